@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+
+# program to compare sending messages one at a time with 'send' and receiving
+# them with 'receive' to sending them in batches with 'send_many' and
+# receiving them with 'receive_batch'. Many producers send messages to an
+# aggregator coroutine.
+
+# Optional arguments are number of producers, number of messages each
+# producer sends and batch size.
+
+import sys, time
+import asyncoro
+
+
+def producer_proc(aggregator, n, batch, coro=None):
+    yield coro.sleep(0.1)
+    if batch > 1:
+        for i in range(0, n, batch):
+            aggregator.send_many(list(range(i, min(i + batch, n))))
+            yield
+    else:
+        for i in range(n):
+            aggregator.send(i)
+            yield
+
+
+def aggregator_proc(n, batch, coro=None):
+    total = 0
+    received = 0
+    start = None
+    while received < n:
+        if batch > 1:
+            msgs = yield coro.receive_batch(batch)
+            received += len(msgs)
+            total += sum(msgs)
+        else:
+            msg = yield coro.receive()
+            received += 1
+            total += msg
+        if start is None:
+            start = time.time()
+    print('batch size %d: %d messages in %.3f sec' % (batch, n, time.time() - start))
+
+
+if __name__ == '__main__':
+    producers = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    n = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+    batch = int(sys.argv[3]) if len(sys.argv) > 3 else 100
+
+    for size in (1, batch):
+        aggregator = asyncoro.Coro(aggregator_proc, producers * n, size)
+        for i in range(producers):
+            asyncoro.Coro(producer_proc, aggregator, n, size)
+        aggregator.value()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+
+# program to measure cost of calling (sub-)generator functions from
+# coroutines. First a coroutine recursively calls generator functions (that
+# don't suspend) to given depth many times; then messages are exchanged over a
+# socket pair with 'send_msg' / 'recv_msg', each of which calls other
+# generator methods.
+
+# Optional arguments are number of calls, depth of recursion and number of
+# messages.
+
+import sys, time, socket
+import asyncoro
+
+
+def nested(depth):
+    if depth > 0:
+        yield nested(depth - 1)
+
+
+def calls_proc(n, depth, coro=None):
+    start = time.time()
+    for i in range(n):
+        yield nested(depth)
+    print('%d calls of depth %d: %.3f sec' % (n, depth, time.time() - start))
+
+
+def sender_proc(conn, n, coro=None):
+    msg = 'message'.encode()
+    for i in range(n):
+        yield conn.send_msg(msg)
+    yield conn.send_msg(''.encode())
+    conn.close()
+
+
+def receiver_proc(conn, n, coro=None):
+    start = time.time()
+    while True:
+        msg = yield conn.recv_msg()
+        if not msg:
+            break
+    conn.close()
+    print('%d messages with send_msg / recv_msg: %.3f sec' % (n, time.time() - start))
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    depth = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    msgs = int(sys.argv[3]) if len(sys.argv) > 3 else 100000
+
+    asyncoro.Coro(calls_proc, n, depth).value()
+
+    sock1, sock2 = socket.socketpair()
+    receiver = asyncoro.Coro(receiver_proc, asyncoro.AsyncSocket(sock1), msgs)
+    asyncoro.Coro(sender_proc, asyncoro.AsyncSocket(sock2), msgs)
+    receiver.value()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+
+# program to show how conflating messages helps a slow consumer coroutine that
+# is only interested in latest value of each item. A producer broadcasts price
+# updates of instruments over a channel faster than consumer can process them.
+# Without conflation, consumer processes every (stale) update; with conflation
+# (see 'set_conflate' in Coro and 'conflate' in 'subscribe' of Channel), a
+# queued update for an instrument is replaced by newer update for it.
+
+# Optional arguments are number of updates and number of instruments.
+
+import sys, time
+import asyncoro
+from asyncoro import Coro
+
+
+def consumer_proc(channel, conflate, producer, coro=None):
+    if conflate:
+        yield channel.subscribe(coro, conflate=lambda update: update[0])
+    else:
+        yield channel.subscribe(coro)
+    producer.send('ready')
+    prices = {}
+    processed = 0
+    max_depth = 0
+    while True:
+        depth = coro.mailbox_stats()[0]
+        if depth > max_depth:
+            max_depth = depth
+        instrument, price = yield coro.receive()
+        if instrument is None:
+            break
+        processed += 1
+        prices[instrument] = price
+        # processing an update takes a while
+        for i in range(10):
+            yield
+    yield channel.unsubscribe(coro)
+    producer.send((prices, processed, max_depth, coro.mailbox_stats()[3]))
+
+
+def producer_proc(n, instruments, conflate, coro=None):
+    channel = asyncoro.Channel('prices-%s' % conflate)
+    Coro(consumer_proc, channel, conflate, coro)
+    yield coro.receive()
+    start = time.time()
+    for i in range(n):
+        channel.send((i % instruments, i))
+        yield
+    channel.send((None, None))
+    prices, processed, max_depth, conflated = yield coro.receive()
+    assert prices == dict((i % instruments, i) for i in range(max(n - instruments, 0), n))
+    print('conflate %-5s: processed %6d updates (%6d conflated, max depth %6d) in %.3f sec' %
+          (conflate, processed, conflated, max_depth, time.time() - start))
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    instruments = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+
+    for conflate in (False, True):
+        Coro(producer_proc, n, instruments, conflate).value()
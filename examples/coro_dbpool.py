@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+
+# program to compare AsyncDBCursor with AsyncDBPool (with sqlite3 database).
+# Many coroutines run short queries while a few coroutines run slow queries.
+# With AsyncDBCursor, operations on (shared) cursor are run one at a time, so
+# short queries wait for slow queries to finish; with AsyncDBPool, each
+# coroutine gets a cursor for a connection (run in its own thread), so only
+# coroutines waiting for a connection are delayed. Then a large result is
+# retrieved with 'fetchall' and in batches with 'stream'; with 'stream', first
+# rows are available sooner and next batch is fetched while current batch is
+# processed. 'stats' of pool shows histograms of time coroutines waited for a
+# connection and time queries took.
+
+# Optional arguments are number of coroutines running short queries and number
+# of connections in pool.
+
+import sys, os, time, sqlite3, tempfile
+import asyncoro
+from asyncoro import Coro
+
+slow_query = ('with recursive c(x) as (select 1 union all select x + 1 from c '
+              'where x < 1000000) select sum(x) from c')
+
+
+def short_proc(db, i, coro=None):
+    start = time.time()
+    if isinstance(db, asyncoro.AsyncDBPool):
+        cursor = yield db.cursor()
+        yield cursor.execute('select s from t where i = ?', (i,))
+        row = yield cursor.fetchone()
+        cursor.close()
+    else:
+        thread_pool, conn = db
+        cursor = asyncoro.AsyncDBCursor(thread_pool, conn.cursor())
+        yield cursor.execute('select s from t where i = ?', (i,))
+        row = cursor.fetchone()
+        cursor.close()
+    assert row[0] == 'row %d' % i
+    raise StopIteration(time.time() - start)
+
+
+def slow_proc(db, coro=None):
+    if isinstance(db, asyncoro.AsyncDBPool):
+        cursor = yield db.cursor()
+        yield cursor.execute(slow_query)
+        yield cursor.fetchone()
+        cursor.close()
+    else:
+        thread_pool, conn = db
+        cursor = asyncoro.AsyncDBCursor(thread_pool, conn.cursor())
+        yield cursor.execute(slow_query, ())
+        cursor.fetchone()
+        cursor.close()
+
+
+def client_proc(path, n, num_conns, coro=None):
+    if num_conns:
+        pool = db = asyncoro.AsyncDBPool(num_conns, sqlite3.connect, path)
+        name = 'AsyncDBPool(%d)' % num_conns
+    else:
+        # connection can't be used in parallel, so one thread is used
+        thread_pool = asyncoro.AsyncThreadPool(1)
+        conn = sqlite3.connect(path, check_same_thread=False)
+        db = (thread_pool, conn)
+        pool = None
+        name = 'AsyncDBCursor'
+    start = time.time()
+    slow = [Coro(slow_proc, db) for i in range(2)]
+    latencies = yield asyncoro.gather([Coro(short_proc, db, i) for i in range(n)])
+    yield asyncoro.gather(slow)
+    print('%-16s: %d short queries, average latency %.3f sec, max %.3f sec, total %.3f sec' %
+          (name, n, sum(latencies) / n, max(latencies), time.time() - start))
+    if not pool:
+        thread_pool.terminate()
+        conn.close()
+        raise StopIteration
+
+    for batch in (0, 1000):
+        cursor = yield pool.cursor()
+        start = time.time()
+        yield cursor.execute('select i, s from t')
+        first = rows = 0
+        if batch:
+            results = cursor.stream(batch)
+            while True:
+                result = yield results.get()
+                if not result:
+                    break
+                if not first:
+                    first = time.time() - start
+                rows += len(result)
+                # simulate processing rows
+                yield coro.sleep(0.001)
+            how = 'stream(%d)' % batch
+        else:
+            result = yield cursor.fetchall()
+            first = time.time() - start
+            rows = len(result)
+            for i in range(0, rows, 1000):
+                yield coro.sleep(0.001)
+            how = 'fetchall'
+        cursor.close()
+        print('%-16s: %d rows, first rows in %.3f sec, total %.3f sec' %
+              (how, rows, first, time.time() - start))
+
+    stats = pool.stats()
+    pool.terminate()
+    for hist in ('wait', 'latency'):
+        print('  %-8s: %s' % (hist, ', '.join('%s: %d' % ('<= %gs' % bound if bound else 'more',
+                                                           count)
+                                              for bound, count in stats[hist])))
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    num_conns = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+
+    path = os.path.join(tempfile.mkdtemp(), 'coro_dbpool.db')
+    conn = sqlite3.connect(path)
+    conn.execute('create table t (i integer primary key, s text)')
+    conn.executemany('insert into t values (?, ?)', (((i, 'row %d' % i) for i in range(200000))))
+    conn.commit()
+    conn.close()
+
+    for conns in (0, num_conns):
+        Coro(client_proc, path, n, conns).value()
+    os.remove(path)
+    os.rmdir(os.path.dirname(path))
@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+
+# program to compare ways of waiting for results of many coroutines that
+# finish in random order: with 'finish' on each coroutine in turn, results
+# are processed in order of creation, so a result that is ready early waits
+# until results of all coroutines created before it are processed; with
+# 'gather', all results are returned together; with 'as_completed', results
+# are processed in order of completion, as soon as each coroutine finishes.
+# Latency is time between a coroutine finishing and its result being
+# processed.
+
+# Optional argument is number of coroutines.
+
+import sys, time, random
+import asyncoro
+from asyncoro import Coro
+
+
+def worker_proc(delay, coro=None):
+    yield coro.sleep(delay)
+    raise StopIteration(time.time())
+
+
+def client_proc(n, how, coro=None):
+    random.seed(n)
+    coros = [Coro(worker_proc, random.uniform(0, 2)) for i in range(n)]
+    start = time.time()
+    latency = 0
+    if how == 'finish':
+        for worker in coros:
+            done = yield worker.finish()
+            latency += time.time() - done
+    elif how == 'gather':
+        results = yield asyncoro.gather(coros)
+        now = time.time()
+        for done in results:
+            latency += now - done
+    else:
+        completions = asyncoro.as_completed(coros)
+        del coros
+        while completions.remaining():
+            worker, done = yield completions.get()
+            latency += time.time() - done
+    print('%-12s: %d coroutines in %.3f sec, average latency %.3f sec' %
+          (how, n, time.time() - start, latency / n))
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+
+    for how in ('finish', 'gather', 'as_completed'):
+        Coro(client_proc, n, how).value()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+
+# program to measure cost of contention for a lock: many coroutines repeatedly
+# acquire a lock, hold it for a while (so other coroutines queue up waiting for
+# it) and release it. With Lock, every coroutine eventually gets the lock; with
+# Semaphore (with value 1), half of coroutines use short timeout, so they give
+# up waiting (while in the middle of queue of waiting coroutines) and try
+# again. Time per acquire should remain (mostly) same as number of coroutines
+# increases, i.e., total time is linear in number of coroutines.
+
+# Optional arguments are (maximum) number of coroutines and number of times
+# each coroutine acquires lock.
+
+import sys, time
+import asyncoro
+from asyncoro import Coro
+
+
+def contender_proc(lock, rounds, timeout, client, coro=None):
+    acquired = timedout = 0
+    for i in range(rounds):
+        if timeout is None:
+            locked = yield lock.acquire()
+        else:
+            locked = yield lock.acquire(timeout=timeout)
+        if locked:
+            # hold lock so others wait for it
+            yield
+            lock.release()
+            acquired += 1
+        else:
+            timedout += 1
+    client.send((acquired, timedout))
+
+
+def client_proc(n, rounds, timeout, coro=None):
+    if timeout is None:
+        lock = asyncoro.Lock()
+    else:
+        lock = asyncoro.Semaphore(1)
+    contenders = [Coro(contender_proc, lock, rounds, timeout if (i % 2) else None, coro)
+                  for i in range(n)]
+    start = time.time()
+    acquired = timedout = 0
+    for contender in contenders:
+        result = yield coro.receive()
+        acquired += result[0]
+        timedout += result[1]
+    elapsed = time.time() - start
+    assert (acquired + timedout) == (n * rounds)
+    print('%-9s %6d coroutines: %7d acquired, %7d timedout in %.3f sec (%.2f usec / acquire)' %
+          (lock.__class__.__name__ + ':', n, acquired, timedout, elapsed,
+           1e6 * elapsed / (n * rounds)))
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+
+    for timeout in (None, 0.005):
+        for count in (n // 8, n // 4, n // 2, n):
+            Coro(client_proc, count, rounds, timeout).value()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+
+# program to show how a bounded mailbox limits number of messages queued for
+# a slow consumer coroutine when a fast producer sends messages to it. With
+# unbounded mailbox (default), messages pile up; with bounded mailbox, the
+# producer is blocked in 'deliver', or messages are dropped / refused, as per
+# mailbox's policy.
+
+# Optional arguments are number of messages and capacity of mailbox.
+
+import sys, time
+import asyncoro
+from asyncoro import Coro
+
+
+def consumer_proc(producer, coro=None):
+    # consumer is slower than producer: it processes one message for every
+    # 10 messages producer sends
+    received = 0
+    while True:
+        msg = yield coro.receive()
+        if msg is None:
+            break
+        received += 1
+        for i in range(10):
+            yield
+    producer.send(received)
+
+
+def producer_proc(n, capacity, overflow, coro=None):
+    consumer = Coro(consumer_proc, coro)
+    if capacity:
+        consumer.set_mailbox(capacity, overflow)
+    max_depth = 0
+    start = time.time()
+    for i in range(n):
+        if overflow == Coro.MailboxBlock:
+            yield consumer.deliver(i)
+        else:
+            consumer.send(i)
+            yield
+        depth = consumer.mailbox_stats()[0]
+        if depth > max_depth:
+            max_depth = depth
+    depth, dropped, refused = consumer.mailbox_stats()[:3]
+    consumer.set_mailbox(None)
+    consumer.send(None)
+    received = yield coro.receive()
+    print('%-18s max depth: %6d, received: %6d, dropped: %6d, refused: %6d, %.3f sec' %
+          (policies[overflow] if capacity else 'unbounded', max_depth, received,
+           dropped, refused, time.time() - start))
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    capacity = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+
+    policies = {Coro.MailboxBlock: 'MailboxBlock', Coro.MailboxReject: 'MailboxReject',
+                Coro.MailboxDropOldest: 'MailboxDropOldest',
+                Coro.MailboxDropNewest: 'MailboxDropNewest'}
+    Coro(producer_proc, n, None, Coro.MailboxReject).value()
+    for overflow in sorted(policies):
+        Coro(producer_proc, n, capacity, overflow).value()
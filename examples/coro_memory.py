@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+
+# program to measure memory used per idle coroutine. Many coroutines are
+# created that each suspend themselves right away (without receiving messages,
+# calling other generators or being monitored), and memory allocated for them
+# is reported. With Python 3, memory is measured with 'tracemalloc' module;
+# with Python 2, sizes (with 'sys.getsizeof') of objects tracked by garbage
+# collector (coroutines, generators, frames, containers etc.) are added, which
+# doesn't include some objects (such as strings), but shows memory used by
+# each coroutine.
+
+# Optional argument is number of coroutines.
+
+import sys, gc
+import asyncoro
+
+
+def idle_proc(coro=None):
+    yield coro.suspend()
+
+
+def memory():
+    try:
+        import tracemalloc
+    except ImportError:
+        return sum(sys.getsizeof(obj) for obj in gc.get_objects())
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+    return tracemalloc.get_traced_memory()[0]
+
+
+def main_proc(n, coro=None):
+    gc.collect()
+    start = memory()
+    coros = [asyncoro.Coro(idle_proc) for i in range(n)]
+    # this coroutine runs again after all the coroutines created above have
+    # run (and suspended themselves)
+    yield
+    gc.collect()
+    used = memory() - start
+    print('%d idle coroutines: %d bytes per coroutine' % (n, used / n))
+    for idle in coros:
+        idle.resume()
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    memory()
+    asyncoro.Coro(main_proc, n).value()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+
+# program to compare cost of calling (sub-)generators from coroutines in
+# legacy style (where sub-generator is called with 'yield' and asyncoro's
+# scheduler runs it) with native style (where sub-generator is called with
+# 'yield from', or native coroutine is called with 'await', so Python
+# interpreter runs it). This program requires Python 3.5 or later.
+
+# Optional arguments are number of calls and depth of recursion.
+
+import sys, time
+import asyncoro
+
+
+def legacy_add(depth):
+    if depth == 0:
+        yield
+        return 1
+    v = yield legacy_add(depth - 1)
+    return v + 1
+
+
+def yield_from_add(depth):
+    if depth == 0:
+        yield
+        return 1
+    v = yield from yield_from_add(depth - 1)
+    return v + 1
+
+
+async def await_add(depth, coro):
+    if depth == 0:
+        await coro.async_sleep(0)
+        return 1
+    v = await await_add(depth - 1, coro)
+    return v + 1
+
+
+def legacy_proc(n, depth, coro=None):
+    start = time.time()
+    for i in range(n):
+        assert (yield legacy_add(depth)) == depth + 1
+    print('legacy (yield):     %d calls of depth %d: %.3f sec' % (n, depth, time.time() - start))
+
+
+def yield_from_proc(n, depth, coro=None):
+    start = time.time()
+    for i in range(n):
+        assert (yield from yield_from_add(depth)) == depth + 1
+    print('native (yield from): %d calls of depth %d: %.3f sec' % (n, depth, time.time() - start))
+
+
+async def await_proc(n, depth, coro=None):
+    start = time.time()
+    for i in range(n):
+        assert (await await_add(depth, coro)) == depth + 1
+    print('native (await):     %d calls of depth %d: %.3f sec' % (n, depth, time.time() - start))
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    depth = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+
+    asyncoro.Coro(legacy_proc, n, depth).value()
+    asyncoro.Coro(yield_from_proc, n, depth).value()
+    asyncoro.Coro(await_proc, n, depth).value()
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+
+# program to measure latency of a (heartbeat) coroutine that wakes up
+# periodically, while many background coroutines keep scheduler busy. Heartbeat
+# coroutine is run with normal priority first and then with high priority; with
+# high priority it doesn't wait for background coroutines that are ready to
+# run, so its latency stays low.
+
+# Optional arguments are number of background coroutines, number of heartbeats
+# and CPU time (in micro seconds) each background coroutine takes per step.
+
+import sys, time
+import asyncoro
+
+
+def busy_proc(work, coro=None):
+    coro.set_daemon()
+    while True:
+        end = time.time() + work
+        while time.time() < end:
+            pass
+        yield
+
+
+def heartbeat_proc(beats, interval, coro=None):
+    latencies = []
+    for i in range(beats):
+        start = time.time()
+        yield coro.sleep(interval)
+        latencies.append(time.time() - start - interval)
+    latencies.sort()
+    raise StopIteration(latencies)
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    beats = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    work = (int(sys.argv[3]) if len(sys.argv) > 3 else 20) / 1e6
+
+    # background coroutines are daemons, so they don't need to be terminated
+    for i in range(n):
+        asyncoro.Coro(busy_proc, work)
+    for priority, name in [(asyncoro.Coro.NormalPriority, 'normal'),
+                           (asyncoro.Coro.HighPriority, 'high')]:
+        heartbeat = asyncoro.Coro(heartbeat_proc, beats, 0.01)
+        heartbeat.priority = priority
+        latencies = heartbeat.value()
+        print('%d busy coroutines, heartbeat with %s priority: latency p50 %.2f ms, '
+              'p99 %.2f ms, max %.2f ms' %
+              (n, name, 1e3 * latencies[len(latencies) // 2],
+               1e3 * latencies[(99 * len(latencies)) // 100], 1e3 * latencies[-1]))
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+# program to compare AsyncThreadPool with AsyncProcessPool for CPU-bound tasks
+# (repeatedly hashing small data, so GIL is held all the time): with threads,
+# tasks don't run in parallel (and compete with scheduler for GIL, so a
+# coroutine that wakes up periodically is delayed), whereas with processes,
+# tasks run in parallel on as many CPUs as available. With 'map' (and larger
+# chunks), cost of sending tasks to processes is reduced. Finally, large
+# (bytes) data is hashed in processes, first serialized and then passed
+# through shared memory (with Python 3.8 and above).
+
+# Optional arguments are number of tasks and number of threads / processes.
+
+import sys, time, hashlib
+import asyncoro
+from asyncoro import Coro
+
+
+def task(i, rounds=2000):
+    digest = str(i).encode()
+    for j in range(rounds):
+        digest = hashlib.sha1(digest).digest()
+    return digest
+
+
+def hash_data(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+def ticker_proc(delays, coro=None):
+    # measure how late this coroutine wakes up while tasks are running
+    coro.set_daemon()
+    while True:
+        start = time.time()
+        yield coro.sleep(0.01)
+        delays.append(time.time() - start - 0.01)
+
+
+def task_proc(pool, i, coro=None):
+    if isinstance(pool, asyncoro.AsyncProcessPool):
+        value = yield pool.run(task, i)
+    else:
+        value = yield pool.async_task(task, i)
+    raise StopIteration(value)
+
+
+def client_proc(pool, n, chunksize, coro=None):
+    delays = []
+    ticker = Coro(ticker_proc, delays)
+    start = time.time()
+    if chunksize:
+        results = pool.map(task, range(n), chunksize=chunksize)
+        done = 0
+        while True:
+            index, value = yield results.get()
+            if index is None:
+                break
+            done += 1
+        assert done == n
+        how = 'map chunksize %d' % chunksize
+    else:
+        yield asyncoro.gather([Coro(task_proc, pool, i) for i in range(n)])
+        how = 'run' if isinstance(pool, asyncoro.AsyncProcessPool) else 'async_task'
+    elapsed = time.time() - start
+    ticker.terminate()
+    print('%-16s %-20s: %d tasks in %.3f sec, max delay of ticker %.3f sec' %
+          (pool.__class__.__name__, how, n, elapsed, max(delays) if delays else 0))
+
+
+def data_proc(pool, shared, size, n, coro=None):
+    data = b'x' * size
+    expected = hash_data(data)
+    start = time.time()
+    for i in range(n):
+        digest = yield pool.run(hash_data, data)
+        assert digest == expected
+    print('%-16s %-20s: %d tasks with %d MB in %.3f sec' %
+          (pool.__class__.__name__, 'shared memory' if shared else 'serialized',
+           n, size >> 20, time.time() - start))
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    num_procs = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+
+    pool = asyncoro.AsyncThreadPool(num_procs)
+    Coro(client_proc, pool, n, 0).value()
+    pool.terminate()
+
+    pool = asyncoro.AsyncProcessPool(num_procs)
+    for chunksize in (0, 1, 50):
+        Coro(client_proc, pool, n, chunksize).value()
+    pool.terminate()
+
+    # shared memory is available with Python 3.8 and above
+    for shm_min_size in ((0, 65536) if sys.version_info >= (3, 8) else (0,)):
+        pool = asyncoro.AsyncProcessPool(num_procs, shm_min_size=shm_min_size)
+        Coro(data_proc, pool, shm_min_size > 0, 32 << 20, 20).value()
+        pool.terminate()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+
+# program to show how bounded Queue limits memory used by a pipeline where a
+# fast stage (producing blocks of data) feeds a slower stage (computing
+# checksum of data). When blocks are sent as messages, they pile up in
+# mailbox of slow stage; with Queue of given size, producer waits in 'put'
+# when queue is full. Consumer gets blocks in batches with 'get_many'.
+
+# Optional arguments are amount of data (in MB) and size of queue.
+
+import sys, time, hashlib
+import asyncoro
+
+
+def checksum_proc(queue, client, coro=None):
+    csum = hashlib.sha1()
+    while True:
+        if queue:
+            blocks = yield queue.get_many(16)
+        else:
+            blocks = yield coro.receive_batch(16)
+        for block in blocks:
+            if block is None:
+                client.send(csum.hexdigest())
+                return
+            csum.update(block)
+            # this stage is slower than producer
+            for i in range(4):
+                yield
+
+
+def producer_proc(mb, size, coro=None):
+    queue = asyncoro.Queue(size) if size else None
+    consumer = asyncoro.Coro(checksum_proc, queue, coro)
+    max_depth = 0
+    start = time.time()
+    for i in range(mb * 16):
+        block = bytearray(64 * 1024)
+        if queue:
+            yield queue.put(block)
+            depth = queue.qsize()
+        else:
+            consumer.send(block)
+            yield
+            depth = consumer.mailbox_stats()[0]
+        if depth > max_depth:
+            max_depth = depth
+    if queue:
+        yield queue.put(None)
+    else:
+        consumer.send(None)
+    csum = yield coro.receive()
+    print('%-15s: %d MB in %.3f sec, max blocks queued: %d (%.1f MB), checksum %s' %
+          ('queue size %d' % size if size else 'messages', mb, time.time() - start,
+           max_depth, max_depth / 16.0, csum[:8]))
+
+
+if __name__ == '__main__':
+    mb = int(sys.argv[1]) if len(sys.argv) > 1 else 512
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else 32
+
+    asyncoro.Coro(producer_proc, mb, 0).value()
+    asyncoro.Coro(producer_proc, mb, size).value()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+
+# program to compare policies of Router for distributing messages to a pool of
+# worker coroutines when cost of processing messages varies (most messages are
+# cheap, a few are costly). Sending each message to a randomly chosen worker
+# (or with Router.RoundRobin) queues messages behind costly messages, whereas
+# with Router.LeastDepth messages are sent to workers with fewest messages
+# queued, so messages wait less. With Router.ConsistentHash, messages with same
+# key are processed by same worker (so in order); when pool is resized, keys of
+# only a fraction of workers move to new workers. Latency is time between
+# message being sent and worker processing it.
+
+# Optional arguments are number of messages and number of workers.
+
+import sys, time, random
+import asyncoro
+from asyncoro import Coro, Router
+
+
+def worker_proc(client, coro=None):
+    latencies = []
+    last = {}
+    in_order = True
+    while True:
+        msg = yield coro.receive()
+        if msg is None:
+            break
+        key, seq, sent, cost = msg
+        latencies.append(time.time() - sent)
+        if last.get(key, -1) > seq:
+            in_order = False
+        last[key] = seq
+        yield coro.sleep(cost)
+    client.send((latencies, in_order, set(last)))
+
+
+def client_proc(n, num_workers, policy, coro=None):
+    random.seed(n)
+    if policy is None:
+        # hand-rolled pool: send to a worker chosen at random
+        workers = [Coro(worker_proc, coro) for i in range(num_workers)]
+        router = None
+        name = 'random'
+    else:
+        router = Router(worker_proc, num_workers, policy=policy, key=lambda msg: msg[0],
+                        args=(coro,))
+        workers = router.workers()
+        name = {Router.RoundRobin: 'RoundRobin', Router.LeastDepth: 'LeastDepth',
+                Router.ConsistentHash: 'ConsistentHash'}[policy]
+    start = time.time()
+    for i in range(n):
+        cost = 0.03 if random.random() < 0.1 else 0.001
+        msg = (i % 100, i, time.time(), cost)
+        if router:
+            router.send(msg)
+        else:
+            random.choice(workers).send(msg)
+        if policy == Router.ConsistentHash and i == n // 2:
+            # grow pool halfway; only keys that move to new worker change owner
+            router.resize(num_workers + 1)
+            workers = router.workers()
+        if i % 3 == 2:
+            yield coro.sleep(0.001)
+    for worker in workers:
+        worker.send(None)
+    latencies = []
+    in_order = True
+    owners = {}
+    for worker in workers:
+        result = yield coro.receive()
+        latencies.extend(result[0])
+        in_order = in_order and result[1]
+        for key in result[2]:
+            owners[key] = owners.get(key, 0) + 1
+    assert len(latencies) == n
+    latencies.sort()
+    print('%-14s: %d messages in %.3f sec, latency average %.4f, 99%% %.4f, max %.4f sec%s' %
+          (name, n, time.time() - start, sum(latencies) / n, latencies[int(0.99 * n)],
+           latencies[-1], (', in order: %s, keys moved: %s / 100' %
+                           (in_order, sum(1 for count in owners.values() if count > 1)))
+           if policy == Router.ConsistentHash else ''))
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    num_workers = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+
+    for policy in (None, Router.RoundRobin, Router.LeastDepth, Router.ConsistentHash):
+        Coro(client_proc, n, num_workers, policy).value()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+# program to compare Lock with RWLock for protecting a read-mostly cache shared
+# by many coroutines. Readers hold lock while they (simulate) suspend for I/O;
+# with Lock, readers are serialized, whereas with RWLock they proceed
+# concurrently, except when a writer holds the lock. With 'prefer_writer',
+# writers don't wait for all (continuously arriving) readers to finish. All
+# coroutines start together after reaching a Barrier and client waits for them
+# to finish with a CountDownLatch.
+
+# Optional arguments are number of readers, number of writers and number of
+# times each coroutine reads / writes.
+
+import sys, time
+import asyncoro
+from asyncoro import Coro
+
+
+def reader_proc(cache, lock, rounds, barrier, latch, coro=None):
+    yield barrier.wait()
+    for i in range(rounds):
+        if isinstance(lock, asyncoro.RWLock):
+            yield lock.acquire_read()
+        else:
+            yield lock.acquire()
+        value = cache['value']
+        yield coro.sleep(0.001)
+        assert cache['value'] == value
+        if isinstance(lock, asyncoro.RWLock):
+            lock.release_read()
+        else:
+            lock.release()
+        yield
+    latch.count_down()
+
+
+def writer_proc(cache, lock, rounds, barrier, latch, stats, coro=None):
+    yield barrier.wait()
+    for i in range(rounds):
+        yield coro.sleep(0.01)
+        start = time.time()
+        if isinstance(lock, asyncoro.RWLock):
+            yield lock.acquire_write()
+        else:
+            yield lock.acquire()
+        stats.append(time.time() - start)
+        cache['value'] += 1
+        yield coro.sleep(0.001)
+        if isinstance(lock, asyncoro.RWLock):
+            lock.release_write()
+        else:
+            lock.release()
+    latch.count_down()
+
+
+def client_proc(lock, readers, writers, rounds, coro=None):
+    cache = {'value': 0}
+    barrier = asyncoro.Barrier(readers + writers)
+    latch = asyncoro.CountDownLatch(readers + writers)
+    stats = []
+    start = time.time()
+    for i in range(readers):
+        Coro(reader_proc, cache, lock, rounds, barrier, latch)
+    for i in range(writers):
+        Coro(writer_proc, cache, lock, rounds // 10, barrier, latch, stats)
+    yield latch.wait()
+    assert cache['value'] == writers * (rounds // 10)
+    if isinstance(lock, asyncoro.RWLock):
+        name = 'RWLock(%s)' % ('prefer_writer' if lock._prefer_writer else '')
+    else:
+        name = 'Lock'
+    print('%-21s: %d readers, %d writers in %.3f sec, max writer wait %.3f sec' %
+          (name, readers, writers, time.time() - start, max(stats) if stats else 0))
+
+
+if __name__ == '__main__':
+    readers = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    writers = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+    rounds = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+
+    for lock in (asyncoro.Lock(), asyncoro.RWLock(), asyncoro.RWLock(prefer_writer=True)):
+        Coro(client_proc, lock, readers, writers, rounds).value()
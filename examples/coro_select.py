@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+
+# program to measure cost of selective receive. In first part, producer sends
+# many messages, most of which are 'low' priority messages, and consumer first
+# receives only 'high' priority messages (and later the rest), either by
+# receiving every message and putting aside 'low' priority messages itself, or
+# with categories (CategorizeMessages), where 'low' priority messages are
+# queued in their category without resuming consumer. In second part, client
+# sends requests to server and waits for reply to each request, while also
+# receiving notifications; reply is selected either by receiving every message
+# and putting aside notifications, or with 'match' in 'receive'.
+
+# Optional argument is number of messages.
+
+import sys, time, collections
+import asyncoro
+from asyncoro import Coro
+
+
+def consumer_proc(n, high, how, coro=None):
+    if how == 'categories':
+        categories = asyncoro.CategorizeMessages(coro)
+        categories.add(lambda msg: msg[0])
+    low = collections.deque()
+    start = time.time()
+    for i in range(high):
+        if how == 'categories':
+            msg = yield categories.receive('high')
+        else:
+            while True:
+                msg = yield coro.receive()
+                if msg[0] == 'high':
+                    break
+                low.append(msg)
+        assert msg[0] == 'high'
+    elapsed = time.time() - start
+    for i in range(n - high):
+        if how == 'categories':
+            msg = yield categories.receive('low')
+        elif low:
+            msg = low.popleft()
+        else:
+            msg = yield coro.receive()
+        assert msg[0] == 'low'
+    print('%-10s: %d high priority messages (among %d) in %.3f sec' % (how, high, n, elapsed))
+
+
+def producer_proc(n, how, coro=None):
+    # 10% of messages are high priority
+    consumer = Coro(consumer_proc, n, n // 10, how)
+    yield coro.sleep(0.1)
+    for i in range(n):
+        if (i % 10) == 0:
+            consumer.send(('high', i))
+        else:
+            consumer.send(('low', i))
+        yield
+    yield consumer.finish()
+
+
+def server_proc(coro=None):
+    while True:
+        msg = yield coro.receive()
+        if msg is None:
+            break
+        client, i = msg
+        # client gets a few notifications before reply
+        for j in range(5):
+            client.send(('notification', j))
+        client.send(('reply', i))
+
+
+def client_proc(n, how, coro=None):
+    server = Coro(server_proc)
+    notifications = collections.deque()
+    start = time.time()
+    for i in range(n):
+        server.send((coro, i))
+        if how == 'match':
+            reply = yield coro.receive(match=lambda msg: msg[0] == 'reply')
+        else:
+            while True:
+                reply = yield coro.receive()
+                if reply[0] == 'reply':
+                    break
+                notifications.append(reply)
+        assert reply == ('reply', i)
+        # process notifications received so far
+        if how == 'match':
+            notifications = yield coro.receive_batch(10, timeout=0)
+        else:
+            notifications.clear()
+    print('%-10s: %d requests in %.3f sec' % (how, n, time.time() - start))
+    server.send(None)
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    for how in ('dispatch', 'categories'):
+        Coro(producer_proc, n, how).value()
+    for how in ('dispatch', 'match'):
+        Coro(client_proc, n // 10, how).value()
@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+
+# program to compare time to create many coroutines in a loop (as done in
+# perf.py) with creating them with 'spawn_many'. The coroutines exchange
+# messages with a server coroutine, as in perf.py.
+
+# Optional argument is number of coroutines.
+
+import sys, time
+import asyncoro
+
+
+def client_proc(i, server, coro=None):
+    # wait until all coroutines are created
+    yield coro.sleep(1)
+    server.send(i)
+
+
+def server_proc(n, coro=None):
+    for i in range(n):
+        yield coro.receive()
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    server = asyncoro.Coro(server_proc, n)
+    start = time.time()
+    for i in range(n):
+        asyncoro.Coro(client_proc, i, server)
+    print('creating %d coroutines in a loop took %.3f sec' % (n, time.time() - start))
+    server.value()
+
+    server = asyncoro.Coro(server_proc, n)
+    start = time.time()
+    asyncoro.Coro.spawn_many(client_proc, [(i, server) for i in range(n)])
+    print('creating %d coroutines with spawn_many took %.3f sec' % (n, time.time() - start))
+    server.value()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+
+# program to measure cost of running (short) tasks in threads with
+# AsyncThreadPool. Many coroutines submit tasks with 'async_task', first with
+# unbounded queue and then with 'max_queue', where coroutines wait until there
+# is room in queue (so number of pending tasks is bounded). Then same tasks are
+# executed with 'map', with chunks of different sizes (and with results
+# retrieved by more than one coroutine). Completed tasks are
+# delivered to coroutines in batches, so scheduler is woken once per batch
+# instead of once per task; 'stats' of pool shows number of batches.
+
+# Optional arguments are number of tasks and number of threads.
+
+import sys, time, hashlib
+import asyncoro
+from asyncoro import Coro
+
+data = b'x' * 4096
+
+
+def task(i):
+    return hashlib.sha1(data).hexdigest()
+
+
+def task_proc(pool, max_pending, coro=None):
+    max_pending[0] = max(max_pending[0], pool.stats()['pending'])
+    yield pool.async_task(task, 0)
+
+
+def consumer_proc(pool, results, max_pending, coro=None):
+    done = 0
+    while True:
+        index, value = yield results.get()
+        if index is None:
+            break
+        done += 1
+        max_pending[0] = max(max_pending[0], pool.stats()['pending'])
+    raise StopIteration(done)
+
+
+def client_proc(n, num_threads, max_queue, chunksize, consumers, coro=None):
+    pool = asyncoro.AsyncThreadPool(num_threads, max_queue=max_queue)
+    max_pending = [0]
+    start = time.time()
+    if chunksize:
+        results = pool.map(task, range(n), chunksize=chunksize)
+        # results are retrieved by 'consumers' coroutines
+        done = yield asyncoro.gather([Coro(consumer_proc, pool, results, max_pending)
+                                      for i in range(consumers)])
+        assert sum(done) == n
+        how = 'map chunksize %d' % chunksize
+        if consumers > 1:
+            how += ' x %d' % consumers
+    else:
+        coros = [Coro(task_proc, pool, max_pending) for i in range(n)]
+        yield asyncoro.gather(coros)
+        how = 'max_queue %d' % max_queue if max_queue else 'unbounded'
+    elapsed = time.time() - start
+    stats = pool.stats()
+    pool.terminate()
+    print('%-24s: %d tasks in %.3f sec, %d batches, max pending %d, utilization %.2f' %
+          (how, n, elapsed, stats['batches'], max_pending[0], stats['utilization']))
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    num_threads = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+
+    for max_queue, chunksize, consumers in ((0, 0, 1), (16, 0, 1), (0, 1, 1), (0, 100, 1),
+                                            (0, 100, 4)):
+        Coro(client_proc, n, num_threads, max_queue, chunksize, consumers).value()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+
+# program to measure throughput of echo server and clients using asynchronous
+# sockets. Each client sends messages to server and waits for server to echo
+# them back. When data is already available (or send buffer has room),
+# asynchronous socket operations complete without waiting for I/O notifier.
+
+# Optional arguments are number of clients, number of messages each client
+# sends and size of each message in bytes.
+
+import sys, socket, time
+import asyncoro
+
+
+def server_conn_proc(conn, msg_len, coro=None):
+    while True:
+        msg = yield conn.recvall(msg_len)
+        if not msg:
+            break
+        yield conn.sendall(msg)
+    conn.close()
+
+
+def server_proc(n, sock, msg_len, coro=None):
+    for i in range(n):
+        conn, addr = yield sock.accept()
+        asyncoro.Coro(server_conn_proc, conn, msg_len)
+    sock.close()
+
+
+def client_proc(addr, msgs, msg_len, coro=None):
+    sock = asyncoro.AsyncSocket(socket.socket(socket.AF_INET, socket.SOCK_STREAM))
+    yield sock.connect(addr)
+    msg = 'x'.encode() * msg_len
+    for i in range(msgs):
+        yield sock.sendall(msg)
+        yield sock.recvall(msg_len)
+    sock.close()
+
+
+if __name__ == '__main__':
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    msgs = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+    msg_len = int(sys.argv[3]) if len(sys.argv) > 3 else 100
+
+    sock = asyncoro.AsyncSocket(socket.socket(socket.AF_INET, socket.SOCK_STREAM))
+    sock.bind(('127.0.0.1', 0))
+    sock.listen(128)
+    asyncoro.Coro(server_proc, clients, sock, msg_len)
+    start = time.time()
+    coros = [asyncoro.Coro(client_proc, sock.getsockname(), msgs, msg_len)
+             for i in range(clients)]
+    for coro in coros:
+        coro.value()
+    elapsed = time.time() - start
+    print('%d clients, %d messages of %d bytes: %.1f usec per message, %d messages/sec' %
+          (clients, clients * msgs, msg_len, 1e6 * elapsed / (clients * msgs),
+           (clients * msgs) / elapsed))
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+
+# program to measure cost of I/O with sockets that have timeout set, as the
+# number of (idle) sockets with timeouts grows. Each idle socket is a UDP
+# socket waiting to receive (with timeout), so there are as many pending
+# timeouts in the I/O notifier as idle sockets. A client and server exchange
+# messages over TCP socket with timeout set, so each message adds and removes
+# timeouts in the notifier. Time per message should not depend on number of idle
+# sockets.
+
+# Each idle socket uses a file descriptor, so limit on number of open files
+# ('ulimit -n') may need to be increased for large number of sockets.
+
+import sys, socket, time
+import asyncoro
+
+
+def idle_proc(sock, coro=None):
+    sock.settimeout(3600)
+    try:
+        yield sock.recvfrom(128)
+    except:
+        pass
+    sock.close()
+
+
+def server_proc(conn, coro=None):
+    conn.settimeout(10)
+    while True:
+        msg = yield conn.recv_msg()
+        if not msg:
+            break
+        yield conn.send_msg(msg)
+    conn.close()
+
+
+def client_proc(n, conn, msgs, coro=None):
+    conn.settimeout(10)
+    idle_socks = []
+    for i in range(n):
+        sock = asyncoro.AsyncSocket(socket.socket(socket.AF_INET, socket.SOCK_DGRAM))
+        sock.bind(('127.0.0.1', 0))
+        idle_socks.append(sock)
+        asyncoro.Coro(idle_proc, sock)
+    # let idle coroutines start waiting
+    yield coro.sleep(0.1)
+    msg = 'x'.encode() * 100
+    start = time.time()
+    for i in range(msgs):
+        yield conn.send_msg(msg)
+        yield conn.recv_msg()
+    elapsed = time.time() - start
+    print('%6d idle sockets: %.1f usec per message' % (n, 1e6 * elapsed / msgs))
+    yield conn.send_msg(''.encode())
+    conn.close()
+    # wake idle coroutines so they terminate
+    wake = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    for sock in idle_socks:
+        wake.sendto('q'.encode(), sock.getsockname())
+    wake.close()
+
+
+if __name__ == '__main__':
+    msgs = 10000
+    if len(sys.argv) > 1:
+        counts = [int(arg) for arg in sys.argv[1:]]
+    else:
+        counts = [0, 100, 1000, 4000]
+    for n in counts:
+        sock1, sock2 = socket.socketpair()
+        asyncoro.Coro(server_proc, asyncoro.AsyncSocket(sock1))
+        asyncoro.Coro(client_proc, n, asyncoro.AsyncSocket(sock2), msgs).value()
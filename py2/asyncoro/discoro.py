@@ -433,9 +433,7 @@ class Computation(object):
                 else:
                     params = (params,)
             append_coro(Coro(self.run_result, gen, *params))
-        results = [None] * len(coros)
-        for i, coro in enumerate(coros):
-            results[i] = yield coro.finish()
+        results = yield asyncoro.gather(coros)
         raise StopIteration(results)
 
     def enable_node(self, ip_addr, *setup_args):
@@ -19,11 +19,11 @@ import select
 import sys
 import types
 import struct
+import hashlib
 import re
 import errno
 import platform
 import ssl
-from heapq import heappush, heappop
 from bisect import bisect_left
 import queue
 import atexit
@@ -48,6 +48,22 @@ else:
 if sys.version_info >= (3, 3):
     from time import perf_counter as _time
 
+if sys.version_info >= (3, 5):
+    # native coroutines (defined with 'async def') and generators marked
+    # with 'types.coroutine' can be used as coroutines and awaited
+    from types import coroutine as _coroutine
+    _GeneratorTypes = (types.GeneratorType, types.CoroutineType)
+    _iscoroutinefunction = inspect.iscoroutinefunction
+    _CoroutineFlags = inspect.CO_COROUTINE | inspect.CO_ITERABLE_COROUTINE
+else:
+    def _coroutine(func):
+        return func
+    _GeneratorTypes = types.GeneratorType
+
+    def _iscoroutinefunction(func):
+        return False
+    _CoroutineFlags = 0
+
 
 __author__ = "Giridhar Pemmasani (pgiri@yahoo.com)"
 __email__ = "pgiri@yahoo.com"
@@ -60,14 +76,20 @@ __status__ = "Production"
 __version__ = "4.5.6"
 
 __all__ = ['AsyncSocket', 'AsynCoroSocket', 'Coro', 'AsynCoro',
-           'Lock', 'RLock', 'Event', 'Condition', 'Semaphore',
+           'Lock', 'RLock', 'Event', 'Condition', 'Semaphore', 'RWLock',
+           'CountDownLatch', 'Barrier', 'Queue',
+           'gather', 'wait_any', 'as_completed',
            'HotSwapException', 'MonitorException', 'Location', 'Channel',
-           'CategorizeMessages', 'AsyncThreadPool', 'AsyncDBCursor',
+           'CategorizeMessages', 'Router', 'AsyncThreadPool', 'AsyncProcessPool',
+           'AsyncDBCursor', 'AsyncDBPool',
            'Singleton', 'logger', 'serialize', 'deserialize', 'unserialize', 'Logger']
 
 # timeout in seconds used when sending messages
 MsgTimeout = 10
 
+# 'alarm_value' used internally to detect timeout when receiving messages
+_NoMessage = object()
+
 
 def serialize(obj):
     return pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
@@ -78,6 +100,31 @@ def deserialize(pkl):
 unserialize = deserialize
 
 
+@_coroutine
+def _awaitable(value):
+    """Internal use only.
+
+    Methods meant to be used with 'yield' that may suspend coroutine
+    (and return value instead of generator) are used with this for
+    'await' in native coroutines; 'value' is given to scheduler and the
+    value coroutine gets back is returned.
+    """
+    return (yield value)
+
+
+def _is_native(generator):
+    """Internal use only.
+
+    Returns True if 'generator' is native coroutine or generator marked
+    with 'types.coroutine'. As with 'yield from' and 'await', when
+    these finish without value, their value is None (instead of last
+    value sent to them).
+    """
+    if isinstance(generator, types.GeneratorType):
+        return (generator.gi_code.co_flags & _CoroutineFlags) != 0
+    return isinstance(generator, _GeneratorTypes)
+
+
 class Singleton(type):
 
     def __call__(cls, *args, **kwargs):
@@ -170,6 +217,231 @@ class Logger(object):
 logger = Logger('asyncoro')
 
 
+class _Timer(object):
+    """Internal use only. See _TimerWheel.
+    """
+
+    __slots__ = ('expiry', 'tick', 'data', '_slot', '_level')
+
+    def __init__(self, expiry, tick, data):
+        self.expiry = expiry
+        self.tick = tick
+        self.data = data
+        self._slot = None
+        self._level = 0
+
+
+class _TimerWheel(object):
+    """Internal use only.
+
+    Hierarchical timing wheel: Timers are kept in 'levels' wheels of
+    2**'bits' slots each, with each slot of level 0 covering
+    'resolution' seconds and each slot of higher level covering all of
+    the wheel below it. Adding and cancelling a timer are O(1); timers
+    in higher levels are moved (cascaded) to lower levels as time
+    advances. Timers expire at most 'resolution' seconds late.
+    """
+
+    def __init__(self, resolution=0.001, bits=8, levels=4):
+        self._resolution = resolution
+        self._bits = bits
+        self._mask = (1 << bits) - 1
+        self._levels = levels
+        self._wheels = [[set() for i in range(1 << bits)] for level in range(levels)]
+        # number of timers in each level
+        self._counts = [0] * levels
+        self._count = 0
+        # next tick to process
+        self._base = int(_time() / resolution)
+
+    def __len__(self):
+        return self._count
+
+    def add(self, expiry, data):
+        """Add timer that expires at 'expiry' (as per _time). Returned
+        timer can be used to 'cancel' it.
+        """
+        if not self._count:
+            # no timers to expire, so base may be far behind
+            self._base = max(self._base, int(_time() / self._resolution))
+        timer = _Timer(expiry, int(expiry / self._resolution) + 1, data)
+        self._insert(timer)
+        self._count += 1
+        return timer
+
+    def cancel(self, timer):
+        """Remove timer (added with 'add') if it hasn't expired yet.
+        """
+        if timer._slot is not None:
+            timer._slot.discard(timer)
+            timer._slot = None
+            self._counts[timer._level] -= 1
+            self._count -= 1
+
+    def _insert(self, timer):
+        tick = timer.tick
+        delta = tick - self._base
+        if delta > 0:
+            level = (delta.bit_length() - 1) // self._bits
+            if level >= self._levels:
+                # beyond range of wheels; put in farthest slot, from where
+                # it will be cascaded again
+                level = self._levels - 1
+                tick = self._base + (1 << (self._bits * self._levels)) - 1
+        else:
+            tick = self._base
+            level = 0
+        slot = self._wheels[level][(tick >> (self._bits * level)) & self._mask]
+        slot.add(timer)
+        timer._slot = slot
+        timer._level = level
+        self._counts[level] += 1
+
+    def _cascade(self, level):
+        slot = self._wheels[level][(self._base >> (self._bits * level)) & self._mask]
+        if slot:
+            self._counts[level] -= len(slot)
+            timers = list(slot)
+            slot.clear()
+            for timer in timers:
+                self._insert(timer)
+
+    def next_expiry(self):
+        """Time when next timer expires, or when timers in earliest
+        occupied slot of a higher level are to be cascaded. Returns None
+        if there are no timers.
+        """
+        if not self._count:
+            return None
+        base = self._base
+        mask = self._mask
+        expiry = None
+        if self._counts[0]:
+            wheel = self._wheels[0]
+            for tick in range(base, base + mask + 1):
+                if wheel[tick & mask]:
+                    expiry = tick
+                    break
+        for level in range(1, self._levels):
+            if not self._counts[level]:
+                continue
+            shift = self._bits * level
+            current = base >> shift
+            # slot of 'current' is cascaded at 'base' only if base is at
+            # its boundary; otherwise, it is cascaded after a full turn
+            if (current << shift) == base:
+                start = current
+            else:
+                start = current + 1
+            if expiry is not None and (start << shift) >= expiry:
+                # higher levels are cascaded even later
+                break
+            wheel = self._wheels[level]
+            for index in range(start, current + mask + 2):
+                if wheel[index & mask]:
+                    if expiry is None or (index << shift) < expiry:
+                        expiry = index << shift
+                    break
+        return expiry * self._resolution
+
+    def expire(self, now):
+        """Remove and return list of timers that expire at or before
+        'now'.
+        """
+        now_tick = int(now / self._resolution)
+        if now_tick < self._base:
+            return []
+        expired = []
+        bits = self._bits
+        mask = self._mask
+        while self._base <= now_tick:
+            if not self._count:
+                self._base = now_tick + 1
+                break
+            index = self._base & mask
+            if not index:
+                level = 1
+                while level < self._levels:
+                    self._cascade(level)
+                    if (self._base >> (bits * level)) & mask:
+                        break
+                    level += 1
+            slot = self._wheels[0][index]
+            if slot:
+                self._counts[0] -= len(slot)
+                self._count -= len(slot)
+                for timer in slot:
+                    timer._slot = None
+                expired.extend(slot)
+                slot.clear()
+            self._base += 1
+            # skip over empty slots to next boundary where timers in
+            # (non-empty) higher level are cascaded
+            level = 0
+            while level < self._levels and not self._counts[level]:
+                level += 1
+            if level:
+                shift = bits * level
+                self._base = min(now_tick + 1, (((self._base - 1) >> shift) + 1) << shift)
+        return expired
+
+
+class _ReadyQueue(object):
+    """Internal use only.
+
+    Run queue of coroutines in _Scheduled state, with a FIFO queue for
+    each priority (see Coro.priority). Coroutines in higher priority
+    queue are run first, but a lower priority queue that has been
+    passed over 'aging' times is served once, so lower priority
+    coroutines are not starved. Coroutines are appended with
+    scheduler's lock held, but (only) scheduler pops them without lock.
+    """
+
+    __slots__ = ('_queues', '_high', '_normal', '_low', '_skipped', '_aging')
+
+    def __init__(self, aging=8):
+        self._high = collections.deque()
+        self._normal = collections.deque()
+        self._low = collections.deque()
+        # indexed by priority
+        self._queues = (self._high, self._normal, self._low)
+        self._skipped = [0, 0, 0]
+        self._aging = aging
+
+    def append(self, coro):
+        self._queues[coro._priority].append(coro)
+
+    def remove(self, coro):
+        self._queues[coro._priority].remove(coro)
+
+    def popleft(self):
+        if not self._high and not self._low:
+            # all coroutines have normal priority (common case)
+            return self._normal.popleft()
+        queues = self._queues
+        skipped = self._skipped
+        chosen = None
+        for level in range(3):
+            if not queues[level]:
+                continue
+            if chosen is None:
+                chosen = level
+            else:
+                skipped[level] += 1
+                if skipped[level] >= self._aging:
+                    chosen = level
+        skipped[chosen] = 0
+        return queues[chosen].popleft()
+
+    def clear(self):
+        for queue in self._queues:
+            queue.clear()
+        self._skipped = [0, 0, 0]
+
+    def __len__(self):
+        return len(self._high) + len(self._normal) + len(self._low)
+
+
 class _AsyncSocket(object):
     """Base class for use with AsynCoro, for asynchronous I/O
     completion and coroutines. This class is for internal use
@@ -413,6 +685,17 @@ class _AsyncSocket(object):
         if self._read_task:
             self._read_task()
 
+    @staticmethod
+    def _would_block(exc):
+        """Internal use only.
+
+        Returns True if exception raised by an operation on non-blocking
+        socket indicates the operation can't be completed yet.
+        """
+        if isinstance(exc, ssl.SSLError):
+            return exc.errno in (ssl.SSL_ERROR_WANT_READ, ssl.SSL_ERROR_WANT_WRITE)
+        return isinstance(exc, socket.error) and exc.errno in (errno.EAGAIN, EWOULDBLOCK)
+
     def _async_recv(self, bufsize, *args):
         """Internal use only; use 'recv' with 'yield' instead.
 
@@ -422,6 +705,8 @@ class _AsyncSocket(object):
             try:
                 buf = self._rsock.recv(bufsize, *args)
             except:
+                if _AsyncSocket._would_block(sys.exc_info()[1]):
+                    return
                 self._read_task = None
                 self._notifier.clear(self, _AsyncPoller._Read)
                 self._read_coro.throw(*sys.exc_info())
@@ -430,6 +715,13 @@ class _AsyncSocket(object):
                 self._notifier.clear(self, _AsyncPoller._Read)
                 self._read_coro._proceed_(buf)
 
+        # if data is already available, return it without waiting for poller
+        try:
+            return self._rsock.recv(bufsize, *args)
+        except socket.error as exc:
+            if not _AsyncSocket._would_block(exc):
+                raise
+
         if not self._asyncoro:
             self._asyncoro = AsynCoro.scheduler()
             self._notifier = self._asyncoro._notifier
@@ -438,18 +730,6 @@ class _AsyncSocket(object):
         self._read_coro._await_()
         self._read_task = _recv
         self._notifier.add(self, _AsyncPoller._Read)
-        if self._certfile and self._rsock.pending():
-            try:
-                buf = self._rsock.recv(bufsize, *args)
-            except:
-                self._read_task = None
-                self._notifier.clear(self, _AsyncPoller._Read)
-                self._read_coro.throw(*sys.exc_info())
-            else:
-                if buf:
-                    self._read_task = None
-                    self._notifier.clear(self, _AsyncPoller._Read)
-                    self._read_coro._proceed_(buf)
 
     def _async_recvall(self, bufsize, *args):
         """Internal use only; use 'recvall' with 'yield' instead.
@@ -465,6 +745,8 @@ class _AsyncSocket(object):
             try:
                 recvd = self._rsock.recv_into(view, len(view), *args)
             except:
+                if _AsyncSocket._would_block(sys.exc_info()[1]):
+                    return
                 view.release()
                 self._read_task = self._read_result = None
                 self._notifier.clear(self, _AsyncPoller._Read)
@@ -491,6 +773,26 @@ class _AsyncSocket(object):
 
         self._read_result = bytearray(bufsize)
         view = memoryview(self._read_result)
+        # receive data that is already available before waiting for poller
+        try:
+            recvd = self._rsock.recv_into(view, len(view), *args)
+        except socket.error as exc:
+            if not _AsyncSocket._would_block(exc):
+                view.release()
+                self._read_result = None
+                raise
+        else:
+            if recvd == bufsize:
+                view.release()
+                buf, self._read_result = self._read_result, None
+                return buf
+            elif recvd:
+                view = view[recvd:]
+            else:
+                view.release()
+                self._read_result = None
+                return b''
+
         if not self._asyncoro:
             self._asyncoro = AsynCoro.scheduler()
             self._notifier = self._asyncoro._notifier
@@ -499,23 +801,6 @@ class _AsyncSocket(object):
         self._read_coro._await_()
         self._read_task = partial_func(_recvall, self, view)
         self._notifier.add(self, _AsyncPoller._Read)
-        if self._certfile and self._rsock.pending():
-            try:
-                recvd = self._rsock.recv_into(view, len(view), *args)
-            except:
-                self._read_task = self._read_result = None
-                self._notifier.clear(self, _AsyncPoller._Read)
-                self._read_coro.throw(*sys.exc_info())
-            else:
-                if recvd == bufsize:
-                    view.release()
-                    buf = self._read_result
-                    self._read_task = self._read_result = None
-                    self._notifier.clear(self, _AsyncPoller._Read)
-                    self._read_coro._proceed_(buf)
-                elif recvd:
-                    view = view[recvd:]
-                    self._read_task = partial_func(_recvall, self, view)
 
     def _sync_recvall(self, bufsize, *args):
         """Internal use only; use 'recvall' instead.
@@ -544,6 +829,8 @@ class _AsyncSocket(object):
             try:
                 buf = self._rsock.recvfrom(*args)
             except:
+                if _AsyncSocket._would_block(sys.exc_info()[1]):
+                    return
                 self._read_task = None
                 self._notifier.clear(self, _AsyncPoller._Read)
                 self._read_coro.throw(*sys.exc_info())
@@ -552,6 +839,12 @@ class _AsyncSocket(object):
                 self._notifier.clear(self, _AsyncPoller._Read)
                 self._read_coro._proceed_(buf)
 
+        try:
+            return self._rsock.recvfrom(*args)
+        except socket.error as exc:
+            if not _AsyncSocket._would_block(exc):
+                raise
+
         if not self._asyncoro:
             self._asyncoro = AsynCoro.scheduler()
             self._notifier = self._asyncoro._notifier
@@ -570,6 +863,8 @@ class _AsyncSocket(object):
             try:
                 sent = self._rsock.send(*args)
             except:
+                if _AsyncSocket._would_block(sys.exc_info()[1]):
+                    return
                 self._write_task = None
                 self._notifier.clear(self, _AsyncPoller._Write)
                 self._write_coro.throw(*sys.exc_info())
@@ -578,6 +873,12 @@ class _AsyncSocket(object):
                 self._notifier.clear(self, _AsyncPoller._Write)
                 self._write_coro._proceed_(sent)
 
+        try:
+            return self._rsock.send(*args)
+        except socket.error as exc:
+            if not _AsyncSocket._would_block(exc):
+                raise
+
         if not self._asyncoro:
             self._asyncoro = AsynCoro.scheduler()
             self._notifier = self._asyncoro._notifier
@@ -596,6 +897,8 @@ class _AsyncSocket(object):
             try:
                 sent = self._rsock.sendto(*args)
             except:
+                if _AsyncSocket._would_block(sys.exc_info()[1]):
+                    return
                 self._write_task = None
                 self._notifier.clear(self, _AsyncPoller._Write)
                 self._write_coro.throw(*sys.exc_info())
@@ -604,6 +907,12 @@ class _AsyncSocket(object):
                 self._notifier.clear(self, _AsyncPoller._Write)
                 self._write_coro._proceed_(sent)
 
+        try:
+            return self._rsock.sendto(*args)
+        except socket.error as exc:
+            if not _AsyncSocket._would_block(exc):
+                raise
+
         if not self._asyncoro:
             self._asyncoro = AsynCoro.scheduler()
             self._notifier = self._asyncoro._notifier
@@ -632,7 +941,7 @@ class _AsyncSocket(object):
                     self._write_coro.throw(*sys.exc_info())
             except socket.error as exc:
                 # apparently BSD may raise EAGAIN
-                if exc.errno != errno.EAGAIN:
+                if not _AsyncSocket._would_block(exc):
                     self._write_task = self._write_result = None
                     self._notifier.clear(self, _AsyncPoller._Write)
                     self._write_coro.throw(*sys.exc_info())
@@ -649,11 +958,30 @@ class _AsyncSocket(object):
                         self._write_task = self._write_result = None
                         self._notifier.clear(self, _AsyncPoller._Write)
                         self._write_coro._proceed_(None)
+                    else:
+                        # new task indicates progress to notifier
+                        self._write_task = partial_func(_sendall, self, data_len)
                     # elif self._timeout:
                     #     self._notifier._del_timeout(self)
                     #     self._notifier._add_timeout(self)
 
         self._write_result = memoryview(data)
+        # send as much as socket buffer can take before waiting for poller
+        try:
+            sent = self._rsock.send(self._write_result, *args)
+        except socket.error as exc:
+            if not _AsyncSocket._would_block(exc):
+                self._write_result.release()
+                self._write_result = None
+                raise
+        else:
+            if sent >= len(self._write_result):
+                self._write_result.release()
+                self._write_result = None
+                return None
+            elif sent > 0:
+                self._write_result = self._write_result[sent:]
+
         if not self._asyncoro:
             self._asyncoro = AsynCoro.scheduler()
             self._notifier = self._asyncoro._notifier
@@ -690,6 +1018,8 @@ class _AsyncSocket(object):
             try:
                 conn, addr = self._rsock.accept()
             except:
+                if _AsyncSocket._would_block(sys.exc_info()[1]):
+                    return
                 self._read_task = None
                 self._notifier.clear(self, _AsyncPoller._Read)
                 self._read_coro.throw(*sys.exc_info())
@@ -754,6 +1084,17 @@ class _AsyncSocket(object):
             conn._notifier.add(conn, _AsyncPoller._Read | _AsyncPoller._Write)
             conn._read_task()
 
+        if not self._certfile:
+            # SSL connections need handshake, so they are always accepted
+            # in '_accept'
+            try:
+                conn, addr = self._rsock.accept()
+            except socket.error as exc:
+                if not _AsyncSocket._would_block(exc):
+                    raise
+            else:
+                return (AsyncSocket(conn, blocking=False), addr)
+
         if not self._asyncoro:
             self._asyncoro = AsynCoro.scheduler()
             self._notifier = self._asyncoro._notifier
@@ -762,6 +1103,8 @@ class _AsyncSocket(object):
         self._read_coro._await_()
         self._read_task = _accept
         self._notifier.add(self, _AsyncPoller._Read)
+        if self._certfile:
+            self._read_task()
 
     def _sync_accept(self, *args):
         """Internal use only; use 'accept' instead.
@@ -850,13 +1193,14 @@ class _AsyncSocket(object):
                 self._write_coro._proceed_(None)
                 raise
 
+    @_coroutine
     def _async_send_msg(self, data):
         """Internal use only; use 'send_msg' with 'yield' instead.
 
         Messages are tagged with length of the data, so on the
         receiving side, recv_msg knows how much data to receive.
         """
-        yield self.sendall(struct.pack('>L', len(data)) + data)
+        return (yield self.sendall(struct.pack('>L', len(data)) + data))
 
     def _sync_send_msg(self, data):
         """Internal use only; use 'send_msg' instead.
@@ -865,6 +1209,7 @@ class _AsyncSocket(object):
         """
         return self._sync_sendall(struct.pack('>L', len(data)) + data)
 
+    @_coroutine
     def _async_recv_msg(self):
         """Internal use only; use 'recv_msg' with 'yield' instead.
 
@@ -894,9 +1239,9 @@ class _AsyncSocket(object):
                     raise
             if len(data) != n:
                 raise socket.error(errno.EPIPE, 'Insufficient data: %s / %s' % (len(data), n))
-            raise StopIteration(data)
+            return data
         else:
-            raise StopIteration(b'')
+            return b''
 
     def _sync_recv_msg(self):
         """Internal use only; use 'recv_msg' instead.
@@ -929,12 +1274,43 @@ class _AsyncSocket(object):
         else:
             return b''
 
+    @_coroutine
     def create_connection(self, host_port, timeout=None, source_address=None):
         if timeout is not None:
             self.settimeout(timeout)
         if source_address is not None:
             self._rsock.bind(source_address)
-        yield self.connect(host_port)
+        return (yield self.connect(host_port))
+
+    def async_recv(self, bufsize, *args):
+        """Same as 'recv', but must be used with 'await' as 'data = await
+        sock.async_recv(bufsize)' in native coroutines. Similarly,
+        methods below are versions of 'recvall', 'send' etc. for
+        'await'. 'recv_msg', 'send_msg' and 'create_connection' can be
+        used with 'await' as they are.
+        """
+        return _awaitable(self.recv(bufsize, *args))
+
+    def async_recvall(self, bufsize, *args):
+        return _awaitable(self.recvall(bufsize, *args))
+
+    def async_recvfrom(self, *args):
+        return _awaitable(self.recvfrom(*args))
+
+    def async_send(self, *args):
+        return _awaitable(self.send(*args))
+
+    def async_sendto(self, *args):
+        return _awaitable(self.sendto(*args))
+
+    def async_sendall(self, data, *args):
+        return _awaitable(self.sendall(data, *args))
+
+    def async_accept(self):
+        return _awaitable(self.accept())
+
+    def async_connect(self, *args):
+        return _awaitable(self.connect(*args))
 
 
 if platform.system() == 'Windows':
@@ -1159,7 +1535,7 @@ if platform.system() == 'Windows':
                 self._poller_name = 'IOCP'
                 self.iocp = win32file.CreateIoCompletionPort(win32file.INVALID_HANDLE_VALUE,
                                                              None, 0, 0)
-                self._timeouts = []
+                self._timers = _TimerWheel()
                 self.async_poller = _AsyncPoller(self)
                 self.cmd_rsock, self.cmd_wsock = _AsyncPoller._socketpair()
                 self.cmd_wsock.setblocking(0)
@@ -1172,6 +1548,8 @@ if platform.system() == 'Windows':
                                            self.cmd_rsock._read_overlap, 0)
                 if err and err != winerror.ERROR_IO_PENDING:
                     logger.warning('WSARecv error: %s', err)
+                self._interrupt_pending = False
+                self.interrupts_elided = 0
                 self._lock = threading.RLock()
                 self._polling = False
 
@@ -1186,7 +1564,11 @@ if platform.system() == 'Windows':
                     logger.warning('WSARecv error: %s', err)
 
             def interrupt(self, timeout=None):
-                self.cmd_wsock.send(b'i')
+                if self._interrupt_pending:
+                    self.interrupts_elided += 1
+                else:
+                    self._interrupt_pending = True
+                    self.cmd_wsock.send(b'i')
 
             def register(self, handle, event=0):
                 win32file.CreateIoCompletionPort(handle, self.iocp, 1, 0)
@@ -1201,8 +1583,8 @@ if platform.system() == 'Windows':
                 self._lock.acquire()
                 if timeout == 0:
                     self.poll_timeout = 0
-                elif self._timeouts:
-                    self.poll_timeout = self._timeouts[0][0] - _time()
+                elif self._timers:
+                    self.poll_timeout = self._timers.next_expiry() - _time()
                     if self.poll_timeout < 0.0001:
                         self.poll_timeout = 0
                     elif timeout is not None:
@@ -1218,7 +1600,9 @@ if platform.system() == 'Windows':
                 self._polling = True
                 err, n, key, overlap = win32file.GetQueuedCompletionStatus(self.iocp, timeout)
                 self._polling = False
+                events = 0
                 while err != winerror.WAIT_TIMEOUT:
+                    events += 1
                     if overlap and overlap.object:
                         overlap.object(err, n)
                     elif not self.iocp:
@@ -1227,48 +1611,39 @@ if platform.system() == 'Windows':
                             pass
                         else:
                             logger.warning('IOCP handle closed error: %d', err)
-                        return
+                        return events
                     else:
                         logger.warning('invalid overlap: %s', err)
                         break
                     err, n, key, overlap = win32file.GetQueuedCompletionStatus(self.iocp, 0)
 
                 self._lock.acquire()
-                if self._timeouts:
-                    now = _time() + 0.0001
-                    while self._timeouts and self._timeouts[0][0] <= now:
-                        fd_timeout, fd = self._timeouts.pop(0)
-                        if fd._timeout_id == fd_timeout:
+                if self._timers:
+                    for timer in self._timers.expire(_time() + 0.0001):
+                        fd = timer.data
+                        if fd._timeout_id is timer:
                             fd._timeout_id = None
                             fd._timed_out()
                 self._lock.release()
+                return events
 
             def _add_timeout(self, fd):
+                self._lock.acquire()
+                if fd._timeout_id:
+                    self._timers.cancel(fd._timeout_id)
                 if fd._timeout:
-                    self._lock.acquire()
-                    fd._timeout_id = _time() + fd._timeout + 0.0001
-                    i = bisect_left(self._timeouts, (fd._timeout_id, fd))
-                    self._timeouts.insert(i, (fd._timeout_id, fd))
+                    fd._timeout_id = self._timers.add(_time() + fd._timeout, fd)
                     if self._polling:
                         self.interrupt()
-                    self._lock.release()
                 else:
                     fd._timeout_id = None
+                self._lock.release()
 
             def _del_timeout(self, fd):
                 if fd._timeout_id:
                     self._lock.acquire()
-                    i = bisect_left(self._timeouts, (fd._timeout_id, fd))
-                    while i < len(self._timeouts):
-                        if self._timeouts[i] == (fd._timeout_id, fd):
-                            del self._timeouts[i]
-                            fd._timeout_id = None
-                            break
-                        if fd._timeout_id != self._timeouts[i][0]:
-                            logger.warning('fd %s with %s is not found',
-                                           fd._fileno, fd._timeout_id)
-                            break
-                        i += 1
+                    self._timers.cancel(fd._timeout_id)
+                    fd._timeout_id = None
                     if self._polling:
                         self.interrupt()
                     self._lock.release()
@@ -1281,7 +1656,7 @@ if platform.system() == 'Windows':
                     self.cmd_rsock_buf = None
                     iocp, self.iocp = self.iocp, None
                     win32file.CloseHandle(iocp)
-                    self._timeouts = []
+                    self._timers = _TimerWheel()
                     self.cmd_rsock = self.cmd_wsock = None
                     self.__class__._instance = None
 
@@ -1745,8 +2120,15 @@ if not hasattr(sys.modules[__name__], '_AsyncNotifier'):
 
         _Block = None
 
+        # with epoll, register descriptors once (for both reading and
+        # writing) in edge-triggered mode, instead of modifying registration
+        # for each operation; set to False before AsynCoro is created to use
+        # level-triggered mode
+        _EdgeTriggered = True
+
         def __init__(self):
             self.timeout_multiplier = 1
+            self._edge_triggered = 0
 
             if hasattr(select, 'epoll'):
                 self._poller_name = 'epoll'
@@ -1756,6 +2138,9 @@ if not hasattr(sys.modules[__name__], '_AsyncNotifier'):
                 _AsyncPoller._Hangup = select.EPOLLHUP
                 _AsyncPoller._Error = select.EPOLLERR
                 _AsyncPoller._Block = -1
+                if _AsyncPoller._EdgeTriggered:
+                    self._edge_triggered = (_AsyncPoller._Read | _AsyncPoller._Write |
+                                            select.EPOLLET)
             elif hasattr(select, 'kqueue'):
                 self._poller_name = 'kqueue'
                 self._poller = _KQueueNotifier()
@@ -1795,21 +2180,43 @@ if not hasattr(sys.modules[__name__], '_AsyncNotifier'):
 
             self._fds = {}
             self._events = {}
-            self._timeouts = []
+            self._timers = _TimerWheel()
+            # an interrupt is written only if one is not pending already
+            # (scheduler clears '_interrupt_pending' when it starts waiting
+            # for events), so any number of interrupts while scheduler is
+            # busy cost one write and one read; 'interrupts_elided' counts
+            # interrupts saved
+            self._interrupt_pending = False
+            self.interrupts_elided = 0
             self.cmd_read, self.cmd_write = _AsyncPoller._cmd_read_write_fds(self)
             if hasattr(self.cmd_write, 'getsockname'):
                 self.cmd_read = AsyncSocket(self.cmd_read)
                 self.cmd_read._read_task = lambda: self.cmd_read._rsock.recv(128)
-                self.interrupt = lambda: self.cmd_write.send(b'I')
+                self._cmd_write = lambda: self.cmd_write.send(b'I')
+            elif self.cmd_write is self.cmd_read:
+                # eventfd's counter is incremented with 8-byte integer
+                self._cmd_write = lambda: os.write(self.cmd_write._fileno,
+                                                   struct.pack('=Q', 1))
             else:
-                self.interrupt = lambda: os.write(self.cmd_write._fileno, b'I')
+                self._cmd_write = lambda: os.write(self.cmd_write._fileno, b'I')
             self.add(self.cmd_read, _AsyncPoller._Read)
+            if self._edge_triggered:
+                # interrupt descriptor is only read (eventfd is always
+                # writable, which would cause spurious events)
+                self._poller.modify(self.cmd_read._fileno, _AsyncPoller._Read | select.EPOLLET)
+
+        def interrupt(self):
+            if self._interrupt_pending:
+                self.interrupts_elided += 1
+            else:
+                self._interrupt_pending = True
+                self._cmd_write()
 
         def poll(self, timeout):
             if timeout == 0:
                 poll_timeout = timeout
-            elif self._timeouts:
-                poll_timeout = self._timeouts[0][0] - _time()
+            elif self._timers:
+                poll_timeout = self._timers.next_expiry() - _time()
                 if timeout is not None:
                     poll_timeout = min(timeout, poll_timeout)
                 if poll_timeout < 0.0001:
@@ -1826,42 +2233,87 @@ if not hasattr(sys.modules[__name__], '_AsyncNotifier'):
                 logger.debug(traceback.format_exc())
                 # prevent tight loops
                 time.sleep(5)
-                return
+                return 0
 
             try:
-                for fileno, event in events:
-                    fd = self._fds.get(fileno, None)
-                    if not fd:
-                        if not (event & _AsyncPoller._Hangup):
-                            logger.debug('invalid fd %s for event %s', fileno, event)
-                        continue
-                    if event & _AsyncPoller._Read:
-                        if fd._read_task:
-                            fd._read_task()
-                        else:
-                            logger.debug('fd %s is not registered for reading!', fd._fileno)
-                            self.unregister(fd)
-                    elif event & _AsyncPoller._Write:
-                        if fd._write_task:
-                            fd._write_task()
-                        else:
-                            logger.debug('fd %s is not registered for writing!', fd._fileno)
+                if self._edge_triggered:
+                    self._edge_events(events)
+                else:
+                    for fileno, event in events:
+                        fd = self._fds.get(fileno, None)
+                        if not fd:
+                            if not (event & _AsyncPoller._Hangup):
+                                logger.debug('invalid fd %s for event %s', fileno, event)
+                            continue
+                        if event & _AsyncPoller._Read:
+                            if fd._read_task:
+                                fd._read_task()
+                            else:
+                                logger.debug('fd %s is not registered for reading!', fd._fileno)
+                                self.unregister(fd)
+                        elif event & _AsyncPoller._Write:
+                            if fd._write_task:
+                                fd._write_task()
+                            else:
+                                logger.debug('fd %s is not registered for writing!', fd._fileno)
+                                self.unregister(fd)
+                        elif event & _AsyncPoller._Hangup:
+                            fd._eof()
+                        elif event & _AsyncPoller._Error:
+                            logger.warning('error on fd %s', fd._fileno)
                             self.unregister(fd)
-                    elif event & _AsyncPoller._Hangup:
-                        fd._eof()
-                    elif event & _AsyncPoller._Error:
-                        logger.warning('error on fd %s', fd._fileno)
-                        self.unregister(fd)
             except:
                 logger.debug(traceback.format_exc())
 
-            if self._timeouts:
-                now = _time() + 0.0001
-                while self._timeouts and self._timeouts[0][0] <= now:
-                    fd_timeout, fd = self._timeouts.pop(0)
-                    if fd._timeout_id == fd_timeout:
+            if self._timers:
+                for timer in self._timers.expire(_time() + 0.0001):
+                    fd = timer.data
+                    if fd._timeout_id is timer:
                         fd._timeout_id = None
                         fd._timed_out()
+            return len(events)
+
+        def _edge_events(self, events):
+            # with edge-triggered notifications, readiness is reported only
+            # when it changes, so tasks for both directions are run until
+            # they find descriptor is not ready; operations are always
+            # attempted before waiting, so readiness reported when there is
+            # no task is not needed
+            for fileno, event in events:
+                fd = self._fds.get(fileno, None)
+                if not fd:
+                    continue
+                if event & (_AsyncPoller._Hangup | _AsyncPoller._Error):
+                    if (event & _AsyncPoller._Error) and not (fd._read_task or fd._write_task):
+                        logger.warning('error on fd %s', fd._fileno)
+                        self.unregister(fd)
+                        continue
+                    event |= _AsyncPoller._Read | _AsyncPoller._Write
+                # events are not reported again, so failure with one
+                # descriptor shouldn't prevent processing others
+                try:
+                    self._run_tasks(fd, event)
+                except:
+                    logger.debug(traceback.format_exc())
+
+        def _run_tasks(self, fd, event):
+            # a task that makes progress but doesn't complete sets up new
+            # task, which is run until it completes or finds descriptor is
+            # not ready (then it keeps the task as is)
+            if event & _AsyncPoller._Read:
+                task = fd._read_task
+                while task:
+                    task()
+                    if fd._read_task is task:
+                        break
+                    task = fd._read_task
+            if event & _AsyncPoller._Write:
+                task = fd._write_task
+                while task:
+                    task()
+                    if fd._write_task is task:
+                        break
+                    task = fd._write_task
 
         def terminate(self):
             if hasattr(self.cmd_write, 'getsockname'):
@@ -1875,34 +2327,24 @@ if not hasattr(sys.modules[__name__], '_AsyncNotifier'):
                                    fd._fileno, traceback.format_exc())
                 fd._notifier = None
             self._fds.clear()
-            self._timeouts = []
+            self._timers = _TimerWheel()
             if hasattr(self._poller, 'terminate'):
                 self._poller.terminate()
             self._poller = None
             self.cmd_read = self.cmd_write = None
 
         def _add_timeout(self, fd):
+            if fd._timeout_id:
+                self._timers.cancel(fd._timeout_id)
             if fd._timeout:
-                fd._timeout_id = _time() + fd._timeout + 0.0001
-                i = bisect_left(self._timeouts, (fd._timeout_id, fd))
-                self._timeouts.insert(i, (fd._timeout_id, fd))
+                fd._timeout_id = self._timers.add(_time() + fd._timeout, fd)
             else:
                 fd._timeout_id = None
 
         def _del_timeout(self, fd):
             if fd._timeout_id:
-                i = bisect_left(self._timeouts, (fd._timeout_id, fd))
-                # in case of identical timeouts (unlikely?), search for
-                # correct index where fd is
-                while i < len(self._timeouts):
-                    if self._timeouts[i] == (fd._timeout_id, fd):
-                        del self._timeouts[i]
-                        fd._timeout_id = None
-                        break
-                    if fd._timeout_id != self._timeouts[i][0]:
-                        logger.warning('fd %s with %s is not found', fd._fileno, fd._timeout_id)
-                        break
-                    i += 1
+                self._timers.cancel(fd._timeout_id)
+                fd._timeout_id = None
 
         def unregister(self, fd):
             if self._fds.pop(fd._fileno, None) is None:
@@ -1917,15 +2359,13 @@ if not hasattr(sys.modules[__name__], '_AsyncNotifier'):
             if cur_event is None:
                 self._fds[fd._fileno] = fd
                 self._events[fd._fileno] = event
-                self._poller.register(fd._fileno, event)
+                self._poller.register(fd._fileno, self._edge_triggered or event)
             else:
                 event |= cur_event
                 self._events[fd._fileno] = event
-                self._poller.modify(fd._fileno, event)
-            if fd._timeout:
-                self._add_timeout(fd)
-            else:
-                fd._timeout_id = None
+                if not self._edge_triggered:
+                    self._poller.modify(fd._fileno, event)
+            self._add_timeout(fd)
 
         def clear(self, fd, event=0):
             cur_event = self._events.get(fd._fileno, None)
@@ -1935,7 +2375,8 @@ if not hasattr(sys.modules[__name__], '_AsyncNotifier'):
                 else:
                     cur_event = 0
                 self._events[fd._fileno] = cur_event
-                self._poller.modify(fd._fileno, cur_event)
+                if not self._edge_triggered:
+                    self._poller.modify(fd._fileno, cur_event)
                 if not cur_event:
                     self._del_timeout(fd)
 
@@ -1949,11 +2390,16 @@ if not hasattr(sys.modules[__name__], '_AsyncNotifier'):
                         self._timeout = None
                         self._timeout_id = None
                         self._notifier = notifier
+                        self._read_task = self._read
+                        self._write_task = None
                         flags = fcntl.fcntl(self._fileno, fcntl.F_GETFL)
                         fcntl.fcntl(self._fileno, fcntl.F_SETFL, flags | os.O_NONBLOCK)
 
-                    def _read_task(self):
-                        os.read(self._fileno, 128)
+                    def _read(self):
+                        try:
+                            os.read(self._fileno, 128)
+                        except OSError:
+                            pass
 
                     def close(self):
                         if self._notifier:
@@ -1964,6 +2410,10 @@ if not hasattr(sys.modules[__name__], '_AsyncNotifier'):
                     def _eof(self):
                         self._read_task()
 
+                if hasattr(os, 'eventfd'):
+                    # same descriptor is used to interrupt and to read
+                    fd = PipeFD(os.eventfd(0, os.EFD_CLOEXEC))
+                    return (fd, fd)
                 pipein, pipeout = os.pipe()
                 return (PipeFD(pipein), PipeFD(pipeout))
             elif hasattr(socket, 'socketpair'):
@@ -2093,19 +2543,94 @@ if not hasattr(sys.modules[__name__], '_AsyncNotifier'):
 AsynCoroSocket = AsyncSocket
 
 
+class _WaitQueue(object):
+    """Internal use only.
+
+    FIFO queue of coroutines waiting for Lock, Semaphore etc. When a
+    coroutine stops waiting (e.g., due to timeout), its entry is only
+    marked as cancelled (in constant time) and skipped when woken.
+    """
+
+    __slots__ = ('_entries', '_waiting')
+
+    def __init__(self):
+        self._entries = collections.deque()
+        self._waiting = 0
+
+    def append(self, coro):
+        """Adds 'coro' at the end; returns entry to pass to 'cancel'.
+        """
+        entry = [coro]
+        self._entries.append(entry)
+        self._waiting += 1
+        return entry
+
+    def appendleft(self, coro):
+        """Adds 'coro' at the front; returns entry to pass to 'cancel'.
+        """
+        entry = [coro]
+        self._entries.appendleft(entry)
+        self._waiting += 1
+        return entry
+
+    def cancel(self, entry):
+        """Removes coroutine in 'entry' (if it has not been popped yet).
+        """
+        if entry[0] is not None:
+            entry[0] = None
+            self._waiting -= 1
+            if not self._waiting:
+                self._entries.clear()
+            elif len(self._entries) > 2 * self._waiting + 16:
+                # drop cancelled entries so they don't accumulate
+                self._entries = collections.deque(entry for entry in self._entries
+                                                  if entry[0] is not None)
+
+    def wake(self, update=True):
+        """Resumes earliest waiting coroutine with 'update'. Returns True if
+        a coroutine is resumed, False if there are no waiting coroutines.
+        """
+        entries = self._entries
+        while entries:
+            entry = entries.popleft()
+            coro = entry[0]
+            if coro is not None:
+                entry[0] = None
+                self._waiting -= 1
+                # skip coroutine whose timeout has expired (it may still
+                # be in queue until it runs)
+                if coro._state == AsynCoro._AwaitIO_:
+                    coro._proceed_(update)
+                    return True
+        return False
+
+    def wake_all(self, update=True):
+        """Resumes all waiting coroutines with 'update'. Returns number of
+        coroutines resumed.
+        """
+        n = 0
+        while self.wake(update):
+            n += 1
+        return n
+
+    def __len__(self):
+        return self._waiting
+
+
 class Lock(object):
     """'Lock' primitive for coroutines.
     """
     def __init__(self):
         self._owner = None
-        self._waitlist = []
+        self._waitlist = _WaitQueue()
         self._asyncoro = AsynCoro.scheduler()
 
+    @_coroutine
     def acquire(self, blocking=True, timeout=-1):
         """Must be used with 'yield' as 'yield lock.acquire()'.
         """
         if not blocking and self._owner is not None:
-            raise StopIteration(False)
+            return False
         if not self._asyncoro:
             self._asyncoro = AsynCoro.scheduler()
         coro = AsynCoro.cur_coro(self._asyncoro)
@@ -2114,18 +2639,15 @@ class Lock(object):
         while self._owner is not None:
             if timeout is not None:
                 if timeout <= 0:
-                    raise StopIteration(False)
+                    return False
                 start = _time()
-            self._waitlist.append(coro)
+            entry = self._waitlist.append(coro)
             if (yield coro._await_(timeout)) is None:
-                try:
-                    self._waitlist.remove(coro)
-                except ValueError:
-                    pass
+                self._waitlist.cancel(entry)
             if timeout is not None:
                 timeout -= (_time() - start)
         self._owner = coro
-        raise StopIteration(True)
+        return True
 
     def release(self):
         """May be used with 'yield'.
@@ -2134,9 +2656,7 @@ class Lock(object):
         if self._owner != coro:
             raise RuntimeError('"%s"/%s: invalid lock release - not locked' % (coro._name, coro._id))
         self._owner = None
-        if self._waitlist:
-            wake = self._waitlist.pop(0)
-            wake._proceed_(True)
+        self._waitlist.wake()
 
 
 class RLock(object):
@@ -2145,9 +2665,10 @@ class RLock(object):
     def __init__(self):
         self._owner = None
         self._depth = 0
-        self._waitlist = []
+        self._waitlist = _WaitQueue()
         self._asyncoro = AsynCoro.scheduler()
 
+    @_coroutine
     def acquire(self, blocking=True, timeout=-1):
         """Must be used with 'yield' as 'yield rlock.acquire()'.
         """
@@ -2157,28 +2678,25 @@ class RLock(object):
         if self._owner == coro:
             assert self._depth > 0
             self._depth += 1
-            raise StopIteration(True)
+            return True
         if not blocking and self._owner is not None:
-            raise StopIteration(False)
+            return False
         if timeout < 0:
             timeout = None
         while self._owner is not None:
             if timeout is not None:
                 if timeout <= 0:
-                    raise StopIteration(False)
+                    return False
                 start = _time()
-            self._waitlist.append(coro)
+            entry = self._waitlist.append(coro)
             if (yield coro._await_(timeout)) is None:
-                try:
-                    self._waitlist.remove(coro)
-                except ValueError:
-                    pass
+                self._waitlist.cancel(entry)
             if timeout is not None:
                 timeout -= (_time() - start)
         assert self._depth == 0
         self._owner = coro
         self._depth = 1
-        raise StopIteration(True)
+        return True
 
     def release(self):
         """May be used with 'yield'.
@@ -2190,9 +2708,7 @@ class RLock(object):
         self._depth -= 1
         if self._depth == 0:
             self._owner = None
-            if self._waitlist:
-                wake = self._waitlist.pop(0)
-                wake._proceed_(True)
+            self._waitlist.wake()
 
 
 class Condition(object):
@@ -2203,10 +2719,11 @@ class Condition(object):
         """
         self._owner = None
         self._depth = 0
-        self._waitlist = []
-        self._notifylist = []
+        self._waitlist = _WaitQueue()
+        self._notifylist = _WaitQueue()
         self._asyncoro = AsynCoro.scheduler()
 
+    @_coroutine
     def acquire(self, blocking=True, timeout=-1):
         """Must be used with 'yield' as 'yield cv.acquire()'.
         """
@@ -2215,28 +2732,25 @@ class Condition(object):
         coro = AsynCoro.cur_coro(self._asyncoro)
         if self._owner == coro:
             self._depth += 1
-            raise StopIteration(True)
+            return True
         if not blocking and self._owner is not None:
-            raise StopIteration(False)
+            return False
         if timeout < 0:
             timeout = None
         while self._owner is not None:
             if timeout is not None:
                 if timeout <= 0:
-                    raise StopIteration(False)
+                    return False
                 start = _time()
-            self._waitlist.append(coro)
+            entry = self._waitlist.append(coro)
             if (yield coro._await_(timeout)) is None:
-                try:
-                    self._waitlist.remove(coro)
-                except ValueError:
-                    pass
+                self._waitlist.cancel(entry)
             if timeout is not None:
                 timeout -= (_time() - start)
         assert self._depth == 0
         self._owner = coro
         self._depth = 1
-        raise StopIteration(True)
+        return True
 
     def release(self):
         """May be used with 'yield'.
@@ -2248,16 +2762,12 @@ class Condition(object):
         self._depth -= 1
         if self._depth == 0:
             self._owner = None
-            if self._waitlist:
-                wake = self._waitlist.pop(0)
-                wake._proceed_(True)
+            self._waitlist.wake()
 
     def notify(self, n=1):
         """May not be used with 'yield'.
         """
-        while self._notifylist and n:
-            wake = self._notifylist.pop(0)
-            wake._proceed_(True)
+        while n > 0 and self._notifylist.wake():
             n -= 1
 
     def notify_all(self):
@@ -2265,6 +2775,7 @@ class Condition(object):
 
     notifyAll = notify_all
 
+    @_coroutine
     def wait(self, timeout=None):
         """Must be used with 'yield' as 'yield cv.wait()'.
         """
@@ -2276,34 +2787,26 @@ class Condition(object):
         depth = self._depth
         self._depth = 0
         self._owner = None
-        if self._waitlist:
-            wake = self._waitlist.pop(0)
-            wake._proceed_(True)
-        self._notifylist.append(coro)
+        self._waitlist.wake()
+        entry = self._notifylist.append(coro)
         start = _time()
         if (yield coro._await_(timeout)) is None:
-            try:
-                self._notifylist.remove(coro)
-            except ValueError:
-                pass
-            raise StopIteration(False)
+            self._notifylist.cancel(entry)
+            return False
         while self._owner is not None:
-            self._waitlist.insert(0, coro)
             if timeout is not None:
                 timeout -= (_time() - start)
                 if timeout <= 0:
-                    raise StopIteration(False)
+                    return False
                 start = _time()
+            entry = self._waitlist.appendleft(coro)
             if (yield coro._await_(timeout)) is None:
-                try:
-                    self._waitlist.remove(coro)
-                except ValueError:
-                    pass
-                raise StopIteration(False)
+                self._waitlist.cancel(entry)
+                return False
         assert self._depth == 0
         self._owner = coro
         self._depth = depth
-        raise StopIteration(True)
+        return True
 
 
 class Event(object):
@@ -2311,16 +2814,14 @@ class Event(object):
     """
     def __init__(self):
         self._flag = False
-        self._waitlist = []
+        self._waitlist = _WaitQueue()
         self._asyncoro = AsynCoro.scheduler()
 
     def set(self):
         """May be used with 'yield'.
         """
         self._flag = True
-        for coro in self._waitlist:
-            coro._proceed_(True)
-        self._waitlist = []
+        self._waitlist.wake_all()
 
     def is_set(self):
         """No need to use with 'yield'.
@@ -2334,26 +2835,24 @@ class Event(object):
         """
         self._flag = False
 
+    @_coroutine
     def wait(self, timeout=None):
         """Must be used with 'yield' as 'yield event.wait()' .
         """
         if self._flag:
-            raise StopIteration(True)
+            return True
         if not self._asyncoro:
             self._asyncoro = AsynCoro.scheduler()
         coro = AsynCoro.cur_coro(self._asyncoro)
         if timeout is not None:
             if timeout <= 0:
-                raise StopIteration(False)
-        self._waitlist.append(coro)
+                return False
+        entry = self._waitlist.append(coro)
         if (yield coro._await_(timeout)) is None:
-            try:
-                self._waitlist.remove(coro)
-            except ValueError:
-                pass
-            raise StopIteration(False)
+            self._waitlist.cancel(entry)
+            return False
         else:
-            raise StopIteration(True)
+            return True
 
 
 class Semaphore(object):
@@ -2361,57 +2860,407 @@ class Semaphore(object):
     """
     def __init__(self, value=1):
         assert value >= 1
-        self._waitlist = []
+        self._waitlist = _WaitQueue()
         self._counter = value
         self._asyncoro = AsynCoro.scheduler()
 
-    def acquire(self, blocking=True):
+    @_coroutine
+    def acquire(self, blocking=True, timeout=None):
         """Must be used with 'yield' as 'yield sem.acquire()'.
+
+        If 'timeout' is given and semaphore could not be acquired within
+        that time, returns False.
         """
         if blocking:
             if not self._asyncoro:
                 self._asyncoro = AsynCoro.scheduler()
             coro = AsynCoro.cur_coro(self._asyncoro)
             while self._counter == 0:
-                self._waitlist.append(coro)
-                yield coro._await_()
+                if timeout is not None:
+                    if timeout <= 0:
+                        return False
+                    start = _time()
+                entry = self._waitlist.append(coro)
+                if (yield coro._await_(timeout)) is None:
+                    self._waitlist.cancel(entry)
+                if timeout is not None:
+                    timeout -= (_time() - start)
         elif self._counter == 0:
-            raise StopIteration(False)
+            return False
         self._counter -= 1
-        raise StopIteration(True)
+        return True
 
     def release(self):
         """May be used with 'yield'.
         """
         self._counter += 1
         assert self._counter > 0
-        if self._waitlist:
-            wake = self._waitlist.pop(0)
-            wake._proceed_()
+        self._waitlist.wake()
 
 
-class HotSwapException(Exception):
-    """This exception is used to indicate hot-swap request and
-    response.
+class RWLock(object):
+    """Readers-writer lock for coroutines: any number of coroutines may
+    hold the lock for reading at the same time, or one coroutine may
+    hold it for writing.
 
-    If 'exc' is the exception, then len(exc.args) == 1 and
-    exc.args[0] is the new generator method.
+    If 'prefer_writer' is False (default), readers acquire the lock as
+    long as no writer holds it. Otherwise, once a writer is waiting,
+    new readers wait until that writer is done, so that writers are not
+    starved by continuous readers. The lock is not reentrant.
     """
-    pass
+    def __init__(self, prefer_writer=False):
+        self._prefer_writer = bool(prefer_writer)
+        self._readers = 0
+        self._writer = None
+        self._read_waitlist = _WaitQueue()
+        self._write_waitlist = _WaitQueue()
+        self._asyncoro = AsynCoro.scheduler()
 
+    @_coroutine
+    def acquire_read(self, blocking=True, timeout=None):
+        """Must be used with 'yield' as 'yield rwlock.acquire_read()'.
 
-class MonitorException(Exception):
-    """This execption is used to indicate that a coroutine being
-    monitored has finished or terminated.
+        Returns True if the lock is acquired for reading, False if not
+        (when 'blocking' is False or due to timeout).
+        """
+        if not self._asyncoro:
+            self._asyncoro = AsynCoro.scheduler()
+        coro = AsynCoro.cur_coro(self._asyncoro)
+        while self._writer is not None or (self._prefer_writer and self._write_waitlist):
+            if not blocking:
+                return False
+            if timeout is not None:
+                if timeout <= 0:
+                    return False
+                start = _time()
+            entry = self._read_waitlist.append(coro)
+            if (yield coro._await_(timeout)) is None:
+                self._read_waitlist.cancel(entry)
+            if timeout is not None:
+                timeout -= (_time() - start)
+        self._readers += 1
+        return True
 
-    If 'exc' is the exception, then
+    def release_read(self):
+        """May be used with 'yield'.
+        """
+        if self._readers <= 0:
+            coro = AsynCoro.cur_coro(self._asyncoro)
+            raise RuntimeError('"%s"/%s: invalid lock release - not locked for reading' %
+                               (coro._name, coro._id))
+        self._readers -= 1
+        if self._readers == 0:
+            self._wake()
+
+    @_coroutine
+    def acquire_write(self, blocking=True, timeout=None):
+        """Must be used with 'yield' as 'yield rwlock.acquire_write()'.
+
+        Returns True if the lock is acquired for writing, False if not
+        (when 'blocking' is False or due to timeout).
+        """
+        if not self._asyncoro:
+            self._asyncoro = AsynCoro.scheduler()
+        coro = AsynCoro.cur_coro(self._asyncoro)
+        while self._writer is not None or self._readers:
+            if not blocking:
+                return False
+            if timeout is not None:
+                if timeout <= 0:
+                    return False
+                start = _time()
+            entry = self._write_waitlist.append(coro)
+            if (yield coro._await_(timeout)) is None:
+                self._write_waitlist.cancel(entry)
+                if self._writer is None and not self._write_waitlist:
+                    # readers may have been waiting for this writer
+                    self._read_waitlist.wake_all()
+            if timeout is not None:
+                timeout -= (_time() - start)
+        self._writer = coro
+        return True
 
-    exc.args[0] is the coroutine (either local or remote) about
-    which this exception is thrown,
+    def release_write(self):
+        """May be used with 'yield'.
+        """
+        coro = AsynCoro.cur_coro(self._asyncoro)
+        if self._writer != coro:
+            raise RuntimeError('"%s"/%s: invalid lock release - not locked for writing' %
+                               (coro._name, coro._id))
+        self._writer = None
+        self._wake()
 
-    If the coroutine finished executing normally, then len(exc.args)
-    == 2, type(exc.args[1]) == tuple, len(exc.args[1]) == 2,
-    exc.args[1][0] is StopIteration and exc.args[1][1] is the value of
+    def _wake(self):
+        """Internal use only.
+        """
+        if self._prefer_writer:
+            if not self._write_waitlist.wake():
+                self._read_waitlist.wake_all()
+        elif not self._read_waitlist.wake_all():
+            self._write_waitlist.wake()
+
+
+class CountDownLatch(object):
+    """Coroutines can wait (with 'wait') until 'count_down' has been
+    called 'count' times, e.g., for results from 'count' coroutines.
+    Once count reaches 0, waiting coroutines are resumed (once) and
+    later 'wait' calls return immediately.
+    """
+    def __init__(self, count):
+        assert count >= 0
+        self._count = count
+        self._waitlist = _WaitQueue()
+        self._asyncoro = AsynCoro.scheduler()
+
+    def count_down(self):
+        """May be used with 'yield'.
+        """
+        if self._count > 0:
+            self._count -= 1
+            if self._count == 0:
+                self._waitlist.wake_all()
+
+    def remaining(self):
+        """No need to use with 'yield'.
+
+        Returns number of 'count_down' calls still needed.
+        """
+        return self._count
+
+    @_coroutine
+    def wait(self, timeout=None):
+        """Must be used with 'yield' as 'yield latch.wait()'.
+
+        Returns True when count reaches 0, or False if timeout expires
+        before that.
+        """
+        if not self._asyncoro:
+            self._asyncoro = AsynCoro.scheduler()
+        coro = AsynCoro.cur_coro(self._asyncoro)
+        while self._count > 0:
+            if timeout is not None:
+                if timeout <= 0:
+                    return False
+                start = _time()
+            entry = self._waitlist.append(coro)
+            if (yield coro._await_(timeout)) is None:
+                self._waitlist.cancel(entry)
+            if timeout is not None:
+                timeout -= (_time() - start)
+        return True
+
+
+class Barrier(object):
+    """Coroutines wait (with 'wait') until 'parties' coroutines have
+    called 'wait', after which all of them are resumed. The barrier can
+    then be used again.
+    """
+    def __init__(self, parties):
+        assert parties >= 1
+        self.parties = parties
+        self._arrived = 0
+        self._generation = 0
+        self._waitlist = _WaitQueue()
+        self._asyncoro = AsynCoro.scheduler()
+
+    @_coroutine
+    def wait(self, timeout=None):
+        """Must be used with 'yield' as 'index = yield barrier.wait()'.
+
+        Returns arrival index of coroutine among coroutines released
+        together (0 for earliest, and the coroutine whose arrival
+        completes the barrier gets 'parties - 1'), or -1 if timeout
+        expires before all parties arrive, in which case the coroutine
+        is no longer counted as arrived.
+        """
+        if not self._asyncoro:
+            self._asyncoro = AsynCoro.scheduler()
+        coro = AsynCoro.cur_coro(self._asyncoro)
+        self._arrived += 1
+        if self._arrived == self.parties:
+            self._arrived = 0
+            self._generation += 1
+            # indexes are given when barrier completes, so coroutines
+            # that left with timeout don't leave gaps (or duplicates)
+            index = 0
+            while self._waitlist.wake(index):
+                index += 1
+            return index
+        if timeout is not None and timeout <= 0:
+            self._arrived -= 1
+            return -1
+        generation = self._generation
+        entry = self._waitlist.append(coro)
+        index = yield coro._await_(timeout)
+        if index is None:
+            self._waitlist.cancel(entry)
+            # if barrier completed just as timeout expired, coroutine was
+            # counted, but others have been released without it
+            if generation == self._generation:
+                self._arrived -= 1
+            return -1
+        return index
+
+
+class Queue(object):
+    """'Queue' primitive for coroutines.
+
+    If 'maxsize' is > 0, at most that many items are kept in queue, so
+    'put' waits until there is room in queue (i.e., slow consumers
+    apply backpressure to producers); otherwise, queue is unbounded.
+    """
+    def __init__(self, maxsize=0):
+        self.maxsize = maxsize
+        self._items = collections.deque()
+        # coroutines waiting to get / put items
+        self._getters = _WaitQueue()
+        self._putters = _WaitQueue()
+        self._asyncoro = AsynCoro.scheduler()
+
+    def qsize(self):
+        """No need to use with 'yield'.
+        """
+        return len(self._items)
+
+    def empty(self):
+        """No need to use with 'yield'.
+        """
+        return not self._items
+
+    def full(self):
+        """No need to use with 'yield'.
+        """
+        return self.maxsize > 0 and len(self._items) >= self.maxsize
+
+    @_coroutine
+    def put(self, item, block=True, timeout=None):
+        """Must be used with 'yield' as 'yield queue.put(item)'.
+
+        Adds 'item' to queue, waiting (if 'block' is True) until there
+        is room in queue. Returns True if item is added and False if
+        it could not be added before timeout.
+        """
+        if self.maxsize > 0 and len(self._items) >= self.maxsize:
+            if not block:
+                return False
+            if not self._asyncoro:
+                self._asyncoro = AsynCoro.scheduler()
+            coro = AsynCoro.cur_coro(self._asyncoro)
+            while len(self._items) >= self.maxsize:
+                if timeout is not None:
+                    if timeout <= 0:
+                        return False
+                    start = _time()
+                entry = self._putters.append(coro)
+                if (yield coro._await_(timeout)) is None:
+                    self._putters.cancel(entry)
+                if timeout is not None:
+                    timeout -= (_time() - start)
+        self._items.append(item)
+        self._getters.wake()
+        return True
+
+    def put_nowait(self, item):
+        """No need to use with 'yield'.
+
+        Adds 'item' to queue if there is room in queue. Returns True if
+        item is added and False otherwise.
+        """
+        if self.maxsize > 0 and len(self._items) >= self.maxsize:
+            return False
+        self._items.append(item)
+        self._getters.wake()
+        return True
+
+    @_coroutine
+    def get(self, block=True, timeout=None, alarm_value=None):
+        """Must be used with 'yield' as 'item = yield queue.get()'.
+
+        Removes and returns earliest item in queue, waiting (if 'block'
+        is True) until an item is available. If no item is available
+        before timeout, 'alarm_value' is returned.
+        """
+        if not self._items:
+            if not block:
+                return alarm_value
+            if not self._asyncoro:
+                self._asyncoro = AsynCoro.scheduler()
+            coro = AsynCoro.cur_coro(self._asyncoro)
+            while not self._items:
+                if timeout is not None:
+                    if timeout <= 0:
+                        return alarm_value
+                    start = _time()
+                entry = self._getters.append(coro)
+                if (yield coro._await_(timeout)) is None:
+                    self._getters.cancel(entry)
+                if timeout is not None:
+                    timeout -= (_time() - start)
+        item = self._items.popleft()
+        self._putters.wake()
+        return item
+
+    def get_nowait(self, alarm_value=None):
+        """No need to use with 'yield'.
+
+        Removes and returns earliest item in queue if available;
+        otherwise, returns 'alarm_value'.
+        """
+        if not self._items:
+            return alarm_value
+        item = self._items.popleft()
+        self._putters.wake()
+        return item
+
+    @_coroutine
+    def get_many(self, max_n, timeout=None):
+        """Must be used with 'yield' as 'items = yield
+        queue.get_many(max_n)'.
+
+        Removes and returns (as list) up to 'max_n' earliest items in
+        queue, waiting until at least one item is available. If no
+        item is available before timeout, empty list is returned.
+        """
+        if not self._items:
+            item = yield from self.get(timeout=timeout, alarm_value=_NoMessage)
+            if item is _NoMessage:
+                return []
+            items = [item]
+            max_n -= 1
+        else:
+            items = []
+        popleft = self._items.popleft
+        n = min(max_n, len(self._items))
+        items.extend(popleft() for i in range(n))
+        putters = self._putters
+        for i in range(n):
+            if not putters.wake():
+                break
+        return items
+
+
+class HotSwapException(Exception):
+    """This exception is used to indicate hot-swap request and
+    response.
+
+    If 'exc' is the exception, then len(exc.args) == 1 and
+    exc.args[0] is the new generator method.
+    """
+    pass
+
+
+class MonitorException(Exception):
+    """This execption is used to indicate that a coroutine being
+    monitored has finished or terminated.
+
+    If 'exc' is the exception, then
+
+    exc.args[0] is the coroutine (either local or remote) about
+    which this exception is thrown,
+
+    If the coroutine finished executing normally, then len(exc.args)
+    == 2, type(exc.args[1]) == tuple, len(exc.args[1]) == 2,
+    exc.args[1][0] is StopIteration and exc.args[1][1] is the value of
     coroutine (i.e., last value yielded). If the coroutine is remote
     and value (i.e., exc.args[1][1]) is not serializable, then
     exc.args[1][1] is just the type of that value.
@@ -2441,34 +3290,187 @@ class SysCoro(object):
     pass
 
 
+class _Mailbox(object):
+    """Internal use only. See set_mailbox, set_conflate and receive in
+    Coro, and CategorizeMessages.
+    """
+
+    __slots__ = ('capacity', 'overflow', 'key', 'latest', 'dropped', 'refused', 'conflated',
+                 'waiting', 'categorize', 'buckets', 'match', 'categories')
+
+    def __init__(self, capacity=None, overflow=None):
+        self.capacity = capacity
+        self.overflow = overflow
+        self.key = None
+        # with conflation, queued messages are kept as lists [state,
+        # message, key] and 'latest' maps key to such (queued) list
+        self.latest = None
+        self.dropped = 0
+        self.refused = 0
+        self.conflated = 0
+        # coroutines waiting in 'deliver' for room in mailbox
+        self.waiting = _WaitQueue()
+        # functions to categorize messages (most recently added first)
+        # and messages (in deques) by category
+        self.categorize = None
+        self.buckets = None
+        # when coroutine waits for a message in state _AwaitMatch_, it
+        # waits for a message for which 'match' returns True, or with
+        # category in 'categories'
+        self.match = None
+        self.categories = None
+
+    def discard(self, entry):
+        """Called when 'entry' is removed from message queue.
+        """
+        if self.latest and len(entry) > 2 and self.latest.get(entry[2], None) is entry:
+            del self.latest[entry[2]]
+
+    def category(self, message):
+        """Returns category of 'message' (None if it is not categorized).
+        """
+        for categorize in self.categorize:
+            try:
+                category = categorize(message)
+                if category is not None:
+                    hash(category)
+                    return category
+            except Exception:
+                logger.warning('categorizing message failed:\n%s', traceback.format_exc())
+        return None
+
+    def matches(self, message):
+        """Returns True if 'message' satisfies 'match'.
+        """
+        try:
+            return bool(self.match(message))
+        except Exception:
+            logger.warning('matching message failed:\n%s', traceback.format_exc())
+            return False
+
+
+class _Completions(object):
+    """Internal use only.
+
+    Used by 'gather', 'wait_any' and 'as_completed' to be notified (with
+    'completed') when any of given coroutines finishes, instead of
+    waiting for each coroutine with 'finish'. Finished coroutines are
+    queued in order of completion.
+    """
+
+    __slots__ = ('_done', '_pending', '_waitlist')
+
+    def __init__(self, coros):
+        self._done = collections.deque()
+        self._pending = 0
+        self._waitlist = _WaitQueue()
+        for coro in coros:
+            if coro._scheduler._add_complete(coro, self):
+                self._pending += 1
+            else:
+                self._done.append(coro)
+
+    def completed(self, coro):
+        """Called by scheduler when 'coro' finishes.
+        """
+        self._pending -= 1
+        self._done.append(coro)
+        self._waitlist.wake()
+
+    def remaining(self):
+        """No need to use with 'yield'.
+
+        Returns number of coroutines not yet retrieved with 'get'.
+        """
+        return self._pending + len(self._done)
+
+    @_coroutine
+    def get(self, timeout=None):
+        """Must be used with 'yield' as 'coro, value = yield
+        completions.get()'.
+
+        Returns next coroutine that finished (in order of completion)
+        and its value. If there are no more coroutines, or no coroutine
+        finishes before timeout, (None, None) is returned.
+        """
+        if not self._done:
+            if not self._pending:
+                return (None, None)
+            if timeout is not None and timeout <= 0:
+                return (None, None)
+            coro = AsynCoro.cur_coro()
+            entry = self._waitlist.append(coro)
+            if (yield coro._await_(timeout)) is None:
+                self._waitlist.cancel(entry)
+            if not self._done:
+                return (None, None)
+        coro = self._done.popleft()
+        return (coro, coro._value)
+
+    def close(self, coros):
+        """Stops watching coroutines in 'coros' that have not finished.
+        """
+        for coro in coros:
+            coro._scheduler._discard_complete(coro, self)
+
+
 class Coro(object):
     """Creates coroutine with the given generator function and
     schedules that coroutine to be executed with AsynCoro. If the
     function definition has 'coro' keyword argument set to (default
     value) None, that argument will be set to the coroutine created.
+
+    With Python 3.5+, the function can also be native coroutine
+    (defined with 'async def'). Methods that must be used with 'yield'
+    are awaitable, except for methods that suspend coroutine and
+    return value (instead of generator), such as 'receive' and
+    'sleep'; for these, use 'async_receive', 'async_sleep' etc. with
+    'await'.
     """
 
     __slots__ = ('_generator', '_name', '_id', '_state', '_value', '_exceptions', '_callers',
                  '_timeout', '_daemon', '_complete', '_msgs', '_monitors', '_swap_generator',
-                 '_hot_swappable', '_location', '_scheduler')
+                 '_hot_swappable', '_location', '_scheduler', '_priority', '_mailbox')
 
     _asyncoro = None
 
+    # priorities of coroutines; see 'priority' property
+    HighPriority = 0
+    NormalPriority = 1
+    LowPriority = 2
+    _default_priority = NormalPriority
+
+    # policies when mailbox is full; see 'set_mailbox'
+    MailboxBlock = 0
+    MailboxReject = 1
+    MailboxDropOldest = 2
+    MailboxDropNewest = 3
+
     def __init__(self, *args, **kwargs):
         self._generator = Coro.__get_generator(self, *args, **kwargs)
+        self.__setup()
+        self._scheduler._add(self)
+
+    def __setup(self):
+        """Internal use only.
+        """
         self._name = self._generator.__name__
         self._id = id(self)
         self._state = None
         self._value = None
-        self._exceptions = []
-        self._callers = []
+        # exceptions, callers, messages and monitors are allocated when
+        # first needed, as most coroutines don't use them
+        self._exceptions = None
+        self._callers = None
         self._timeout = None
         self._daemon = False
         self._complete = None
-        self._msgs = collections.deque()
-        self._monitors = set()
+        self._msgs = None
+        self._monitors = None
         self._swap_generator = None
         self._hot_swappable = False
+        self._priority = self._default_priority
+        self._mailbox = None
         if not Coro._asyncoro:
             AsynCoro.instance()
             if not Coro._asyncoro:
@@ -2480,7 +3482,30 @@ class Coro(object):
         else:
             # assert self._location and self._scheduler == SysCoro._asyncoro
             self._name = '!' + self._name
-        self._scheduler._add(self)
+
+    @classmethod
+    def spawn_many(cls, target, args_list):
+        """Create coroutines with generator function 'target', one for
+        each item in 'args_list', where each item is tuple of arguments
+        to 'target' (as with 'Coro(target, *args)'). Returns list of
+        coroutines created.
+
+        Coroutines are added to scheduler together, so this is faster
+        than creating them in a loop.
+        """
+        pass_coro = Coro.__check_target(target)
+        coros = []
+        for args in args_list:
+            coro = cls.__new__(cls)
+            if pass_coro:
+                coro._generator = target(*args, coro=coro)
+            else:
+                coro._generator = target(*args)
+            coro.__setup()
+            coros.append(coro)
+        if coros:
+            coros[0]._scheduler._add_many(coros)
+        return coros
 
     @property
     def location(self):
@@ -2498,11 +3523,85 @@ class Coro(object):
         """
         return self._name[1:]
 
+    @property
+    def priority(self):
+        """Get / set priority of coroutine.
+
+        Priority is one of Coro.HighPriority, Coro.NormalPriority (default)
+        or Coro.LowPriority. When more than one coroutine is ready to run,
+        coroutines with higher priority are run first, although lower
+        priority coroutines are run occasionally so they are not starved.
+        Priority can be set from any thread; when set from a thread other
+        than scheduler's thread, it is changed by scheduler.
+        """
+        return self._priority
+
+    @priority.setter
+    def priority(self, priority):
+        self._scheduler._set_priority(self, priority)
+
+    def set_mailbox(self, capacity, overflow=MailboxBlock):
+        """Limit number of messages queued for coroutine to 'capacity'.
+
+        If 'capacity' is None, the number of messages is not limited,
+        which is the default. 'overflow' is the policy applied when a
+        message is sent to coroutine while 'capacity' messages are
+        already queued:
+
+          Coro.MailboxBlock (default): 'send' refuses message and
+          returns -2; 'deliver' waits until coroutine receives a
+          message.
+
+          Coro.MailboxReject: 'send' refuses message and returns -2;
+          'deliver' returns 0.
+
+          Coro.MailboxDropOldest: earliest queued message is dropped
+          to make room for message.
+
+          Coro.MailboxDropNewest: message is dropped; 'send' returns 1
+          and 'deliver' returns 0.
+
+        Messages already queued are kept even if there are more than
+        'capacity' of them. Can only be used on local coroutines.
+        """
+        return self._scheduler._set_mailbox(self, capacity, overflow)
+
+    def set_conflate(self, key):
+        """Conflate messages queued for coroutine: 'key' is a function
+        that is called with a message and returns (hashable) key for
+        it. If a message with same key is already queued, new message
+        replaces it (in the position of queued message, so messages are
+        still received in the order their keys first arrived), instead
+        of being queued. Thus, for example, a slow coroutine that is
+        only interested in latest value of each item receives only
+        those, instead of every (stale) update.
+
+        If 'key' is None, conflation is turned off. Can be combined
+        with 'set_mailbox'; a message that replaces queued message
+        doesn't need room in mailbox. Can only be used on local
+        coroutines.
+        """
+        return self._scheduler._set_conflate(self, key)
+
+    def mailbox_stats(self):
+        """Returns tuple (depth, dropped, refused, conflated), where
+        'depth' is number of messages currently queued for coroutine,
+        'dropped' is number of messages dropped and 'refused' is
+        number of times a message was refused (see 'set_mailbox')
+        because mailbox was full, and 'conflated' is number of queued
+        messages replaced by newer messages (see 'set_conflate').
+        Returns None if coroutine is not valid.
+
+        Can only be used on local coroutines.
+        """
+        return self._scheduler._mailbox_stats(self)
+
     @classmethod
     def scheduler(cls):
         return cls._asyncoro
 
     @staticmethod
+    @_coroutine
     def locate(name, location=None, timeout=None):
         """Must be used with 'yield' as
         'rcoro = yield Coro.locate("name")'.
@@ -2513,9 +3612,10 @@ class Coro(object):
         """
         if not Coro._asyncoro:
             Coro._asyncoro = AsynCoro.instance()
-        yield Coro._locate('~' + name, location=location, timeout=timeout)
+        return (yield from Coro._locate('~' + name, location=location, timeout=timeout))
 
     @staticmethod
+    @_coroutine
     def _locate(name, location, timeout):
         """Internal use only.
         """
@@ -2527,9 +3627,9 @@ class Coro(object):
                 rcoro = SysCoro._asyncoro._rcoros.get(name, None)
                 SysCoro._asyncoro._lock.release()
             else:
-                raise StopIteration(None)
+                return None
             if rcoro or location == Coro._asyncoro._location:
-                raise StopIteration(rcoro)
+                return rcoro
         req = _NetRequest('locate_coro', kwargs={'name': name}, dst=location, timeout=timeout)
         req_id = id(req)
         req.event = Event()
@@ -2543,7 +3643,7 @@ class Coro(object):
         SysCoro._asyncoro._pending_reqs.pop(req_id, None)
         SysCoro._asyncoro._lock.release()
         rcoro = req.reply
-        raise StopIteration(rcoro)
+        return rcoro
 
     def register(self, name=None):
         """Register this coroutine so coroutines running on a remote
@@ -2598,6 +3698,15 @@ class Coro(object):
 
     sleep = suspend
 
+    def async_suspend(self, timeout=None, alarm_value=None):
+        """Same as 'suspend', but must be used with 'await' as 'await
+        coro.async_suspend()' in native coroutines.
+        """
+        return _awaitable(self._scheduler._suspend(self, timeout, alarm_value,
+                                                   AsynCoro._Suspended))
+
+    async_sleep = async_suspend
+
     def resume(self, update=None):
         """May be used with 'yield'. Resume/wakeup this coro and send
         'update' to it.
@@ -2617,6 +3726,12 @@ class Coro(object):
         with 'message'. Otherwise, 'message' is queued so that next
         receive call will return message.
 
+        Returns 0 if message is delivered or queued and -1 if coro is
+        not valid. If coro's mailbox is full (see 'set_mailbox'),
+        returns 1 if message is dropped (with MailboxDropNewest policy)
+        or -2 if it is refused (with MailboxBlock or MailboxReject
+        policies).
+
         Can also be used on remotely running coroutines.
         """
         if self._location == Coro._asyncoro._location:
@@ -2632,6 +3747,30 @@ class Coro(object):
             else:
                 return 0
 
+    def send_many(self, messages):
+        """May be used with 'yield'. Sends messages in list 'messages' (in
+        that order) to coro.
+
+        Same as calling 'send' with each message, except that messages
+        are queued together, so this is more efficient.
+
+        Can also be used on remotely running coroutines, in which case
+        messages are sent in one request.
+        """
+        if self._location == Coro._asyncoro._location:
+            return self._scheduler._resume_many(self, messages)
+        else:
+            request = _NetRequest('send_many', kwargs={'messages': list(messages),
+                                                       'name': self._name, 'coro': self._id},
+                                  dst=self._location, timeout=MsgTimeout)
+            # request is queued for asynchronous processing
+            if _Peer.send_req(request) != 0:
+                logger.warning('remote coro at %s may not be valid', self._location)
+                return -1
+            else:
+                return 0
+
+    @_coroutine
     def deliver(self, message, timeout=None):
         """Must be used with 'yield' as 'yield coro.deliver(message)'.
 
@@ -2641,11 +3780,36 @@ class Coro(object):
         is 1, then message has been delivered, if it is 0, it couldn't
         be delivered before timeout, and if it is < 0, then the
         (remote) coroutine is not valid.
+
+        If coro's mailbox is full and its policy is MailboxBlock, waits
+        until coro receives a message so there is room for this
+        message. With MailboxReject and MailboxDropNewest policies, 0
+        is returned when mailbox is full. Messages delivered to remote
+        coroutines are not waited for, and may be dropped or refused
+        (see 'mailbox_stats') even when 1 is returned.
         """
         if self._location == Coro._asyncoro._location:
             reply = self._scheduler._resume(self, message, AsynCoro._AwaitMsg_)
+            if reply == -2:
+                mailbox = self._scheduler._get_mailbox(self)
+                if mailbox and mailbox.overflow == Coro.MailboxBlock:
+                    # sender may be running with a different scheduler
+                    coro = AsynCoro.cur_coro()
+                    while reply == -2:
+                        if timeout is not None:
+                            if timeout <= 0:
+                                break
+                            start = _time()
+                        entry = mailbox.waiting.append(coro)
+                        if (yield coro._await_(timeout)) is None:
+                            mailbox.waiting.cancel(entry)
+                        if timeout is not None:
+                            timeout -= (_time() - start)
+                        reply = self._scheduler._resume(self, message, AsynCoro._AwaitMsg_)
             if reply == 0:
                 reply = 1
+            elif reply > 0 or reply == -2:
+                reply = 0
         else:
             request = _NetRequest('deliver', kwargs={'message': message, 'name': self._name,
                                                      'coro': self._id},
@@ -2656,20 +3820,66 @@ class Coro(object):
                 reply = -1
             # if reply < 0:
             #     logger.warning('remote coro at %s may not be valid', self._location)
-        raise StopIteration(reply)
+        return reply
 
-    def receive(self, timeout=None, alarm_value=None):
+    def receive(self, timeout=None, alarm_value=None, match=None):
         """Must be used with 'yield' as 'message = yield coro.receive()'.
         Gets/waits for message.
 
         Gets earliest queued message if available (that has been sent
         earlier with 'send'). Otherwise, suspends until 'timeout'. If
         timeout happens, coro receives alarm_value.
+
+        If 'match' is not None, it must be a function that is called
+        with a message and returns True if that message is to be
+        received. Queued messages are checked once and earliest
+        matching message is returned; if there is none, coro waits for
+        a matching message (messages that don't match are queued).
+        As each call checks all queued messages, when many messages
+        are queued (and not received), CategorizeMessages is more
+        efficient.
         """
-        return self._scheduler._suspend(self, timeout, alarm_value, AsynCoro._AwaitMsg_)
+        if match is None:
+            return self._scheduler._suspend(self, timeout, alarm_value, AsynCoro._AwaitMsg_)
+        else:
+            return self._scheduler._receive_match(self, timeout, alarm_value, match, None)
 
     recv = receive
 
+    def async_receive(self, timeout=None, alarm_value=None, match=None):
+        """Same as 'receive', but must be used with 'await' as 'message =
+        await coro.async_receive()' in native coroutines.
+        """
+        return _awaitable(self.receive(timeout=timeout, alarm_value=alarm_value, match=match))
+
+    async_recv = async_receive
+
+    @_coroutine
+    def receive_batch(self, max_n, timeout=None):
+        """Must be used with 'yield' as 'messages = yield
+        coro.receive_batch(max_n)'. Gets/waits for messages.
+
+        Gets up to 'max_n' earliest queued messages (as list) if any
+        are available, without suspending. Otherwise, suspends until a
+        message is received (which is returned along with up to
+        'max_n' - 1 messages queued by then), or until 'timeout', in
+        which case empty list is returned. If 'max_n' is not positive,
+        empty list is returned without waiting (as with 'get_many' of
+        Queue).
+        """
+        if max_n <= 0:
+            return []
+        msgs = self._scheduler._receive_many(self, max_n)
+        if msgs:
+            return msgs
+        msg = yield self._scheduler._suspend(self, timeout, _NoMessage, AsynCoro._AwaitMsg_)
+        if msg is _NoMessage:
+            return []
+        msgs = [msg]
+        if max_n > 1:
+            msgs.extend(self._scheduler._receive_many(self, max_n - 1))
+        return msgs
+
     def throw(self, *args):
         """Throw exception in coroutine. This method must be called from
         coro only.
@@ -2694,22 +3904,13 @@ class Coro(object):
         Once coroutine stops (finishes) executing, the last value is
          returned.
         """
-        value = None
-        self._scheduler._lock.acquire()
-        if self._complete is None:
-            self._complete = threading.Event()
-            self._scheduler._lock.release()
-            if self._complete.wait(timeout=timeout) is True:
-                value = self._value
-        elif self._complete == 0:
-            self._scheduler._lock.release()
-            value = self._value
-        else:
-            self._scheduler._lock.release()
-            if self._complete.wait(timeout=timeout) is True:
-                value = self._value
-        return value
+        complete = threading.Event()
+        if self._scheduler._add_complete(self, complete):
+            if complete.wait(timeout=timeout) is not True:
+                return None
+        return self._value
 
+    @_coroutine
     def finish(self, timeout=None):
         """Get last value 'yield'ed / value of StopIteration of
         coro. Must be used in a coroutine with 'yield' as
@@ -2719,19 +3920,25 @@ class Coro(object):
         returned.
         """
         value = None
-        if self._complete is None:
-            self._complete = Event()
-            if (yield self._complete.wait(timeout=timeout)) is True:
-                value = self._value
-        elif self._complete == 0:
+        complete = self._complete
+        if complete == 0:
             value = self._value
-        elif isinstance(self._complete, Event):
-            if (yield self._complete.wait(timeout=timeout)) is True:
-                value = self._value
         else:
-            raise RuntimeError('invalid wait on %s/%s: %s' %
-                               (self._name, self._id, type(self._complete)))
-        raise StopIteration(value)
+            # reuse Event added by earlier 'finish' (e.g., with timeout)
+            event = None
+            if isinstance(complete, Event):
+                event = complete
+            elif isinstance(complete, list):
+                for waiter in complete:
+                    if isinstance(waiter, Event):
+                        event = waiter
+                        break
+            if event is None:
+                event = Event()
+                self._scheduler._add_complete(self, event)
+            if (yield event.wait(timeout=timeout)) is True:
+                value = self._value
+        return value
 
     def terminate(self):
         """Terminate coro.
@@ -2783,6 +3990,7 @@ class Coro(object):
         self._swap_generator = generator
         return self._scheduler._swap_generator(self)
 
+    @_coroutine
     def monitor(self, observe):
         """Must be used with 'yield' as 'yield coro.monitor(observe)',
         where 'observe' is a coroutine which will be monitored by
@@ -2803,7 +4011,7 @@ class Coro(object):
                                                      'coro': observe._id},
                                   dst=observe._location, timeout=MsgTimeout)
             reply = yield _Peer._sync_reply(request)
-        raise StopIteration(reply)
+        return reply
 
     def notify(self, monitor):
         """Similar to 'monitor' method, except that it is invoked with
@@ -2845,13 +4053,21 @@ class Coro(object):
             target = kwargs.pop('target', None)
             args = kwargs.pop('args', ())
             kwargs = kwargs.pop('kwargs', kwargs)
-        if not inspect.isgeneratorfunction(target):
-            raise Exception('%s is not a generator!' % target.__name__)
-        if target.__defaults__ and \
-           'coro' in target.__code__.co_varnames[:target.__code__.co_argcount][-len(target.__defaults__):]:
+        if Coro.__check_target(target):
             kwargs['coro'] = coro
         return target(*args, **kwargs)
 
+    @staticmethod
+    def __check_target(target):
+        """Internal use only.
+
+        Returns True if 'target' takes 'coro' keyword argument.
+        """
+        if not inspect.isgeneratorfunction(target) and not _iscoroutinefunction(target):
+            raise Exception('%s is not a generator!' % target.__name__)
+        return bool(target.__defaults__) and \
+            'coro' in target.__code__.co_varnames[:target.__code__.co_argcount][-len(target.__defaults__):]
+
     def __getstate__(self):
         state = {'name': self._name, 'id': str(self._id), 'location': self._location}
         return state
@@ -2895,6 +4111,65 @@ class Coro(object):
             return hash(id(self))
 
 
+@_coroutine
+def gather(coros, timeout=None):
+    """Must be used with 'yield' as 'results = yield
+    asyncoro.gather(coros)'.
+
+    Waits for (local) coroutines in 'coros' to finish and returns list
+    of their values, in same order as 'coros'. If timeout expires
+    before all coroutines finish, values of coroutines that have not
+    finished are None.
+    """
+    coros = list(coros)
+    completions = _Completions(coros)
+    while completions.remaining():
+        if timeout is not None:
+            if timeout <= 0:
+                break
+            start = _time()
+        coro, value = yield from completions.get(timeout)
+        if coro is None:
+            break
+        if timeout is not None:
+            timeout -= (_time() - start)
+    if completions.remaining():
+        completions.close(coros)
+    return [(coro._value if coro._complete == 0 else None) for coro in coros]
+
+
+@_coroutine
+def wait_any(coros, timeout=None):
+    """Must be used with 'yield' as 'coro, value = yield
+    asyncoro.wait_any(coros)'.
+
+    Waits until any of (local) coroutines in 'coros' finishes and
+    returns that coroutine and its value. If no coroutine finishes
+    before timeout, (None, None) is returned.
+    """
+    coros = list(coros)
+    completions = _Completions(coros)
+    coro, value = yield from completions.get(timeout)
+    completions.close(coros)
+    return (coro, value)
+
+
+def as_completed(coros):
+    """Returns object to retrieve (local) coroutines in 'coros', and
+    their values, as they finish (in order of completion), e.g.,
+
+    completions = asyncoro.as_completed(coros)
+    while completions.remaining():
+        coro, value = yield completions.get()
+
+    'get' takes optional timeout and returns (None, None) if no
+    coroutine finishes before timeout. Once retrieved, coroutines are
+    not referenced by this object, so finished coroutines (and their
+    values) can be freed early.
+    """
+    return _Completions(coros)
+
+
 class Location(object):
     """Distributed asyncoro, coroutines, channels use Location to
     identify where they are running, where to send a message etc.
@@ -3005,6 +4280,7 @@ class Channel(object):
         return self._name[1:]
 
     @staticmethod
+    @_coroutine
     def locate(name, location=None, timeout=None):
         """Must be used with 'yield' as
         'rchannel = yield Channel.locate("name")'.
@@ -3017,7 +4293,7 @@ class Channel(object):
         if not location or location == Channel._asyncoro._location:
             rchannel = Channel._asyncoro._channels.get('~' + name, None)
             if rchannel or location == Channel._asyncoro._location:
-                raise StopIteration(rchannel)
+                return rchannel
         req = _NetRequest('locate_channel', kwargs={'name': '~' + name},
                           dst=location, timeout=timeout)
         req.event = Event()
@@ -3032,7 +4308,7 @@ class Channel(object):
         SysCoro._asyncoro._pending_reqs.pop(req_id, None)
         SysCoro._asyncoro._lock.release()
         rchannel = req.reply
-        raise StopIteration(rchannel)
+        return rchannel
 
     def register(self):
         """A registered channel can be located (with 'locate') by a
@@ -3061,7 +4337,8 @@ class Channel(object):
         self._transform = transform
         return 0
 
-    def subscribe(self, subscriber, timeout=None):
+    @_coroutine
+    def subscribe(self, subscriber, timeout=None, conflate=None):
         """Must be used with 'yield', as, for example,
         'yield channel.subscribe(coro)'.
 
@@ -3069,11 +4346,24 @@ class Channel(object):
         subscribe. A message sent to this channel is delivered to all
         subscribers.
 
+        If 'conflate' is not None, it must be a function that returns
+        key for a message, which is used to conflate messages queued
+        for subscriber, which must be a local coroutine; see
+        'set_conflate' in Coro. Note that conflation applies to all
+        messages sent to subscriber, not just those from this channel.
+
         Can also be used on remote channels.
         """
         if not isinstance(subscriber, Coro) and not isinstance(subscriber, Channel):
             logger.warning('invalid subscriber ignored')
-            raise StopIteration(-1)
+            return -1
+        if conflate is not None:
+            if not isinstance(subscriber, Coro) or \
+               subscriber._location != Channel._asyncoro._location:
+                logger.warning('conflate is supported for local coroutines only')
+                return -1
+            if subscriber.set_conflate(conflate) != 0:
+                return -1
         if self._location == Channel._asyncoro._location:
             if subscriber._location != self._location:
                 if isinstance(subscriber, Coro):
@@ -3102,8 +4392,9 @@ class Channel(object):
             kwargs['subscriber'] = subscriber
             request = _NetRequest('subscribe', kwargs=kwargs, dst=self._location, timeout=timeout)
             reply = yield _Peer._sync_reply(request)
-        raise StopIteration(reply)
+        return reply
 
+    @_coroutine
     def unsubscribe(self, subscriber, timeout=None):
         """Must be called with 'yield' as, for example,
         'yield channel.unsubscribe(coro)'.
@@ -3114,7 +4405,7 @@ class Channel(object):
         """
         if not isinstance(subscriber, Coro) and not isinstance(subscriber, Channel):
             logger.warning('invalid subscriber ignored')
-            raise StopIteration(-1)
+            return -1
         if self._location == Channel._asyncoro._location:
             if subscriber._location != self._location:
                 if isinstance(subscriber, Coro):
@@ -3144,7 +4435,7 @@ class Channel(object):
             kwargs['subscriber'] = subscriber
             request = _NetRequest('unsubscribe', kwargs=kwargs, dst=self._location, timeout=timeout)
             reply = yield _Peer._sync_reply(request)
-        raise StopIteration(reply)
+        return reply
 
     def send(self, message):
         """Message is sent to currently registered subscribers.
@@ -3166,7 +4457,8 @@ class Channel(object):
                     return 0
             invalid = []
             for subscriber in subscribers:
-                if subscriber.send(message) != 0:
+                # message may be dropped / refused if subscriber's mailbox is full
+                if subscriber.send(message) == -1:
                     invalid.append(subscriber)
             if invalid:
                 def _unsub(self, subscriber, coro=None):
@@ -3184,6 +4476,7 @@ class Channel(object):
                 return -1
         return 0
 
+    @_coroutine
     def deliver(self, message, timeout=None, n=0):
         """Must be used with 'yield' as 'rcvd = yield channel.deliver(message)'.
 
@@ -3196,7 +4489,7 @@ class Channel(object):
         Can also be used on remote channels.
         """
         if not isinstance(n, int) or n < 0:
-            raise StopIteration(-1)
+            return -1
         if self._location == Channel._asyncoro._location:
             self._scheduler._lock.acquire()
             transform = self._transform
@@ -3209,7 +4502,7 @@ class Channel(object):
                 except:
                     message = None
                 if message is None:
-                    raise StopIteration(0)
+                    return 0
             if n:
                 while len(subscribers) < n:
                     start = _time()
@@ -3217,11 +4510,11 @@ class Channel(object):
                     self._subscribe_event.clear()
                     self._scheduler._lock.release()
                     if (yield self._subscribe_event.wait(timeout)) is False:
-                        raise StopIteration(0)
+                        return 0
                     if timeout is not None:
                         timeout -= _time() - start
                         if timeout <= 0:
-                            raise StopIteration(0)
+                            return 0
                     self._scheduler._lock.acquire()
                     subscribers = list(self._subscribers)
                     self._scheduler._lock.release()
@@ -3246,7 +4539,12 @@ class Channel(object):
                     info['done'].set()
             for subscriber in subscribers:
                 if isinstance(subscriber, Coro) and self._location == subscriber._location:
-                    if subscriber.send(message) == 0:
+                    reply = subscriber.send(message)
+                    if reply == -2:
+                        # mailbox is full; 'deliver' waits if necessary
+                        Coro(_deliver, subscriber, info, timeout, n)
+                        continue
+                    if reply == 0:
                         info['reply'] += 1
                         info['success'] += 1
                     info['pending'] -= 1
@@ -3265,7 +4563,7 @@ class Channel(object):
                 for subscriber in info['invalid']:
                     Coro(_unsub, self, subscriber)
 
-            raise StopIteration(info['reply'])
+            return info['reply']
         else:
             # remote channel
             request = _NetRequest('deliver', kwargs={'message': message, 'channel': self._name,
@@ -3278,7 +4576,7 @@ class Channel(object):
             # if reply < 0:
             #     logger.warning('remote channel "%s" at %s may have gone away!',
             #                    self._name, self._location)
-            raise StopIteration(reply)
+            return reply
 
     def close(self):
         if self._location == Channel._asyncoro._location:
@@ -3332,21 +4630,26 @@ class CategorizeMessages(object):
         """Categorize messages to coroutine 'coro'.
         """
         self._coro = coro
-        self._categories = {None: collections.deque()}
         self._categorize = []
 
     def add(self, categorize):
         """Add given method to categorize messages. When a message is
-        received, each of the added methods (most recently added
-        method first) is called with the message. The method should
+        sent to coroutine, each of the added methods (most recently
+        added method first) is called with the message. The method should
         return a category (any hashable object) or None (in which case
         next recently added method is called with the same
         message). If all the methods return None for a given message,
         the message is queued with category=None, so that 'receive'
         method here works just as Coro.receive.
+
+        As messages are categorized when they are sent, coroutine
+        waiting for a category is resumed only when a message in that
+        category is sent. Messages that are not categorized can also
+        be received with Coro.receive. Messages queued when this
+        method is called are categorized as well.
         """
         if inspect.isfunction(categorize):
-            argspec = inspect.getargspec(categorize)
+            argspec = inspect.getfullargspec(categorize)
             if len(argspec.args) != 1:
                 categorize = None
         elif type(categorize) != partial_func:
@@ -3354,6 +4657,7 @@ class CategorizeMessages(object):
 
         if categorize:
             self._categorize.insert(0, categorize)
+            self._coro._scheduler._set_categorize(self._coro, tuple(self._categorize))
         else:
             logger.warning('invalid categorize function ignored')
 
@@ -3364,64 +4668,264 @@ class CategorizeMessages(object):
             self._categorize.remove(categorize)
         except ValueError:
             logger.warning('invalid categorize function')
+        else:
+            self._coro._scheduler._set_categorize(self._coro, tuple(self._categorize))
 
+    @_coroutine
     def receive(self, category=None, timeout=None, alarm_value=None):
         """Similar to 'receive' of Coro, except it retrieves (waiting,
         if necessary) messages in given 'category'.
         """
         # assert AsynCoro.cur_coro() == self._coro
-        c = self._categories.get(category, None)
-        if c:
-            msg = c.popleft()
-            raise StopIteration(msg)
-        if timeout:
-            start = _time()
-        while 1:
-            msg = yield self._coro.receive(timeout=timeout, alarm_value=alarm_value)
-            if msg == alarm_value:
-                raise StopIteration(msg)
-            for categorize in self._categorize:
-                c = categorize(msg)
-                if c == category:
-                    raise StopIteration(msg)
-                if c is not None:
-                    bucket = self._categories.get(c, None)
-                    if not bucket:
-                        bucket = self._categories[c] = collections.deque()
-                    bucket.append(msg)
-                    break
-            else:
-                self._categories[None].append(msg)
-            if timeout:
-                now = _time()
-                timeout -= now - start
-                start = now
+        msg = yield self._coro._scheduler._receive_match(self._coro, timeout, _NoMessage, None,
+                                                         (category,))
+        if msg is _NoMessage:
+            return alarm_value
+        return msg[1]
 
     recv = receive
 
+    @_coroutine
+    def receive_any(self, categories, timeout=None, alarm_value=None):
+        """Must be used with 'yield' as 'category, message = yield
+        categorize.receive_any(categories)'.
 
-class AsynCoro(object, metaclass=Singleton):
-    """Coroutine scheduler.
+        Similar to 'receive', except it retrieves (waiting, if
+        necessary) earliest message in any of the categories in list
+        'categories'; the result is tuple (category, message) or
+        alarm_value if timeout happens.
+        """
+        msg = yield self._coro._scheduler._receive_match(self._coro, timeout, _NoMessage, None,
+                                                         tuple(categories))
+        if msg is _NoMessage:
+            return alarm_value
+        return msg
 
-    The scheduler is created and started automatically (when a
-    coroutine is created, for example), so there is no reason to
-    create it explicitly. To use distributed programming, AsynCoro in
-    disasyncoro module should be used.
+
+class Router(object):
+    """Routes messages to a pool of (identical) worker coroutines,
+    balancing load among them according to policy:
+
+    Router.RoundRobin sends messages to workers in turn.
+
+    Router.LeastDepth sends a message to worker with fewest messages
+    queued (so workers that are slow, e.g., due to costly messages,
+    get fewer messages). Mailboxes of remote workers can't be
+    inspected, so depth of a remote worker is taken as average depth
+    of local workers (and workers with same depth get messages in
+    turn).
+
+    Router.ConsistentHash sends messages with same key to same worker
+    (e.g., so messages for an item are processed in order by one
+    worker). When workers are added or removed, only keys of (about)
+    1/n of workers move to other workers.
+
+    Workers can be local or remote coroutines.
     """
 
-    _instance = None
-    _schedulers = {}
+    RoundRobin = 0
+    LeastDepth = 1
+    ConsistentHash = 2
 
-    # in _scheduled set, waiting for turn to execute
+    # number of points on hash ring for each worker
+    _hash_replicas = 64
+
+    def __init__(self, worker_gen=None, n=0, policy=RoundRobin, key=None,
+                 args=(), kwargs=None):
+        """If 'worker_gen' is given, 'n' workers are created as
+        'Coro(worker_gen, *args, **kwargs)'; more workers can be added
+        with 'add' (e.g., remote coroutines) and number of workers can
+        be changed with 'resize'.
+
+        With Router.ConsistentHash policy, key of a message is either
+        given in 'send' or is obtained by calling 'key' with message
+        (if 'key' is None, message itself is the key).
+        """
+        if policy not in (Router.RoundRobin, Router.LeastDepth, Router.ConsistentHash):
+            logger.warning('invalid policy %s; using RoundRobin', policy)
+            policy = Router.RoundRobin
+        self._worker_gen = worker_gen
+        self._policy = policy
+        self._key = key
+        self._args = args
+        self._kwargs = kwargs or {}
+        self._workers = []
+        self._next = 0
+        # hash ring: sorted points and worker at each point
+        self._ring = []
+        self._ring_workers = []
+        if worker_gen:
+            self.resize(n)
+
+    @staticmethod
+    def _hash(key):
+        return struct.unpack('>Q', hashlib.md5(repr(key).encode()).digest()[:8])[0]
+
+    def workers(self):
+        """Returns (copy of) list of workers.
+        """
+        return list(self._workers)
+
+    def depths(self):
+        """Returns list of (worker, depth), where 'depth' is number of
+        messages queued for worker, or None for remote workers.
+        """
+        return [(worker, self._depth(worker)) for worker in self._workers]
+
+    def _depth(self, worker):
+        """Internal use only.
+        """
+        if worker._scheduler:
+            msgs = worker._msgs
+            return len(msgs) if msgs else 0
+        return None
+
+    def add(self, worker):
+        """Adds (local or remote) coroutine 'worker' to pool.
+        """
+        if not isinstance(worker, Coro) or worker in self._workers:
+            logger.warning('invalid worker %s ignored', worker)
+            return -1
+        self._workers.append(worker)
+        if self._policy == Router.ConsistentHash:
+            for i in range(self._hash_replicas):
+                point = Router._hash('%r:%s' % (worker, i))
+                j = bisect_left(self._ring, point)
+                self._ring.insert(j, point)
+                self._ring_workers.insert(j, worker)
+        return 0
+
+    def remove(self, worker):
+        """Removes 'worker' from pool, so no more messages are sent to
+        it. Worker itself is not terminated.
+        """
+        try:
+            i = self._workers.index(worker)
+        except ValueError:
+            return -1
+        del self._workers[i]
+        if self._next > i:
+            self._next -= 1
+        if self._ring:
+            ring = [(point, w) for point, w in zip(self._ring, self._ring_workers)
+                    if w != worker]
+            self._ring = [point for point, w in ring]
+            self._ring_workers = [w for point, w in ring]
+        return 0
+
+    def resize(self, n):
+        """Changes number of workers to 'n': new workers are created
+        with 'worker_gen' (given to Router), or most recently added
+        workers are removed. Returns list of removed workers, which
+        are not terminated (e.g., they can be sent a message to quit
+        after processing messages already queued).
+        """
+        removed = []
+        while len(self._workers) < n:
+            if not self._worker_gen:
+                logger.warning('Router can\'t create workers without "worker_gen"')
+                break
+            self.add(Coro(self._worker_gen, *self._args, **self._kwargs))
+        while len(self._workers) > max(n, 0):
+            worker = self._workers[-1]
+            self.remove(worker)
+            removed.append(worker)
+        return removed
+
+    def _select(self, message, key):
+        """Internal use only.
+        """
+        workers = self._workers
+        n = len(workers)
+        if n == 1:
+            return workers[0]
+        if self._policy == Router.ConsistentHash:
+            if key is None:
+                key = self._key(message) if self._key else message
+            i = bisect_left(self._ring, Router._hash(key))
+            if i == len(self._ring):
+                i = 0
+            return self._ring_workers[i]
+        start = self._next
+        if start >= n:
+            start = 0
+        self._next = start + 1
+        if self._policy == Router.RoundRobin:
+            return workers[start]
+        depths = [self._depth(worker) for worker in workers]
+        local = [depth for depth in depths if depth is not None]
+        estimate = (sum(local) // len(local)) if local else 0
+        best = None
+        for i in range(start, start + n):
+            i %= n
+            depth = depths[i]
+            if depth is None:
+                depth = estimate
+            if best is None or depth < best_depth:
+                best, best_depth = i, depth
+                if depth == 0:
+                    break
+        return workers[best]
+
+    def send(self, message, key=None):
+        """May be used with 'yield'. Sends 'message' to a worker chosen
+        as per policy. Workers that are no longer valid are removed.
+
+        Returns 0 if message is sent and -1 if there are no (valid)
+        workers; see 'send' in Coro for other values.
+        """
+        while self._workers:
+            worker = self._select(message, key)
+            reply = worker.send(message)
+            if reply != -1:
+                return reply
+            self.remove(worker)
+        return -1
+
+    @_coroutine
+    def deliver(self, message, key=None, timeout=None):
+        """Must be used with 'yield' as 'yield router.deliver(message)'.
+        Same as 'send', except that message is delivered with 'deliver'
+        in Coro, so if mailbox of chosen worker is full (and its policy
+        is MailboxBlock), waits until there is room in mailbox.
+
+        Returns 1 if message is delivered, 0 if it couldn't be
+        delivered before timeout and -1 if there are no (valid)
+        workers.
+        """
+        while self._workers:
+            worker = self._select(message, key)
+            reply = yield worker.deliver(message, timeout=timeout)
+            if reply >= 0:
+                return reply
+            self.remove(worker)
+        return -1
+
+
+class AsynCoro(object, metaclass=Singleton):
+    """Coroutine scheduler.
+
+    The scheduler is created and started automatically (when a
+    coroutine is created, for example), so there is no reason to
+    create it explicitly. To use distributed programming, AsynCoro in
+    disasyncoro module should be used.
+    """
+
+    _instance = None
+    _schedulers = {}
+
+    # in _scheduled queue, waiting for turn to execute
     _Scheduled = 1
-    # in _scheduled, currently executing
+    # currently executing
     _Running = 2
-    # in _suspended, waiting for resume
+    # suspended, waiting for resume
     _Suspended = 3
-    # in _suspended, waiting for I/O operation
+    # suspended, waiting for I/O operation
     _AwaitIO_ = 4
-    # in _suspended, waiting for message
+    # suspended, waiting for message
     _AwaitMsg_ = 5
+    # suspended, waiting for message that matches or is in given category
+    _AwaitMatch_ = 6
 
     def __init__(self):
         if not AsynCoro._instance:
@@ -3431,9 +4935,19 @@ class AsynCoro(object, metaclass=Singleton):
         self._name = ''
         self.__cur_coro = None
         self._coros = {}
-        self._scheduled = set()
-        self._suspended = set()
-        self._timeouts = []
+        # run queue of coroutines in _Scheduled state, in FIFO order for
+        # each priority; a coroutine is appended only when its state
+        # changes to _Scheduled
+        self._scheduled = _ReadyQueue()
+        # resume / throw requests from other threads; scheduler processes
+        # them once per iteration, so other threads need not take the lock
+        self._handoff = collections.deque()
+        # ready coroutines are run for at most '_run_steps' steps or
+        # '_run_time' seconds before polling for I/O events; see
+        # set_run_budget
+        self._run_steps = 1000
+        self._run_time = 0.005
+        self._timers = _TimerWheel()
         self._quit = False
         self._daemons = 0
         self._channels = {}
@@ -3493,8 +5007,21 @@ class AsynCoro(object, metaclass=Singleton):
         self._coros[coro._id] = coro
         self._complete.clear()
         coro._state = AsynCoro._Scheduled
-        self._scheduled.add(coro._id)
-        if self._polling and len(self._scheduled) == 1:
+        self._scheduled.append(coro)
+        if self._polling:
+            self._notifier.interrupt()
+        self._lock.release()
+
+    def _add_many(self, coros):
+        """Internal use only. See spawn_many in Coro.
+        """
+        self._lock.acquire()
+        self._complete.clear()
+        for coro in coros:
+            self._coros[coro._id] = coro
+            coro._state = AsynCoro._Scheduled
+            self._scheduled.append(coro)
+        if self._polling:
             self._notifier.interrupt()
         self._lock.release()
 
@@ -3502,16 +5029,193 @@ class AsynCoro(object, metaclass=Singleton):
         """Internal use only.
         """
         self._lock.acquire()
-        try:
-            self._scheduled.remove(coro._id)
-        except KeyError:
+        coro = self._coros.get(coro._id, None)
+        if coro is None or coro._state != AsynCoro._Scheduled:
             ret = -1
         else:
+            # entry in _scheduled is skipped by scheduler
+            coro._state = None
             self._coros.pop(coro._id, None)
             ret = 0
         self._lock.release()
         return ret
 
+    def _set_priority(self, coro, priority):
+        """Internal use only. See priority in Coro.
+        """
+        if priority not in (Coro.HighPriority, Coro.NormalPriority, Coro.LowPriority):
+            logger.warning('invalid priority %s for %s', priority, coro)
+            return -1
+        if threading.current_thread() is not self._scheduler:
+            # scheduler takes coroutines off run queue without lock, so
+            # only scheduler can move coroutine to queue for new priority
+            return self._handoff_req(self._set_priority, coro, priority)
+        self._lock.acquire()
+        try:
+            coro = self._coros.get(coro._id, None)
+            if coro is None:
+                logger.warning('invalid coroutine to set priority')
+                return -1
+            if coro._priority != priority:
+                if coro._state == AsynCoro._Scheduled:
+                    # move to queue for new priority, unless it has been
+                    # taken off the queue (to run) already
+                    try:
+                        self._scheduled.remove(coro)
+                    except ValueError:
+                        coro._priority = priority
+                    else:
+                        coro._priority = priority
+                        self._scheduled.append(coro)
+                else:
+                    coro._priority = priority
+        finally:
+            self._lock.release()
+        return 0
+
+    def _set_mailbox(self, coro, capacity, overflow):
+        """Internal use only. See set_mailbox in Coro.
+        """
+        if capacity is not None and (not isinstance(capacity, int) or capacity < 1):
+            logger.warning('invalid mailbox capacity %s for %s', capacity, coro)
+            return -1
+        if overflow not in (Coro.MailboxBlock, Coro.MailboxReject, Coro.MailboxDropOldest,
+                            Coro.MailboxDropNewest):
+            logger.warning('invalid mailbox policy %s for %s', overflow, coro)
+            return -1
+        self._lock.acquire()
+        coro = self._coros.get(coro._id, None)
+        if coro is None:
+            self._lock.release()
+            logger.warning('invalid coroutine to set mailbox')
+            return -1
+        mailbox = coro._mailbox
+        if mailbox:
+            mailbox.capacity = capacity
+            mailbox.overflow = overflow
+            if capacity is None and mailbox.key is None and mailbox.buckets is None:
+                coro._mailbox = None
+            # let senders blocked in 'deliver' try again
+            mailbox.waiting.wake_all()
+        elif capacity is not None:
+            coro._mailbox = _Mailbox(capacity, overflow)
+        self._lock.release()
+        return 0
+
+    def _set_conflate(self, coro, key):
+        """Internal use only. See set_conflate in Coro.
+        """
+        if key is not None and not callable(key):
+            logger.warning('invalid conflation key %s for %s', key, coro)
+            return -1
+        self._lock.acquire()
+        coro = self._coros.get(coro._id, None)
+        if coro is None:
+            self._lock.release()
+            logger.warning('invalid coroutine to set conflation')
+            return -1
+        mailbox = coro._mailbox
+        if key is None:
+            if mailbox:
+                mailbox.key = mailbox.latest = None
+                if mailbox.capacity is None and mailbox.buckets is None:
+                    coro._mailbox = None
+        else:
+            if not mailbox:
+                mailbox = coro._mailbox = _Mailbox()
+            if mailbox.key != key:
+                # messages already queued are not conflated
+                mailbox.key = key
+                mailbox.latest = {}
+        self._lock.release()
+        return 0
+
+    def _get_mailbox(self, coro):
+        """Internal use only. See deliver in Coro.
+        """
+        self._lock.acquire()
+        coro = self._coros.get(coro._id, None)
+        mailbox = coro._mailbox if coro else None
+        self._lock.release()
+        return mailbox
+
+    def _mailbox_stats(self, coro):
+        """Internal use only. See mailbox_stats in Coro.
+        """
+        self._lock.acquire()
+        coro = self._coros.get(coro._id, None)
+        if coro is None:
+            self._lock.release()
+            return None
+        depth = len(coro._msgs) if coro._msgs else 0
+        mailbox = coro._mailbox
+        if mailbox and mailbox.buckets:
+            depth += sum(len(bucket) for bucket in mailbox.buckets.values())
+        if mailbox:
+            stats = (depth, mailbox.dropped, mailbox.refused, mailbox.conflated)
+        else:
+            stats = (depth, 0, 0, 0)
+        self._lock.release()
+        return stats
+
+    def _add_complete(self, coro, waiter):
+        """Internal use only.
+
+        Adds 'waiter' (Event, threading.Event or _Completions) to be
+        notified when 'coro' finishes. Returns False if 'coro' has
+        already finished.
+        """
+        self._lock.acquire()
+        complete = coro._complete
+        if complete == 0:
+            self._lock.release()
+            return False
+        if complete is None:
+            coro._complete = waiter
+        elif isinstance(complete, list):
+            complete.append(waiter)
+        else:
+            coro._complete = [complete, waiter]
+        self._lock.release()
+        return True
+
+    def _discard_complete(self, coro, waiter):
+        """Internal use only.
+
+        Removes 'waiter' added with '_add_complete'.
+        """
+        self._lock.acquire()
+        complete = coro._complete
+        if complete is waiter:
+            coro._complete = None
+        elif isinstance(complete, list):
+            try:
+                complete.remove(waiter)
+            except ValueError:
+                pass
+            if not complete:
+                coro._complete = None
+        self._lock.release()
+
+    def _notify_complete(self, coro):
+        """Internal use only.
+
+        Called (with lock held) when 'coro' finishes, to notify waiters
+        added with '_add_complete'.
+        """
+        complete = coro._complete
+        coro._complete = 0
+        if isinstance(complete, list):
+            for waiter in complete:
+                if isinstance(waiter, _Completions):
+                    waiter.completed(coro)
+                else:
+                    waiter.set()
+        elif isinstance(complete, _Completions):
+            complete.completed(coro)
+        else:
+            complete.set()
+
     def _set_daemon(self, coro, flag):
         """Internal use only. See set_daemon in Coro.
         """
@@ -3542,6 +5246,8 @@ class AsynCoro(object, metaclass=Singleton):
             self._lock.release()
             logger.warning('monitor: invalid coroutine: %s / %s', coro, type(monitor))
             return -1
+        if coro._monitors is None:
+            coro._monitors = set()
         coro._monitors.add(monitor)
         self._lock.release()
         return 0
@@ -3556,11 +5262,15 @@ class AsynCoro(object, metaclass=Singleton):
             return -1
         cid = coro._id
         if state == AsynCoro._AwaitMsg_ and coro._msgs:
-            s, update = coro._msgs[0]
-            if s == state:
+            entry = coro._msgs[0]
+            if entry[0] == state:
                 coro._msgs.popleft()
+                mailbox = coro._mailbox
+                if mailbox:
+                    mailbox.discard(entry)
+                    mailbox.waiting.wake()
                 self._lock.release()
-                return update
+                return entry[1]
         if timeout is None:
             coro._timeout = None
         else:
@@ -3572,17 +5282,25 @@ class AsynCoro(object, metaclass=Singleton):
                 self._lock.release()
                 return alarm_value
             else:
-                coro._timeout = _time() + timeout + 0.0001
-                heappush(self._timeouts, (coro._timeout, cid, alarm_value))
-        self._scheduled.discard(cid)
-        self._suspended.add(cid)
+                coro._timeout = self._timers.add(_time() + timeout, (coro, alarm_value))
+        if state == AsynCoro._AwaitMsg_ and coro._mailbox and coro._mailbox.categorize:
+            # wait for message that is not categorized
+            coro._mailbox.match = coro._mailbox.categories = None
+            state = AsynCoro._AwaitMatch_
         coro._state = state
         self._lock.release()
         return 0
 
-    def _resume(self, coro, update, state):
+    def _resume(self, coro, update, state, bounded=True):
         """Internal use only. See resume in Coro.
+
+        If 'bounded' is False, message is queued even if coro's mailbox
+        is full (used for system messages, such as MonitorException).
         """
+        if threading.current_thread() is not self._scheduler:
+            if state == AsynCoro._AwaitMsg_ and coro._mailbox:
+                return self._put_msgs(coro, [update], bounded)
+            return self._handoff_req(self._resume, coro, update, state)
         self._lock.acquire()
         cid = coro._id
         coro = self._coros.get(cid, None)
@@ -3590,43 +5308,384 @@ class AsynCoro(object, metaclass=Singleton):
             self._lock.release()
             logger.warning('invalid coroutine %s to resume', cid)
             return -1
-        if coro._state == state:
-            coro._timeout = None
+        # if messages sent from other threads are queued for coro waiting
+        # to receive, it will be resumed with those first
+        if coro._state == state and not (state == AsynCoro._AwaitMsg_ and coro._msgs):
+            if coro._timeout:
+                self._timers.cancel(coro._timeout)
+                coro._timeout = None
             coro._value = update
-            self._suspended.discard(cid)
-            self._scheduled.add(cid)
             coro._state = AsynCoro._Scheduled
-            if self._polling and len(self._scheduled) == 1:
+            self._scheduled.append(coro)
+            if self._polling:
                 self._notifier.interrupt()
         elif state == AsynCoro._AwaitMsg_:
+            if coro._msgs is None:
+                coro._msgs = collections.deque()
+            if coro._mailbox:
+                reply = self._mailbox_put(coro, update, bounded=bounded)
+                self._lock.release()
+                return reply
             coro._msgs.append((state, update))
         else:
             logger.warning('ignoring resume for %s: %s', coro, coro._state)
         self._lock.release()
         return 0
 
+    def _resume_many(self, coro, messages):
+        """Internal use only. See send_many in Coro.
+        """
+        if threading.current_thread() is not self._scheduler:
+            if coro._mailbox:
+                return self._put_msgs(coro, messages)
+            return self._handoff_req(self._resume_many, coro, list(messages))
+        self._lock.acquire()
+        cid = coro._id
+        coro = self._coros.get(cid, None)
+        if not coro:
+            self._lock.release()
+            logger.warning('invalid coroutine %s to send messages', cid)
+            return -1
+        i = 0
+        if messages and coro._state == AsynCoro._AwaitMsg_ and not coro._msgs:
+            if coro._timeout:
+                self._timers.cancel(coro._timeout)
+                coro._timeout = None
+            coro._value = messages[0]
+            coro._state = AsynCoro._Scheduled
+            self._scheduled.append(coro)
+            if self._polling:
+                self._notifier.interrupt()
+            i = 1
+        reply = 0
+        if len(messages) > i:
+            if coro._msgs is None:
+                coro._msgs = collections.deque()
+            if coro._mailbox:
+                for message in messages[i:]:
+                    status = self._mailbox_put(coro, message)
+                    if status and reply != -2:
+                        reply = status
+            else:
+                coro._msgs.extend((AsynCoro._AwaitMsg_, message) for message in messages[i:])
+        self._lock.release()
+        return reply
+
+    def _mailbox_put(self, coro, message, resume=True, bounded=True):
+        """Internal use only. Queues 'message' for coro as per its
+        mailbox; must be called with '_lock' held. See set_mailbox and
+        set_conflate in Coro.
+
+        If 'resume' is False, coro waiting for this message is not
+        resumed (see _put_msgs). If 'bounded' is False, message is
+        queued even if mailbox is full.
+        """
+        mailbox = coro._mailbox
+        msgs = coro._msgs
+        if mailbox.categorize:
+            category = mailbox.category(message)
+        else:
+            category = None
+        if resume and coro._state == AsynCoro._AwaitMatch_:
+            if mailbox.categories is None:
+                if category is None and (mailbox.match is None or mailbox.matches(message)):
+                    update = message
+                else:
+                    update = _NoMessage
+            elif category in mailbox.categories:
+                update = (category, message)
+            else:
+                update = _NoMessage
+            if update is not _NoMessage:
+                if coro._timeout:
+                    self._timers.cancel(coro._timeout)
+                    coro._timeout = None
+                mailbox.match = mailbox.categories = None
+                coro._value = update
+                coro._state = AsynCoro._Scheduled
+                self._scheduled.append(coro)
+                if self._polling:
+                    self._notifier.interrupt()
+                return 0
+        if category is not None:
+            # categorized messages are queued by category, without limits
+            bucket = mailbox.buckets.get(category, None)
+            if bucket is None:
+                bucket = mailbox.buckets[category] = collections.deque()
+            bucket.append(message)
+            return 0
+        if mailbox.key:
+            try:
+                key = mailbox.key(message)
+                entry = mailbox.latest.get(key, None)
+            except Exception:
+                logger.warning('conflation key failed for message to %s:\n%s',
+                               coro, traceback.format_exc())
+                # message is not conflated
+                key = entry = object()
+            if isinstance(entry, list):
+                entry[1] = message
+                mailbox.conflated += 1
+                return 0
+        if bounded and mailbox.capacity and len(msgs) >= mailbox.capacity:
+            if mailbox.overflow == Coro.MailboxDropOldest:
+                while len(msgs) >= mailbox.capacity:
+                    mailbox.discard(msgs.popleft())
+                    mailbox.dropped += 1
+            elif mailbox.overflow == Coro.MailboxDropNewest:
+                mailbox.dropped += 1
+                return 1
+            else:
+                mailbox.refused += 1
+                return -2
+        if mailbox.key:
+            entry = [AsynCoro._AwaitMsg_, message, key]
+            mailbox.latest[key] = entry
+            msgs.append(entry)
+        else:
+            msgs.append((AsynCoro._AwaitMsg_, message))
+        return 0
+
+    def _put_msgs(self, coro, messages, bounded=True):
+        """Internal use only. See send and send_many in Coro.
+
+        Queues 'messages' sent from a thread other than scheduler's
+        thread to coro with mailbox, so that status of sending them (as
+        per mailbox) is returned to sender, instead of handing them off
+        to scheduler. If coro is waiting to receive, scheduler resumes
+        it with queued messages.
+        """
+        self._lock.acquire()
+        cid = coro._id
+        coro = self._coros.get(cid, None)
+        if not coro:
+            self._lock.release()
+            logger.warning('invalid coroutine %s to send messages', cid)
+            return -1
+        if coro._msgs is None:
+            coro._msgs = collections.deque()
+        reply = 0
+        if coro._mailbox:
+            for message in messages:
+                status = self._mailbox_put(coro, message, resume=False, bounded=bounded)
+                if status and reply != -2:
+                    reply = status
+        else:
+            coro._msgs.extend((AsynCoro._AwaitMsg_, message) for message in messages)
+        if coro._state in (AsynCoro._AwaitMsg_, AsynCoro._AwaitMatch_):
+            self._handoff_req(self._resume_queued, coro)
+        self._lock.release()
+        return reply
+
+    def _resume_queued(self, coro):
+        """Internal use only. See _put_msgs.
+        """
+        self._lock.acquire()
+        if coro._state == AsynCoro._AwaitMsg_:
+            update = _NoMessage
+            if coro._msgs and coro._msgs[0][0] == AsynCoro._AwaitMsg_:
+                entry = coro._msgs.popleft()
+                mailbox = coro._mailbox
+                if mailbox:
+                    mailbox.discard(entry)
+                    mailbox.waiting.wake()
+                update = entry[1]
+        elif coro._state == AsynCoro._AwaitMatch_:
+            update = self._match_queued(coro)
+            if update is not _NoMessage:
+                coro._mailbox.match = coro._mailbox.categories = None
+        else:
+            # coro has been resumed (e.g., with timeout) already
+            update = _NoMessage
+        if update is not _NoMessage:
+            if coro._timeout:
+                self._timers.cancel(coro._timeout)
+                coro._timeout = None
+            coro._value = update
+            coro._state = AsynCoro._Scheduled
+            self._scheduled.append(coro)
+        self._lock.release()
+        return 0
+
+    def _match_queued(self, coro):
+        """Internal use only. Removes and returns queued message that
+        coro waiting with 'receive' (with 'match' or categories of
+        messages) is waiting for, or _NoMessage if there is no such
+        message; must be called with '_lock' held.
+        """
+        mailbox = coro._mailbox
+        msgs = coro._msgs
+        if mailbox.categories is None:
+            if msgs:
+                for i, entry in enumerate(msgs):
+                    if entry[0] == AsynCoro._AwaitMsg_ and (mailbox.match is None or
+                                                            mailbox.matches(entry[1])):
+                        del msgs[i]
+                        mailbox.discard(entry)
+                        mailbox.waiting.wake()
+                        return entry[1]
+        else:
+            for category in mailbox.categories:
+                if category is None:
+                    if msgs and msgs[0][0] == AsynCoro._AwaitMsg_:
+                        entry = msgs.popleft()
+                        mailbox.discard(entry)
+                        mailbox.waiting.wake()
+                        return (None, entry[1])
+                elif mailbox.buckets:
+                    bucket = mailbox.buckets.get(category, None)
+                    if bucket:
+                        return (category, bucket.popleft())
+        return _NoMessage
+
+    def _receive_many(self, coro, n):
+        """Internal use only. See receive_batch in Coro.
+        """
+        self._lock.acquire()
+        msgs = coro._msgs
+        if not msgs:
+            self._lock.release()
+            return []
+        mailbox = coro._mailbox
+        if n >= len(msgs):
+            batch = [entry[1] for entry in msgs]
+            msgs.clear()
+            if mailbox and mailbox.latest:
+                mailbox.latest.clear()
+        else:
+            popleft = msgs.popleft
+            if mailbox and mailbox.latest:
+                batch = []
+                for i in range(n):
+                    entry = popleft()
+                    mailbox.discard(entry)
+                    batch.append(entry[1])
+            else:
+                batch = [popleft()[1] for i in range(n)]
+        if mailbox:
+            waiting = mailbox.waiting
+            for i in range(len(batch)):
+                if not waiting.wake():
+                    break
+        self._lock.release()
+        return batch
+
+    def _receive_match(self, coro, timeout, alarm_value, match, categories):
+        """Internal use only. See receive in Coro and CategorizeMessages.
+        """
+        self._lock.acquire()
+        if self.__cur_coro != coro:
+            self._lock.release()
+            logger.warning('invalid "receive" - "%s" != "%s"', coro, self.__cur_coro)
+            return -1
+        mailbox = coro._mailbox
+        if mailbox is None:
+            mailbox = coro._mailbox = _Mailbox()
+        mailbox.match = match
+        mailbox.categories = categories
+        message = self._match_queued(coro)
+        if message is not _NoMessage:
+            self._lock.release()
+            return message
+        if timeout is None:
+            coro._timeout = None
+        else:
+            if not isinstance(timeout, (float, int)):
+                logger.warning('invalid timeout %s', timeout)
+                self._lock.release()
+                return -1
+            if timeout <= 0:
+                self._lock.release()
+                return alarm_value
+            else:
+                coro._timeout = self._timers.add(_time() + timeout, (coro, alarm_value))
+        coro._state = AsynCoro._AwaitMatch_
+        self._lock.release()
+        return 0
+
+    def _set_categorize(self, coro, categorize):
+        """Internal use only. See CategorizeMessages.
+        """
+        self._lock.acquire()
+        coro = self._coros.get(coro._id, None)
+        if coro is None:
+            self._lock.release()
+            logger.warning('invalid coroutine to categorize messages')
+            return -1
+        mailbox = coro._mailbox
+        if mailbox is None:
+            mailbox = coro._mailbox = _Mailbox()
+        if categorize:
+            mailbox.categorize = categorize
+            if mailbox.buckets is None:
+                mailbox.buckets = {}
+            if coro._msgs:
+                # move messages already queued to their categories
+                msgs = collections.deque()
+                for entry in coro._msgs:
+                    if entry[0] == AsynCoro._AwaitMsg_:
+                        category = mailbox.category(entry[1])
+                        if category is not None:
+                            mailbox.discard(entry)
+                            bucket = mailbox.buckets.get(category, None)
+                            if bucket is None:
+                                bucket = mailbox.buckets[category] = collections.deque()
+                            bucket.append(entry[1])
+                            continue
+                    msgs.append(entry)
+                coro._msgs = msgs
+        else:
+            # messages already categorized are kept in their categories
+            mailbox.categorize = None
+        self._lock.release()
+        return 0
+
     def _throw(self, coro, *args):
         """Internal use only. See throw in Coro.
         """
+        if threading.current_thread() is not self._scheduler:
+            return self._handoff_req(self._throw, coro, *args)
         self._lock.acquire()
         cid = coro._id
         coro = self._coros.get(cid, None)
         if coro is None or coro._state not in (AsynCoro._Scheduled, AsynCoro._Suspended,
-                                               AsynCoro._AwaitIO_, AsynCoro._AwaitMsg_):
+                                               AsynCoro._AwaitIO_, AsynCoro._AwaitMsg_,
+                                               AsynCoro._AwaitMatch_):
             logger.warning('invalid coroutine %s to throw exception', cid)
             self._lock.release()
             return -1
-        coro._timeout = None
-        coro._exceptions.append(args)
-        if coro._state in (AsynCoro._AwaitIO_, AsynCoro._Suspended, AsynCoro._AwaitMsg_):
-            self._suspended.discard(cid)
-            self._scheduled.add(cid)
+        if coro._timeout:
+            self._timers.cancel(coro._timeout)
+            coro._timeout = None
+        if coro._exceptions:
+            coro._exceptions.append(args)
+        else:
+            coro._exceptions = [args]
+        if coro._state in (AsynCoro._AwaitIO_, AsynCoro._Suspended, AsynCoro._AwaitMsg_,
+                           AsynCoro._AwaitMatch_):
             coro._state = AsynCoro._Scheduled
-            if self._polling and len(self._scheduled) == 1:
+            self._scheduled.append(coro)
+            if self._polling:
                 self._notifier.interrupt()
         self._lock.release()
         return 0
 
+    def _handoff_req(self, method, coro, *args):
+        """Internal use only.
+
+        Queue request from a thread other than scheduler's thread, to be
+        processed by scheduler.
+        """
+        if coro is not None and self._coros.get(coro._id, None) is None:
+            logger.warning('invalid coroutine %s', coro._id)
+            return -1
+        self._handoff.append((method, coro, args))
+        # scheduler checks '_handoff' after setting '_polling', so either
+        # it finds this request or it is interrupted
+        if self._polling:
+            self._notifier.interrupt()
+        return 0
+
     def _terminate_coro(self, coro):
         """Internal use only.
         """
@@ -3641,14 +5700,19 @@ class AsynCoro(object, metaclass=Singleton):
         if coro._state == AsynCoro._Running:
             logger.warning('coroutine to terminate %s/%s is running', coro._name, cid)
         else:
-            self._suspended.discard(cid)
-            self._scheduled.add(cid)
-            coro._state = AsynCoro._Scheduled
-            coro._timeout = None
-            coro._callers = []
-            if self._polling and len(self._scheduled) == 1:
+            if coro._state != AsynCoro._Scheduled:
+                coro._state = AsynCoro._Scheduled
+                self._scheduled.append(coro)
+            if coro._timeout:
+                self._timers.cancel(coro._timeout)
+                coro._timeout = None
+            coro._callers = None
+            if self._polling:
                 self._notifier.interrupt()
-        coro._exceptions.append((GeneratorExit, GeneratorExit('close')))
+        if coro._exceptions:
+            coro._exceptions.append((GeneratorExit, GeneratorExit('close')))
+        else:
+            coro._exceptions = [(GeneratorExit, GeneratorExit('close'))]
         self._lock.release()
         return 0
 
@@ -3667,28 +5731,32 @@ class AsynCoro(object, metaclass=Singleton):
             self._lock.release()
             return 0
         else:
-            coro._timeout = None
+            if coro._timeout:
+                self._timers.cancel(coro._timeout)
+                coro._timeout = None
             # TODO: check that another HotSwapException is not pending?
             if coro._state is None:
-                # assert coro._id not in self._scheduled
-                # assert coro._id not in self._suspended
                 coro._generator = coro._swap_generator
                 coro._value = None
                 if coro._complete == 0:
                     coro._complete = None
                 elif isinstance(coro._complete, Event):
                     coro._complete.clear()
-                self._scheduled.add(cid)
                 coro._state = AsynCoro._Scheduled
+                self._scheduled.append(coro)
                 coro._hot_swappable = False
             else:
-                coro._exceptions.append((HotSwapException, HotSwapException(coro._swap_generator)))
+                exc = (HotSwapException, HotSwapException(coro._swap_generator))
+                if coro._exceptions:
+                    coro._exceptions.append(exc)
+                else:
+                    coro._exceptions = [exc]
                 # assert coro._state != AsynCoro._AwaitIO_
-                if coro._state in (AsynCoro._Suspended, AsynCoro._AwaitMsg_):
-                    self._suspended.discard(cid)
-                    self._scheduled.add(cid)
+                if coro._state in (AsynCoro._Suspended, AsynCoro._AwaitMsg_,
+                                   AsynCoro._AwaitMatch_):
                     coro._state = AsynCoro._Scheduled
-            if self._polling and len(self._scheduled) == 1:
+                    self._scheduled.append(coro)
+            if self._polling:
                 self._notifier.interrupt()
             coro._swap_generator = None
         self._lock.release()
@@ -3699,29 +5767,37 @@ class AsynCoro(object, metaclass=Singleton):
         """
         while not self._quit:
             # process I/O events
-            self._notifier.poll(0)
+            events = self._notifier.poll(0)
             self._lock.acquire()
+            while self._handoff:
+                method, coro, args = self._handoff.popleft()
+                method(coro, *args)
             if not self._scheduled:
-                if self._timeouts:
-                    timeout = self._timeouts[0][0] - _time()
+                timeout = self._timers.next_expiry()
+                if timeout is not None:
+                    timeout -= _time()
                     # pollers may timeout slightly earlier, so give a bit of
                     # slack
                     if timeout <= 0.0001:
                         timeout = 0
-                else:
-                    timeout = None
                 self._polling = True
+                # interrupts issued after this must be written
+                self._notifier._interrupt_pending = False
+                if self._handoff:
+                    timeout = 0
                 self._lock.release()
                 self._notifier.poll(timeout)
                 self._lock.acquire()
                 self._polling = False
-            if self._timeouts:
-                now = _time() + 0.0001
-                while self._timeouts and self._timeouts[0][0] <= now:
-                    timeout, cid, alarm_value = heappop(self._timeouts)
-                    # assert timeout <= now
-                    coro = self._coros.get(cid, None)
-                    if not coro or coro._timeout != timeout:
+                while self._handoff:
+                    method, coro, args = self._handoff.popleft()
+                    method(coro, *args)
+            if self._timers:
+                for timer in self._timers.expire(_time() + 0.0001):
+                    if not timer.data:
+                        continue
+                    coro, alarm_value = timer.data
+                    if coro._timeout is not timer:
                         continue
                     # if coro._state not in (AsynCoro._AwaitIO_, AsynCoro._Suspended,
                     #                        AsynCoro._AwaitMsg_):
@@ -3729,164 +5805,247 @@ class AsynCoro(object, metaclass=Singleton):
                     #                    coro._name, coro._id, coro._state)
                     #     continue
                     coro._timeout = None
-                    self._suspended.discard(cid)
-                    self._scheduled.add(cid)
                     coro._state = AsynCoro._Scheduled
                     coro._value = alarm_value
-            scheduled = [self._coros[cid] for cid in self._scheduled]
+                    self._scheduled.append(coro)
+            # run ready coroutines (including those that become ready while
+            # running) until budget is used before polling for I/O events
+            # again; budget is smaller when more descriptors have events, but
+            # all coroutines ready now are run (unless time budget expires)
+            budget = self._run_steps // ((events or 0) + 1)
+            if budget < len(self._scheduled):
+                budget = len(self._scheduled)
+            deadline = _time() + self._run_time
+            # stop in time to run coroutines (possibly with higher priority)
+            # whose timers expire
+            if self._timers:
+                expiry = self._timers.next_expiry()
+                if expiry is not None and expiry < deadline:
+                    deadline = expiry
             self._lock.release()
 
-            for coro in scheduled:
+            while budget > 0:
+                if _time() > deadline:
+                    break
+                budget -= 1
+                try:
+                    coro = self._scheduled.popleft()
+                except IndexError:
+                    break
+                # entry may be stale if coro was removed after it was queued
+                if coro._state != AsynCoro._Scheduled:
+                    continue
                 coro._state = AsynCoro._Running
                 self.__cur_coro = coro
 
-                try:
-                    if coro._exceptions:
-                        exc = coro._exceptions.pop(0)
-                        if exc[0] == GeneratorExit:
-                            coro._generator.close()
-                            retval = coro._value
-                        else:
-                            retval = coro._generator.throw(*exc)
-                    else:
-                        retval = coro._generator.send(coro._value)
-                except:
-                    self._lock.acquire()
-                    exc = sys.exc_info()
-                    if exc[0] == StopIteration:
-                        v = exc[1].args
-                        if v:
-                            if len(v) == 1:
-                                coro._value = v[0]
-                            else:
-                                coro._value = v
-                        coro._exceptions = []
-                    elif exc[0] == HotSwapException:
-                        v = exc[1].args
-                        if isinstance(v, tuple) and len(v) == 1 and inspect.isgenerator(v[0]) and \
-                           coro._hot_swappable and not coro._callers:
-                            try:
-                                coro._generator.close()
-                            except:
-                                logger.warning('closing %s/%s raised exception: %s',
-                                               coro._name, coro._id, traceback.format_exc())
-                            coro._generator = v[0]
-                            coro._name = coro._generator.__name__
-                            coro._exceptions = []
-                            coro._value = None
-                            # coro._msgs is not reset, so new
-                            # coroutine can process pending messages
-                            coro._state = AsynCoro._Scheduled
-                        else:
-                            logger.warning('invalid HotSwapException from %s/%s ignored',
-                                           coro._name, coro._id)
-                        self._lock.release()
-                        continue
-                    else:
-                        coro._exceptions.append(exc)
-
-                    if coro._callers:
-                        # return to caller
-                        caller = coro._callers.pop(-1)
-                        coro._generator = caller[0]
-                        if coro._swap_generator and not coro._callers and coro._hot_swappable:
-                            coro._exceptions.append((HotSwapException,
-                                                     HotSwapException(coro._swap_generator)))
-                            coro._swap_generator = None
-                            coro._state = AsynCoro._Scheduled
-                        elif coro._exceptions:
-                            # exception in callee, restore saved value
-                            coro._value = caller[1]
-                            self._suspended.discard(coro._id)
-                            self._scheduled.add(coro._id)
-                            coro._state = AsynCoro._Scheduled
-                        elif coro._state == AsynCoro._Running:
-                            coro._state = AsynCoro._Scheduled
-                    else:
+                # calls to sub-generators and returns (or exceptions) from
+                # them are processed in the same step, without going through
+                # the run queue, until the coroutine yields a value or
+                # suspends (or time budget expires)
+                while True:
+                    inline = False
+                    try:
                         if coro._exceptions:
-                            exc = coro._exceptions[0]
-                            assert isinstance(exc, tuple)
-                            if len(exc) == 2:
-                                exc = ''.join(traceback.format_exception_only(*exc))
-                            else:
-                                exc = ''.join(traceback.format_exception(*exc))
-                            logger.warning('uncaught exception in %s:\n%s', coro, exc)
-                            try:
+                            exc = coro._exceptions.pop(0)
+                            if exc[0] == GeneratorExit:
                                 coro._generator.close()
-                            except:
-                                logger.warning('closing %s raised exception: %s',
-                                               coro._name, traceback.format_exc())
-                        # delete this coro
-                        if coro._state not in (AsynCoro._Scheduled, AsynCoro._Running):
-                            logger.warning('coro "%s" is in state: %s', coro._name, coro._state)
-                        monitors = list(coro._monitors)
-                        for monitor in monitors:
-                            if monitor._location == self._location:
-                                if coro._exceptions:
-                                    exc = MonitorException(coro, coro._exceptions[0])
+                                retval = coro._value
+                            else:
+                                retval = coro._generator.throw(*exc)
+                        else:
+                            retval = coro._generator.send(coro._value)
+                    except:
+                        self._lock.acquire()
+                        exc = sys.exc_info()
+                        if exc[0] == RuntimeError and exc[2].tb_next is None and \
+                           isinstance(exc[1].__cause__, StopIteration):
+                            # generator raised StopIteration, which is
+                            # converted to RuntimeError with PEP 479
+                            exc = (StopIteration, exc[1].__cause__, exc[2])
+                        if exc[0] == StopIteration:
+                            v = exc[1].args
+                            if v:
+                                if len(v) == 1:
+                                    coro._value = v[0]
                                 else:
-                                    exc = MonitorException(coro, (StopIteration, coro._value))
-                                if monitor.send(exc):
-                                    logger.warning('monitor for %s/%s is not valid!',
-                                                   coro._name, coro._id)
-                                    coro._monitors.discard(monitor)
+                                    coro._value = v
+                            elif _is_native(coro._generator):
+                                coro._value = None
+                            coro._exceptions = None
+                        elif exc[0] == HotSwapException:
+                            v = exc[1].args
+                            if isinstance(v, tuple) and len(v) == 1 and \
+                               isinstance(v[0], _GeneratorTypes) and \
+                               coro._hot_swappable and not coro._callers:
+                                try:
+                                    coro._generator.close()
+                                except:
+                                    logger.warning('closing %s/%s raised exception: %s',
+                                                   coro._name, coro._id, traceback.format_exc())
+                                coro._generator = v[0]
+                                coro._name = coro._generator.__name__
+                                coro._exceptions = None
+                                coro._value = None
+                                # coro._msgs is not reset, so new
+                                # coroutine can process pending messages
+                                if coro._state != AsynCoro._Scheduled:
+                                    if coro._timeout:
+                                        self._timers.cancel(coro._timeout)
+                                        coro._timeout = None
+                                    coro._state = AsynCoro._Scheduled
+                                    self._scheduled.append(coro)
                             else:
-                                # remote monitor; prepare serializable data
+                                logger.warning('invalid HotSwapException from %s/%s ignored',
+                                               coro._name, coro._id)
+                            self._lock.release()
+                            break
+                        elif coro._exceptions:
+                            coro._exceptions.append(exc)
+                        else:
+                            coro._exceptions = [exc]
+
+                        if coro._callers:
+                            # return to caller
+                            caller = coro._callers.pop(-1)
+                            coro._generator = caller[0]
+                            if coro._swap_generator and not coro._callers and coro._hot_swappable:
+                                exc = (HotSwapException, HotSwapException(coro._swap_generator))
                                 if coro._exceptions:
-                                    exc = coro._exceptions[0][:2]
-                                    try:
-                                        serialize(exc[1])
-                                    except pickle.PicklingError:
-                                        # send only the type
-                                        exc = (exc[0], type(exc[1].args[0]))
-                                    exc = MonitorException(coro, exc)
-                                    coro._exceptions = []
+                                    coro._exceptions.append(exc)
                                 else:
-                                    exc = coro._value
-                                    try:
-                                        serialize(exc)
-                                    except pickle.PicklingError:
-                                        exc = type(exc)
-                                    exc = MonitorException(coro, (StopIteration, exc))
-                                monitor.send(exc)
-                        if not coro._monitors or not coro._exceptions:
-                            coro._msgs.clear()
-                            coro._monitors.clear()
-                            coro._exceptions = []
-                            if self._coros.pop(coro._id, None) != coro:
-                                logger.warning('invalid coro: %s, %s', coro._id, coro._state)
-                            if coro._daemon is True:
-                                self._daemons -= 1
-                        elif coro._monitors:
-                            # a (local) monitor can restart it with hot_swap
-                            coro._hot_swappable = True
-                            coro._exceptions = []
-                        coro._state = None
-                        coro._generator = None
-                        if coro._complete:
-                            coro._complete.set()
+                                    coro._exceptions = [exc]
+                                coro._swap_generator = None
+                                if coro._state != AsynCoro._Scheduled:
+                                    if coro._timeout:
+                                        self._timers.cancel(coro._timeout)
+                                        coro._timeout = None
+                                    if coro._state == AsynCoro._Running:
+                                        inline = True
+                                    else:
+                                        coro._state = AsynCoro._Scheduled
+                                        self._scheduled.append(coro)
+                            elif coro._exceptions:
+                                # exception in callee, restore saved value
+                                coro._value = caller[1]
+                                if coro._state != AsynCoro._Scheduled:
+                                    if coro._timeout:
+                                        self._timers.cancel(coro._timeout)
+                                        coro._timeout = None
+                                    if coro._state == AsynCoro._Running:
+                                        inline = True
+                                    else:
+                                        coro._state = AsynCoro._Scheduled
+                                        self._scheduled.append(coro)
+                            elif coro._state == AsynCoro._Running:
+                                inline = True
                         else:
-                            coro._complete = 0
-                        self._scheduled.discard(coro._id)
-                        if len(self._coros) == self._daemons:
-                            self._complete.set()
-                    self._lock.release()
-                else:
-                    self._lock.acquire()
-                    if coro._state == AsynCoro._Running:
-                        coro._state = AsynCoro._Scheduled
-                        # if this coroutine is suspended, don't update
-                        # the value; when it is resumed, it will be
-                        # updated with the 'update' value
-                        coro._value = retval
-
-                    if isinstance(retval, types.GeneratorType):
-                        # push current generator onto stack and activate
-                        # new generator
-                        coro._callers.append((coro._generator, coro._value))
-                        coro._generator = retval
-                        coro._value = None
-                    self._lock.release()
+                            if coro._exceptions:
+                                exc = coro._exceptions[0]
+                                assert isinstance(exc, tuple)
+                                if len(exc) == 2:
+                                    exc = ''.join(traceback.format_exception_only(*exc))
+                                else:
+                                    exc = ''.join(traceback.format_exception(*exc))
+                                logger.warning('uncaught exception in %s:\n%s', coro, exc)
+                                try:
+                                    coro._generator.close()
+                                except:
+                                    logger.warning('closing %s raised exception: %s',
+                                                   coro._name, traceback.format_exc())
+                            # delete this coro
+                            if coro._state not in (AsynCoro._Scheduled, AsynCoro._Running):
+                                logger.warning('coro "%s" is in state: %s', coro._name, coro._state)
+                            monitors = list(coro._monitors) if coro._monitors else []
+                            for monitor in monitors:
+                                if monitor._location == self._location:
+                                    if coro._exceptions:
+                                        exc = MonitorException(coro, coro._exceptions[0])
+                                    else:
+                                        exc = MonitorException(coro, (StopIteration, coro._value))
+                                    # MonitorException is queued even if
+                                    # monitor's mailbox is full
+                                    if monitor._scheduler._resume(monitor, exc,
+                                                                  AsynCoro._AwaitMsg_,
+                                                                  False) == -1:
+                                        logger.warning('monitor for %s/%s is not valid!',
+                                                       coro._name, coro._id)
+                                        coro._monitors.discard(monitor)
+                                else:
+                                    # remote monitor; prepare serializable data
+                                    if coro._exceptions:
+                                        exc = coro._exceptions[0][:2]
+                                        try:
+                                            serialize(exc[1])
+                                        except pickle.PicklingError:
+                                            # send only the type
+                                            exc = (exc[0], type(exc[1].args[0]))
+                                        exc = MonitorException(coro, exc)
+                                        coro._exceptions = None
+                                    else:
+                                        exc = coro._value
+                                        try:
+                                            serialize(exc)
+                                        except pickle.PicklingError:
+                                            exc = type(exc)
+                                        exc = MonitorException(coro, (StopIteration, exc))
+                                    monitor.send(exc)
+                            if not coro._monitors or not coro._exceptions:
+                                if coro._mailbox:
+                                    # senders blocked in 'deliver' find coro is gone
+                                    coro._mailbox.waiting.wake_all()
+                                    coro._mailbox = None
+                                coro._msgs = None
+                                coro._monitors = None
+                                coro._exceptions = None
+                                if self._coros.pop(coro._id, None) != coro:
+                                    logger.warning('invalid coro: %s, %s', coro._id, coro._state)
+                                if coro._daemon is True:
+                                    self._daemons -= 1
+                            elif coro._monitors:
+                                # a (local) monitor can restart it with hot_swap
+                                coro._hot_swappable = True
+                                coro._exceptions = None
+                            coro._state = None
+                            coro._generator = None
+                            if coro._complete:
+                                self._notify_complete(coro)
+                            else:
+                                coro._complete = 0
+                            if len(self._coros) == self._daemons:
+                                self._complete.set()
+                        self._lock.release()
+                    else:
+                        self._lock.acquire()
+                        if coro._state == AsynCoro._Running:
+                            # if this coroutine is suspended, don't update
+                            # the value; when it is resumed, it will be
+                            # updated with the 'update' value
+                            coro._value = retval
+                            if isinstance(retval, _GeneratorTypes):
+                                inline = True
+                            else:
+                                coro._state = AsynCoro._Scheduled
+                                self._scheduled.append(coro)
+
+                        if isinstance(retval, _GeneratorTypes):
+                            # push current generator onto stack and activate
+                            # new generator
+                            if coro._callers is None:
+                                coro._callers = []
+                            coro._callers.append((coro._generator, coro._value))
+                            coro._generator = retval
+                            coro._value = None
+                        self._lock.release()
+
+                    if not inline:
+                        break
+                    if _time() > deadline:
+                        self._lock.acquire()
+                        if coro._state == AsynCoro._Running:
+                            coro._state = AsynCoro._Scheduled
+                            self._scheduled.append(coro)
+                        self._lock.release()
+                        break
             self.__cur_coro = None
 
         self._lock.acquire()
@@ -3906,14 +6065,14 @@ class AsynCoro(object, metaclass=Singleton):
                 else:
                     coro._generator = None
             if coro._complete:
-                coro._complete.set()
+                self._notify_complete(coro)
             else:
                 coro._complete = 0
         self._scheduled.clear()
-        self._suspended.clear()
+        self._handoff.clear()
         self._coros.clear()
         self._channels.clear()
-        self._timeouts = []
+        self._timers = _TimerWheel()
         self.__class__._instance = None
         self._quit = True
         self._lock.release()
@@ -3964,7 +6123,7 @@ class AsynCoro(object, metaclass=Singleton):
             self._quit = True
             # add a dummy timeout so scheduler will not wait for any other
             # timeouts left behind by coroutines that may have quit already
-            heappush(self._timeouts, (_time() + 0.1, None, None))
+            self._timers.add(_time() + 0.1, None)
             self._lock.release()
             self._notifier.interrupt()
             self._complete.wait()
@@ -4002,6 +6161,37 @@ class AsynCoro(object, metaclass=Singleton):
             self._lock.release()
         self._complete.wait()
 
+    def set_run_budget(self, steps=None, duration=None):
+        """Set how long scheduler runs coroutines that are ready to
+        execute before it polls for I/O events: at most 'steps' steps
+        (a step is execution of a coroutine up to next 'yield') or
+        'duration' seconds, whichever is reached first. Fewer steps are
+        run when more I/O events are pending, but all coroutines that
+        are ready at that time are run (unless 'duration' expires).
+        Larger budget improves throughput of compute bound coroutines,
+        whereas smaller budget reduces I/O latency.
+
+        Returns current budget as tuple (steps, duration).
+        """
+        if steps is not None:
+            if not isinstance(steps, int) or steps < 1:
+                logger.warning('invalid steps %s', steps)
+                return -1
+            self._run_steps = steps
+        if duration is not None:
+            if not isinstance(duration, (float, int)) or duration <= 0:
+                logger.warning('invalid duration %s', duration)
+                return -1
+            self._run_time = duration
+        return (self._run_steps, self._run_time)
+
+    def num_timers(self):
+        """Returns number of pending timeouts, i.e., coroutines currently
+        suspended with timeout (e.g., with 'sleep', 'receive', or waiting
+        on Lock, Event etc. with timeout).
+        """
+        return len(self._timers)
+
     def atexit(self, priority, func, *fargs, **fkwargs):
         """Function 'func' will be called after the scheduler has
         terminated. 'priority' indicates the order in which all queued functions
@@ -4079,29 +6269,152 @@ class AsyncThreadPool(object):
     protected by thread locking (not coroutine locking).
     """
 
-    def __init__(self, num_threads):
+    def __init__(self, num_threads, max_threads=None, max_queue=0, idle_timeout=60):
+        """'num_threads' threads are started and kept running. If
+        'max_threads' is greater than 'num_threads', more threads (up
+        to 'max_threads') are started when tasks are waiting for a
+        thread; these threads terminate when idle for 'idle_timeout'
+        seconds.
+
+        If 'max_queue' is positive, at most that many tasks wait for a
+        thread; coroutines that submit more tasks (with 'async_task')
+        wait until (earlier) tasks are completed.
+        """
         self._asyncoro = AsynCoro.scheduler()
-        self._num_threads = num_threads
+        if not max_threads or max_threads < num_threads:
+            max_threads = num_threads
+        self._min_threads = num_threads
+        self._max_threads = max_threads
+        self._max_queue = max_queue
+        self._idle_timeout = idle_timeout
         self._task_queue = queue.Queue()
+        # '_lock' protects '_done' (tasks completed but not yet delivered
+        # to coroutines) and thread counts / stats
+        self._lock = threading.Lock()
+        self._done = []
+        # number of tasks submitted but not yet delivered, and coroutines
+        # waiting to submit tasks (when there are too many)
+        self._pending = 0
+        self._submitters = _WaitQueue()
+        self._num_threads = 0
+        self._idle = 0
+        self._terminate = False
+        self._completed = 0
+        self._batches = 0
+        self._busy_time = 0.0
+        self._thread_time = 0.0
+        self._start_time = self._thread_mark = _time()
         for n in range(num_threads):
-            tasklet = threading.Thread(target=self._tasklet)
-            tasklet.daemon = True
-            tasklet.start()
+            self._start_thread()
+
+    def _start_thread(self):
+        """Internal use only.
+        """
+        with self._lock:
+            now = _time()
+            self._thread_time += (now - self._thread_mark) * self._num_threads
+            self._thread_mark = now
+            self._num_threads += 1
+        tasklet = threading.Thread(target=self._tasklet)
+        tasklet.daemon = True
+        tasklet.start()
 
     def _tasklet(self):
+        # idle threads are counted only if pool can grow
+        dynamic = self._max_threads > self._min_threads
         while 1:
-            item = self._task_queue.get(block=True)
+            if dynamic:
+                with self._lock:
+                    self._idle += 1
+                    # threads above minimum terminate when idle
+                    if self._num_threads > self._min_threads and not self._terminate:
+                        timeout = self._idle_timeout
+                    else:
+                        timeout = None
+                try:
+                    item = self._task_queue.get(block=True, timeout=timeout)
+                except queue.Empty:
+                    with self._lock:
+                        self._idle -= 1
+                        if self._num_threads > self._min_threads and not self._terminate:
+                            now = _time()
+                            self._thread_time += (now - self._thread_mark) * self._num_threads
+                            self._thread_mark = now
+                            self._num_threads -= 1
+                            break
+                    continue
+                with self._lock:
+                    self._idle -= 1
+            else:
+                item = self._task_queue.get(block=True)
             if item is None:
                 self._task_queue.task_done()
                 break
-            coro, target, args, kwargs = item
+            waiter, target, args, kwargs = item
+            start = _time()
             try:
                 val = target(*args, **kwargs)
-                coro._proceed_(val)
+                exc = None
             except:
-                coro.throw(*sys.exc_info())
-            finally:
-                self._task_queue.task_done()
+                val = None
+                exc = sys.exc_info()
+            with self._lock:
+                self._busy_time += _time() - start
+                self._completed += 1
+                self._done.append((waiter, val, exc))
+                # first task completed in this batch asks scheduler to
+                # deliver; tasks completed before scheduler gets to it are
+                # delivered together
+                deliver = len(self._done) == 1
+            if deliver:
+                self._asyncoro._handoff_req(self._deliver, None)
+            self._task_queue.task_done()
+
+    def _deliver(self, _):
+        """Internal use only.
+
+        Called by scheduler to deliver results of completed tasks.
+        """
+        with self._lock:
+            done = self._done
+            self._done = []
+            self._batches += 1
+        self._pending -= len(done)
+        for waiter, val, exc in done:
+            if isinstance(waiter, _PoolMap):
+                waiter._completed(val or [])
+            elif exc:
+                waiter.throw(*exc)
+            else:
+                waiter._proceed_(val)
+        for i in range(len(done)):
+            if not self._submitters.wake():
+                break
+
+    def _submit(self, item):
+        """Internal use only.
+        """
+        self._pending += 1
+        if self._num_threads < self._max_threads and self._idle < self._task_queue.qsize() + 1:
+            self._start_thread()
+        self._task_queue.put(item)
+
+    def _full(self):
+        """Internal use only.
+        """
+        return self._max_queue > 0 and self._pending >= (self._num_threads + self._max_queue)
+
+    @_coroutine
+    def _wait_submit(self, coro, target, args, kwargs):
+        """Internal use only.
+        """
+        while self._full():
+            entry = self._submitters.append(coro)
+            if (yield coro._await_()) is None:
+                self._submitters.cancel(entry)
+        self._submit((coro, target, args, kwargs))
+        val = yield coro._await_()
+        return val
 
     def async_task(self, target, *args, **kwargs):
         """Must be used with 'yield', as
@@ -4116,7 +6429,8 @@ class AsyncThreadPool(object):
         to @target.
 
         This call effectively returns result of executing
-        'target(*args, **kwargs)'.
+        'target(*args, **kwargs)'. If pool has 'max_queue' tasks
+        waiting for a thread, coroutine waits until there is room.
         """
 
         if not self._asyncoro:
@@ -4127,8 +6441,53 @@ class AsyncThreadPool(object):
         if not args and kwargs:
             args = kwargs.pop('args', ())
             kwargs = kwargs.pop('kwargs', kwargs)
+        if self._full():
+            return self._wait_submit(coro, target, args, kwargs)
         coro._await_()
-        self._task_queue.put((coro, target, args, kwargs))
+        self._submit((coro, target, args, kwargs))
+
+    def map(self, target, iterable, chunksize=1):
+        """Executes 'target' with each item in 'iterable' in threads and
+        returns object to retrieve results as they complete (in any
+        order), e.g.,
+
+        results = pool.map(target, iterable)
+        while True:
+            index, value = yield results.get()
+            if index is None:
+                break
+
+        where 'index' is position of item in 'iterable'. If 'target'
+        raises exception for an item, 'get' raises that exception.
+
+        Items are sent to threads in chunks of 'chunksize' items, and
+        only a limited number of chunks are submitted ahead of results
+        retrieved, so 'iterable' may be a (long) generator.
+        """
+        if not self._asyncoro:
+            self._asyncoro = AsynCoro.scheduler()
+        return _PoolMap(self, target, iterable, chunksize,
+                        self._max_threads + (self._max_queue or self._max_threads))
+
+    def stats(self):
+        """Returns dictionary with number of threads (and how many of
+        them are idle, if pool can grow), tasks pending (waiting for or
+        running in a thread), tasks completed (with 'map', each chunk is
+        a task), number of batches in which completed tasks were
+        delivered to coroutines, and utilization (fraction of thread
+        time spent running tasks).
+        """
+        with self._lock:
+            now = _time()
+            thread_time = self._thread_time + (now - self._thread_mark) * self._num_threads
+            if self._max_threads > self._min_threads:
+                idle = self._idle
+            else:
+                idle = None
+            return {'threads': self._num_threads, 'idle': idle,
+                    'pending': self._pending, 'completed': self._completed,
+                    'batches': self._batches,
+                    'utilization': (self._busy_time / thread_time) if thread_time else 0.0}
 
     def join(self):
         """Wait till all scheduled tasks are completed.
@@ -4139,11 +6498,385 @@ class AsyncThreadPool(object):
         """Wait for all scheduled tasks to complete and terminate
         threads.
         """
-        for n in range(self._num_threads):
+        with self._lock:
+            self._terminate = True
+            num_threads = self._num_threads
+        for n in range(num_threads):
             self._task_queue.put(None)
         self._task_queue.join()
 
 
+def _run_chunk(target, chunk):
+    """Internal use only.
+
+    Runs 'target' with each item in 'chunk' (in thread / process) for
+    'map' and returns list of (index, value, exception).
+    """
+    results = []
+    for index, item in chunk:
+        try:
+            results.append((index, target(item), None))
+        except Exception:
+            results.append((index, None, sys.exc_info()[1]))
+    return results
+
+
+class _SharedBuffer(object):
+    """Internal use only. bytes / bytearray passed between processes of
+    AsyncProcessPool through shared memory instead of serializing it.
+    """
+
+    __slots__ = ('name', 'size', 'type')
+
+    def __init__(self, data):
+        from multiprocessing import shared_memory
+        shm = shared_memory.SharedMemory(create=True, size=len(data))
+        shm.buf[:len(data)] = data
+        shm.close()
+        self.name = shm.name
+        self.size = len(data)
+        self.type = type(data)
+
+    def load(self):
+        """Returns data and releases shared memory, so it must be
+        called exactly once.
+        """
+        from multiprocessing import shared_memory
+        shm = shared_memory.SharedMemory(name=self.name)
+        try:
+            data = self.type(shm.buf[:self.size])
+        finally:
+            shm.close()
+            shm.unlink()
+        return data
+
+
+def _share(value, min_size):
+    """Internal use only.
+    """
+    if min_size and isinstance(value, (bytes, bytearray)) and len(value) >= min_size:
+        return _SharedBuffer(value)
+    return value
+
+
+def _unshare(value):
+    """Internal use only.
+    """
+    if isinstance(value, _SharedBuffer):
+        return value.load()
+    return value
+
+
+def _process_worker(conn, peer, shm_min_size):
+    """Internal use only.
+
+    Runs in processes of AsyncProcessPool: executes tasks received over
+    'conn' and sends back results until pool is terminated.
+    """
+    peer.close()
+    conn = AsyncSocket(conn, blocking=True)
+    while 1:
+        try:
+            task = deserialize(conn.recv_msg())
+        except Exception:
+            break
+        if task is None:
+            break
+        target, args, kwargs = task
+        try:
+            args = [_unshare(arg) for arg in args]
+            reply = (True, _share(target(*args, **kwargs), shm_min_size))
+        except Exception:
+            reply = (False, sys.exc_info()[1])
+        try:
+            msg = serialize(reply)
+        except Exception:
+            _unshare(reply[1])
+            msg = serialize((False, RuntimeError(traceback.format_exc())))
+        try:
+            conn.send_msg(msg)
+        except Exception:
+            break
+    conn.close()
+
+
+class AsyncProcessPool(object):
+    """Schedule (CPU-bound) tasks with processes to be executed
+    asynchronously, so tasks run in parallel (not limited by GIL) and
+    don't block scheduler.
+
+    Tasks are sent to processes and results received over sockets
+    (AsyncSocket), so scheduler is notified when results are ready
+    (without any threads). Tasks, their arguments and results must be
+    serializable, e.g., tasks must be module level functions.
+    """
+
+    def __init__(self, num_procs=None, shm_min_size=65536):
+        """'num_procs' processes (default is number of CPUs) are
+        started and kept running.
+
+        bytes / bytearray arguments of tasks and results that are at
+        least 'shm_min_size' bytes long are passed through shared
+        memory (with Python 3.8 and above, except on Windows) instead
+        of serializing them. If 'shm_min_size' is 0, shared memory is
+        not used.
+        """
+        import multiprocessing
+        if not num_procs:
+            num_procs = multiprocessing.cpu_count()
+        if shm_min_size:
+            if platform.system() == 'Windows':
+                shm_min_size = 0
+            else:
+                try:
+                    from multiprocessing import shared_memory, resource_tracker
+                except ImportError:
+                    shm_min_size = 0
+                else:
+                    # shared memory is created in one process and
+                    # released in another, so all processes must use
+                    # same resource tracker
+                    resource_tracker.ensure_running()
+        # pool may be created (and terminated) from main program
+        self._asyncoro = AsynCoro.instance()
+        self._shm_min_size = shm_min_size
+        self._tasks = Queue()
+        self._pending = 0
+        self._completed = 0
+        self._procs = []
+        self._dispatchers = []
+        self._terminated = False
+        for i in range(num_procs):
+            self._start_proc()
+
+    def _start_proc(self):
+        """Internal use only.
+
+        Starts a process and coroutine to dispatch tasks to it.
+        """
+        import multiprocessing
+        conn, peer = socket.socketpair()
+        proc = multiprocessing.Process(target=_process_worker,
+                                       args=(peer, conn, self._shm_min_size))
+        proc.daemon = True
+        proc.start()
+        peer.close()
+        self._procs.append(proc)
+        self._dispatchers.append(Coro(self._dispatch, AsyncSocket(conn), proc))
+
+    @_coroutine
+    def _dispatch(self, conn, proc, coro=None):
+        """Internal use only.
+
+        Sends tasks to a process and delivers results. If process
+        fails, it is replaced with a new process.
+        """
+        coro.set_daemon()
+        failed = False
+        while 1:
+            item = yield self._tasks.get()
+            if item is None:
+                break
+            waiter, target, args, kwargs = item
+            shared = []
+            try:
+                for arg in args:
+                    shared.append(_share(arg, self._shm_min_size))
+                msg = serialize((target, shared, kwargs))
+            except Exception:
+                for arg in shared:
+                    _unshare(arg)
+                self._deliver(waiter, False, sys.exc_info()[1])
+                continue
+            try:
+                yield conn.send_msg(msg)
+                msg = yield conn.recv_msg()
+            except Exception:
+                logger.warning('process %s of AsyncProcessPool failed', proc.pid)
+                self._deliver(waiter, False, sys.exc_info()[1])
+                failed = True
+                break
+            try:
+                ok, val = deserialize(msg)
+            except Exception:
+                ok, val = False, sys.exc_info()[1]
+            self._deliver(waiter, ok, val)
+        if failed:
+            if proc.is_alive():
+                proc.terminate()
+        else:
+            try:
+                yield conn.send_msg(serialize(None))
+                # process closes connection when it terminates
+                yield conn.recv_msg()
+            except socket.error:
+                pass
+        conn.close()
+        # 'join' would block scheduler until process exits
+        while proc.is_alive():
+            yield coro.sleep(0.01)
+        proc.join()
+        self._procs.remove(proc)
+        if failed and not self._terminated:
+            self._dispatchers.remove(coro)
+            try:
+                self._start_proc()
+            except Exception:
+                logger.warning('AsyncProcessPool could not start process:\n%s',
+                               traceback.format_exc())
+        if not self._procs:
+            # tasks queued can't be run
+            while 1:
+                item = self._tasks.get_nowait(_NoMessage)
+                if item is _NoMessage:
+                    break
+                if item is not None:
+                    self._deliver(item[0], False,
+                                  RuntimeError('AsyncProcessPool has no processes'))
+
+    def _deliver(self, waiter, ok, val):
+        """Internal use only.
+        """
+        self._pending -= 1
+        self._completed += 1
+        if isinstance(waiter, _PoolMap):
+            waiter._completed(val if ok else [(None, None, val)])
+        elif ok:
+            waiter._proceed_(_unshare(val))
+        else:
+            waiter.throw(type(val), val)
+
+    def _submit(self, item):
+        """Internal use only.
+        """
+        self._pending += 1
+        if self._procs:
+            self._tasks.put_nowait(item)
+        else:
+            self._deliver(item[0], False, RuntimeError('AsyncProcessPool has no processes'))
+
+    def run(self, target, *args, **kwargs):
+        """Must be used with 'yield', as
+        'val = yield pool.run(target, *args, **kwargs)'.
+
+        @target is function that will be executed in a process, with
+        arguments @args and keyword arguments @kwargs.
+
+        This call effectively returns result of executing
+        'target(*args, **kwargs)' (or raises exception raised by it). If
+        process running the task fails, socket.error is raised (and
+        process is replaced).
+        """
+        if not self._asyncoro:
+            self._asyncoro = AsynCoro.scheduler()
+        coro = AsynCoro.cur_coro(self._asyncoro)
+        coro._await_()
+        self._submit((coro, target, args, kwargs))
+
+    def map(self, target, iterable, chunksize=1):
+        """Executes 'target' with each item in 'iterable' in processes
+        and returns object to retrieve results as they complete (in any
+        order); see 'map' in AsyncThreadPool.
+
+        As each chunk of items is sent to a process in one message,
+        cost of communication is reduced with larger 'chunksize'.
+        """
+        if not self._asyncoro:
+            self._asyncoro = AsynCoro.scheduler()
+        return _PoolMap(self, target, iterable, chunksize, 2 * len(self._procs))
+
+    def stats(self):
+        """Returns dictionary with number of processes, tasks pending
+        (waiting for or running in a process) and tasks completed (with
+        'map', each chunk is a task).
+        """
+        return {'procs': len(self._procs), 'pending': self._pending,
+                'completed': self._completed}
+
+    def _stop(self, _):
+        """Internal use only.
+        """
+        self._terminated = True
+        for proc in self._procs:
+            self._tasks.put_nowait(None)
+
+    def terminate(self):
+        """Processes terminate after completing tasks already
+        scheduled. If called from a coroutine, must be used with
+        'yield' to wait until processes terminate; otherwise (e.g.,
+        from main program), waits until processes terminate.
+        """
+        if AsynCoro.cur_coro():
+            self._stop(None)
+            return gather(list(self._dispatchers))
+        self._asyncoro._handoff_req(self._stop, None)
+        for coro in list(self._dispatchers):
+            coro.value()
+
+
+class _PoolMap(object):
+    """Internal use only. See 'map' in AsyncThreadPool and
+    AsyncProcessPool.
+    """
+
+    def __init__(self, pool, target, iterable, chunksize, window):
+        self._pool = pool
+        self._target = target
+        self._items = enumerate(iterable)
+        self._chunksize = max(1, chunksize)
+        # number of chunks submitted ahead of results retrieved
+        self._window = window
+        self._running = 0
+        self._results = collections.deque()
+        self._waitlist = _WaitQueue()
+        self._submit()
+
+    def _submit(self):
+        ready = len(self._results) // self._chunksize
+        while self._items is not None and (self._running + ready) < self._window:
+            chunk = []
+            for item in self._items:
+                chunk.append(item)
+                if len(chunk) == self._chunksize:
+                    break
+            if not chunk:
+                self._items = None
+                break
+            self._running += 1
+            self._pool._submit((self, _run_chunk, (self._target, chunk), {}))
+
+    def _completed(self, results):
+        self._running -= 1
+        self._results.extend(results)
+        # each result can be retrieved by a different coroutine
+        for i in range(len(results)):
+            if not self._waitlist.wake():
+                break
+        if self._items is None and not self._running:
+            # coroutines still waiting find there are no more results
+            self._waitlist.wake_all()
+
+    @_coroutine
+    def get(self):
+        """Must be used with 'yield' as 'index, value = yield
+        results.get()'. Returns (None, None) when all results have been
+        retrieved.
+        """
+        while not self._results:
+            if self._items is None and not self._running:
+                self._waitlist.wake_all()
+                return (None, None)
+            coro = AsynCoro.cur_coro()
+            entry = self._waitlist.append(coro)
+            if (yield coro._await_()) is None:
+                self._waitlist.cancel(entry)
+        index, value, exc = self._results.popleft()
+        self._submit()
+        if exc is not None:
+            raise exc
+        return (index, value)
+
+
 class AsyncDBCursor(object):
     """Database cursor proxy for asynchronous processing of executions.
 
@@ -4165,23 +6898,392 @@ class AsyncDBCursor(object):
         finally:
             self._sem.release()
 
+    @_coroutine
     def execute(self, query, args=None):
         """Must be used with 'yield' as 'n = yield cursor.execute(stmt)'.
         """
         yield self._sem.acquire()
-        self._thread_pool.async_task(self._exec_task,
-                                     partial_func(self._cursor.execute, query, args))
+        return (yield self._thread_pool.async_task(self._exec_task,
+                                                   partial_func(self._cursor.execute, query, args)))
 
+    @_coroutine
     def executemany(self, query, args):
         """Must be used with 'yield' as 'n = yield cursor.executemany(stmt)'.
         """
         yield self._sem.acquire()
-        self._thread_pool.async_task(self._exec_task,
-                                     partial_func(self._cursor.executemany, query, args))
+        return (yield self._thread_pool.async_task(self._exec_task,
+                                                   partial_func(self._cursor.executemany, query,
+                                                                args)))
 
+    @_coroutine
     def callproc(self, proc, args=()):
         """Must be used with 'yield' as 'yield cursor.callproc(proc)'.
         """
         yield self._sem.acquire()
-        self._thread_pool.async_task(self._exec_task,
-                                     partial_func(self._cursor.callproc, proc, args))
+        return (yield self._thread_pool.async_task(self._exec_task,
+                                                   partial_func(self._cursor.callproc, proc, args)))
+
+
+class _Histogram(object):
+    """Internal use only. Counts of (time) values in buckets with upper
+    bounds 'bounds' (and a bucket for larger values).
+    """
+
+    def __init__(self, bounds):
+        self._bounds = bounds
+        self._counts = [0] * (len(bounds) + 1)
+        self._lock = threading.Lock()
+
+    def add(self, value):
+        i = bisect_left(self._bounds, value)
+        with self._lock:
+            self._counts[i] += 1
+
+    def buckets(self):
+        with self._lock:
+            counts = list(self._counts)
+        return list(zip(list(self._bounds) + [None], counts))
+
+
+class AsyncDBPool(object):
+    """Pool of database (DB-API) connections for asynchronous
+    processing of queries.
+
+    Each connection is used only in its own thread, and a coroutine
+    gets (with 'cursor') a cursor for exclusive use of a connection, so
+    a slow query stalls only the coroutine that issued it, not
+    coroutines using other connections.
+    """
+
+    # upper bounds (in seconds) of buckets in histograms in 'stats'
+    _histogram_bounds = (0.0001, 0.001, 0.01, 0.1, 1.0, 10.0)
+
+    def __init__(self, num_conns, connect, *args, **kwargs):
+        """'num_conns' connections are created, each in its own thread,
+        with 'connect(*args, **kwargs)', e.g., 'AsyncDBPool(4,
+        sqlite3.connect, path)'.
+        """
+        self._asyncoro = AsynCoro.instance()
+        self._wait_hist = _Histogram(self._histogram_bounds)
+        self._latency_hist = _Histogram(self._histogram_bounds)
+        self._conns = [_DBPoolConnection(self, connect, args, kwargs)
+                       for i in range(num_conns)]
+        self._free = collections.deque(self._conns)
+        self._waitlist = _WaitQueue()
+        # '_lock' protects '_done' (operations completed in threads of
+        # connections but not yet delivered to coroutines)
+        self._lock = threading.Lock()
+        self._done = []
+
+    @_coroutine
+    def cursor(self, timeout=None):
+        """Must be used with 'yield' as 'cursor = yield pool.cursor()'.
+
+        Waits until a connection is available and returns a cursor for
+        it, or None if no connection is available before timeout. The
+        connection is used only with this cursor until cursor is
+        closed.
+        """
+        start = _time()
+        if self._free:
+            conn = self._free.popleft()
+        else:
+            if timeout is not None and timeout <= 0:
+                return None
+            # connection released is handed to earliest waiting coroutine
+            # (see '_release'), so coroutines get connections in order
+            coro = AsynCoro.cur_coro(self._asyncoro)
+            entry = self._waitlist.append(coro)
+            conn = yield coro._await_(timeout)
+            if conn is None:
+                self._waitlist.cancel(entry)
+                return None
+        self._wait_hist.add(_time() - start)
+        try:
+            cursor = yield conn.call(conn._cursor, ())
+        except:
+            self._release(conn)
+            raise
+        return _DBPoolCursor(self, conn, cursor)
+
+    def _release(self, conn):
+        """Internal use only.
+        """
+        if not self._waitlist.wake(conn):
+            self._free.append(conn)
+
+    def _completed(self, waiter, val, exc):
+        """Internal use only.
+
+        Called in threads of connections when an operation is completed.
+        """
+        with self._lock:
+            self._done.append((waiter, val, exc))
+            # first operation completed in this batch asks scheduler to
+            # deliver; operations completed before scheduler gets to it
+            # are delivered together
+            deliver = len(self._done) == 1
+        if deliver:
+            self._asyncoro._handoff_req(self._deliver, None)
+
+    def _deliver(self, _):
+        """Internal use only.
+
+        Called by scheduler to deliver results of completed operations.
+        """
+        with self._lock:
+            done = self._done
+            self._done = []
+        for waiter, val, exc in done:
+            if isinstance(waiter, Coro):
+                if exc:
+                    waiter.throw(*exc)
+                else:
+                    waiter._proceed_(val)
+            else:
+                waiter._fetched(val, exc)
+
+    def stats(self):
+        """Returns dictionary with number of connections, how many of
+        them are free, number of coroutines waiting for a connection,
+        and histograms of time coroutines waited for a connection
+        ('wait') and of time queries took ('latency'). Each histogram is
+        a list of (upper bound in seconds, count) with upper bound of
+        last bucket None.
+        """
+        return {'connections': len(self._conns), 'free': len(self._free),
+                'waiting': len(self._waitlist), 'wait': self._wait_hist.buckets(),
+                'latency': self._latency_hist.buckets()}
+
+    def terminate(self):
+        """Wait for all scheduled operations to complete, close
+        connections and terminate threads.
+        """
+        for conn in self._conns:
+            conn._tasks.put(None)
+        for conn in self._conns:
+            conn._thread.join()
+
+
+class _DBPoolConnection(object):
+    """Internal use only. Connection of AsyncDBPool and its thread.
+    """
+
+    def __init__(self, pool, connect, args, kwargs):
+        self._pool = pool
+        self._connection = None
+        self._tasks = queue.Queue()
+        self._thread = threading.Thread(target=self._run, args=(connect, args, kwargs))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self, connect, args, kwargs):
+        try:
+            self._connection = connect(*args, **kwargs)
+            error = None
+        except:
+            error = sys.exc_info()
+        latency_hist = self._pool._latency_hist
+        while 1:
+            item = self._tasks.get()
+            if item is None:
+                break
+            waiter, func, args, query = item
+            if error:
+                val, exc = None, error
+            else:
+                start = _time()
+                try:
+                    val = func(*args)
+                    exc = None
+                except:
+                    val = None
+                    exc = sys.exc_info()
+                if query:
+                    latency_hist.add(_time() - start)
+            if waiter:
+                self._pool._completed(waiter, val, exc)
+        if self._connection:
+            try:
+                self._connection.close()
+            except:
+                pass
+
+    def _cursor(self):
+        # called in thread
+        return self._connection.cursor()
+
+    def _reset(self, cursor):
+        # called in thread
+        try:
+            cursor.close()
+        finally:
+            self._connection.rollback()
+
+    def submit(self, waiter, func, args, query=False):
+        """Runs 'func(*args)' in thread and delivers result to 'waiter',
+        which is either a coroutine or object with '_fetched' method.
+        """
+        self._tasks.put((waiter, func, args, query))
+
+    @_coroutine
+    def call(self, func, args, query=False):
+        """Must be used with 'yield'. Returns result of 'func(*args)'
+        run in thread.
+        """
+        coro = AsynCoro.cur_coro(self._pool._asyncoro)
+        coro._await_()
+        self.submit(coro, func, args, query)
+        val = yield
+        return val
+
+
+class _DBPoolCursor(object):
+    """Cursor of AsyncDBPool; see 'cursor' in AsyncDBPool.
+
+    Operations are run in thread of cursor's connection. Other
+    attributes (such as 'rowcount' and 'description') are those of
+    (DB-API) cursor.
+    """
+
+    def __init__(self, pool, conn, cursor):
+        self._pool = pool
+        self._conn = conn
+        self._cursor = cursor
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    @_coroutine
+    def execute(self, query, args=None):
+        """Must be used with 'yield' as 'yield cursor.execute(stmt)'.
+        """
+        args = (query,) if args is None else (query, args)
+        return (yield self._conn.call(self._cursor.execute, args, True))
+
+    @_coroutine
+    def executemany(self, query, args):
+        """Must be used with 'yield' as 'yield cursor.executemany(stmt,
+        args)'.
+        """
+        return (yield self._conn.call(self._cursor.executemany, (query, args), True))
+
+    @_coroutine
+    def callproc(self, proc, args=()):
+        """Must be used with 'yield' as 'yield cursor.callproc(proc)'.
+        """
+        return (yield self._conn.call(self._cursor.callproc, (proc, args), True))
+
+    @_coroutine
+    def fetchone(self):
+        """Must be used with 'yield' as 'row = yield cursor.fetchone()'.
+        """
+        return (yield self._conn.call(self._cursor.fetchone, ()))
+
+    @_coroutine
+    def fetchmany(self, size=None):
+        """Must be used with 'yield' as 'rows = yield
+        cursor.fetchmany(size)'.
+        """
+        if size is None:
+            size = self._cursor.arraysize
+        return (yield self._conn.call(self._cursor.fetchmany, (size,)))
+
+    @_coroutine
+    def fetchall(self):
+        """Must be used with 'yield' as 'rows = yield cursor.fetchall()'.
+        """
+        return (yield self._conn.call(self._cursor.fetchall, ()))
+
+    @_coroutine
+    def commit(self):
+        """Must be used with 'yield' as 'yield cursor.commit()'.
+        Commits transaction of cursor's connection.
+        """
+        return (yield self._conn.call(self._conn._connection.commit, ()))
+
+    @_coroutine
+    def rollback(self):
+        """Must be used with 'yield' as 'yield cursor.rollback()'.
+        Rolls back transaction of cursor's connection.
+        """
+        return (yield self._conn.call(self._conn._connection.rollback, ()))
+
+    def stream(self, batch=100):
+        """Returns object to retrieve result of query in batches (with
+        'fetchmany'), e.g.,
+
+        rows = cursor.stream(1000)
+        while True:
+            batch = yield rows.get()
+            if not batch:
+                break
+
+        or 'async for batch in cursor.stream(1000)' in native
+        coroutines. Next batch is fetched while current batch is
+        processed, so large results need not be held in memory.
+        """
+        return _DBStream(self._conn, self._cursor, batch)
+
+    def close(self):
+        """Closes cursor (and rolls back uncommitted changes) and
+        returns its connection to pool. Need not be used with 'yield'.
+        """
+        if self._conn:
+            conn, self._conn = self._conn, None
+            conn.submit(None, conn._reset, (self._cursor,))
+            self._pool._release(conn)
+
+
+class _DBStream(object):
+    """Internal use only. See 'stream' in cursor of AsyncDBPool.
+    """
+
+    def __init__(self, conn, cursor, batch):
+        self._conn = conn
+        self._cursor = cursor
+        self._batch = batch
+        # (rows, exc) of batch fetched, but not yet retrieved
+        self._fetched_batch = None
+        self._done = False
+        self._waiter = None
+        self._conn.submit(self, self._cursor.fetchmany, (self._batch,))
+
+    def _fetched(self, rows, exc):
+        # called by scheduler
+        self._fetched_batch = (rows, exc)
+        if self._waiter:
+            waiter, self._waiter = self._waiter, None
+            waiter._proceed_(None)
+
+    @_coroutine
+    def get(self):
+        """Must be used with 'yield' as 'rows = yield stream.get()'.
+        Returns next batch of rows (list), or empty list when all rows
+        have been retrieved.
+        """
+        if self._done:
+            return []
+        while not self._fetched_batch:
+            self._waiter = AsynCoro.cur_coro(self._conn._pool._asyncoro)
+            yield self._waiter._await_()
+        rows, exc = self._fetched_batch
+        self._fetched_batch = None
+        if exc:
+            self._done = True
+            raise exc[1].with_traceback(exc[2])
+        if rows:
+            self._conn.submit(self, self._cursor.fetchmany, (self._batch,))
+        else:
+            self._done = True
+        return rows
+
+    def __aiter__(self):
+        return self
+
+    @_coroutine
+    def __anext__(self):
+        rows = yield from self.get()
+        if not rows:
+            raise StopAsyncIteration
+        return rows
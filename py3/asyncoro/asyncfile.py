@@ -529,6 +529,7 @@ else:
             else:
                 self._notifier = None
             self._timeout = None
+            self._timeout_id = None
             self._read_task = None
             self._write_task = None
             self._read_coro = None
@@ -565,8 +566,10 @@ else:
                 except (OSError, IOError) as exc:
                     if exc.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
                         return
-                    else:
-                        raise
+                    self._notifier.clear(self, _AsyncPoller._Read)
+                    self._read_coro.throw(*sys.exc_info())
+                    self._read_coro = self._read_task = None
+                    return
                 except:
                     self._notifier.clear(self, _AsyncPoller._Read)
                     self._read_coro.throw(*sys.exc_info())
@@ -610,6 +613,9 @@ else:
             self._read_coro._await_()
             self._read_task = partial_func(_read, size, full)
             self._notifier.add(self, _AsyncPoller._Read)
+            # data may be available already (with edge-triggered notifier, it
+            # won't be reported)
+            self._notifier._run_tasks(self, _AsyncPoller._Read)
 
         def write(self, buf, full=False, timeout=None):
             """Write data in 'buf' to file. If 'full' is True, the function
@@ -631,7 +637,9 @@ else:
                 try:
                     n = os.write(self._fileno, view)
                 except (OSError, IOError) as exc:
-                    if exc.errno in (errno.EAGAIN, errno.EINTR):
+                    if exc.errno == errno.EAGAIN:
+                        return
+                    elif exc.errno == errno.EINTR:
                         n = 0
                     else:
                         self._notifier.clear(self, _AsyncPoller._Write)
@@ -665,6 +673,7 @@ else:
             self._write_coro._await_()
             self._write_task = partial_func(_write, view, 0)
             self._notifier.add(self, _AsyncPoller._Write)
+            self._notifier._run_tasks(self, _AsyncPoller._Write)
 
         def close(self):
             """Close file descriptor.
@@ -768,6 +768,28 @@ class AsynCoro(asyncoro.AsynCoro, metaclass=Singleton):
                             logger.warning('ignoring invalid recipient to "send"')
                 yield conn.send_msg(serialize(reply))
 
+            elif req.name == 'send_many':
+                reply = -1
+                if req.dst != self._location:
+                    logger.warning('ignoring invalid "send_many" (%s != %s)',
+                                   req.dst, self._location)
+                else:
+                    coro = req.kwargs.get('coro', None)
+                    name = req.kwargs.get('name', ' ')
+                    if name[0] == '~':
+                        Coro._asyncoro._lock.acquire()
+                        coro = Coro._asyncoro._coros.get(int(coro), None)
+                        Coro._asyncoro._lock.release()
+                    elif name[0] == '!':
+                        coro = self._coros.get(int(coro))
+                    else:
+                        coro = None
+                    if coro and coro._name == name:
+                        reply = coro.send_many(req.kwargs['messages'])
+                    else:
+                        logger.warning('ignoring invalid recipient to "send_many"')
+                yield conn.send_msg(serialize(reply))
+
             elif req.name == 'deliver':
                 reply = -1
                 if req.dst != self._location:
@@ -780,14 +802,19 @@ class AsynCoro(asyncoro.AsynCoro, metaclass=Singleton):
                             Coro._asyncoro._lock.acquire()
                             coro = Coro._asyncoro._coros.get(int(coro))
                             Coro._asyncoro._lock.release()
-                            if coro and coro.send(req.kwargs['message']) == 0:
-                                reply = 1
                         elif name[0] == '!':
                             coro = self._coros.get(int(coro))
-                            if coro and coro.send(req.kwargs['message']) == 0:
+                        else:
+                            coro = None
+                        if coro:
+                            reply = coro.send(req.kwargs['message'])
+                            if reply == 0:
                                 reply = 1
-                            else:
-                                logger.warning('invalid "deliver" message ignored')
+                            elif reply > 0 or reply == -2:
+                                # mailbox is full; don't block this connection
+                                reply = 0
+                        else:
+                            logger.warning('invalid "deliver" message ignored')
                     else:
                         channel = req.kwargs.get('channel')
                         if channel:
@@ -1263,10 +1290,11 @@ class SysCoro(asyncoro.Coro):
 
     These coroutines run in seperate AsynCoro thread, so if user coroutines
     (Coro instances) take too much CPU time, SysCoro can still respond to such
-    events immediately.
+    events immediately. SysCoro instances have high priority by default.
     """
 
     _asyncoro = None
+    _default_priority = asyncoro.Coro.HighPriority
 
     def __init__(self, *args, **kwargs):
         if not SysCoro._asyncoro: